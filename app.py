@@ -1,6 +1,7 @@
 # Nota: la importación `CATEGORIES` de `sre_parse` estaba provocando
 # DeprecationWarning. No se utiliza en la aplicación, así que la eliminamos.
 from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from werkzeug.utils import secure_filename
 from datetime import datetime
 import sqlite3
 import os
@@ -8,6 +9,7 @@ import secrets
 import threading
 import time
 import json
+import hashlib
 from io import BytesIO
 try:
     import qrcode
@@ -19,18 +21,32 @@ try:
     from xhtml2pdf import pisa
 except Exception:
     pisa = None
-try:
-    import serial
-    import serial.tools.list_ports
-except Exception:
-    serial = None
-    import serial as _serial_disabled  # placeholder
+from app.audit import AuditWriter
+from app.catalogo import directorio, facetas_prefijo, invalidar_facetas, listar_prefijos, prefijo_de
+from app.contadores import resumen as resumen_contadores
+from app.db import get_db, get_pool, init_app as init_db
+from app.escaneos import EstacionInvalida, ScanBus, flujo_sse
+from app import etiquetas
+from app.exportar import EXPORTACIONES, MIME_XLSX
+from app.imagenes import VARIANTES as VARIANTES_LOGO, LogoVariantes
+from app.lectores import GestorEscaneres, disponible as lectores_disponibles, leer_estaciones
+from app.pdf import ErrorPDF, ServicioOcupado, ServicioPDF, con_css
+from app import pdf_nativo
+from app.qr import QRCache, generar_png as generar_qr_png, llave_qr
+from app.search import COLUMNAS_PRODUCTO, buscar_inventario
+from app.secuencias import es_sku_secuencial, reservar_skus, siguiente_numero
+from app.series import buscar_por_serie, serie_existe
+from app.tickets import Artefacto, TicketCache, leer_texto, volcar_debug
+from app.trabajos import ExportJobs
+from app.volcados import FORMATOS, VOLCADOS, consulta_volcado, generar_volcado, normalizar_since, una_vez
 
 # Se especifica la carpeta de archivos estáticos (statics)
 app = Flask(__name__, static_folder='static')
 # SECRET_KEY segura desde entorno o generada aleatoriamente (no determinista)
 app.secret_key = os.environ.get('FLASK_SECRET') or secrets.token_hex(32)
-DB_PATH = r"C:\Users\ROG\PruebaGit\SistemaCCC\inventario_consolidado.db"
+DB_PATH = os.environ.get('DB_PATH') or r"C:\Users\ROG\PruebaGit\SistemaCCC\inventario_consolidado.db"
+# Pool de conexiones por petición (lectura para GET, escritura para el resto)
+init_db(app, DB_PATH)
 
 CATEGORIAS = {
     "ANT": "Antenas",
@@ -54,134 +70,72 @@ CATEGORIAS = {
 }
 
 
-def log_movimiento(usuario, accion, rowid_producto=None, sku=None, detalles=None, max_retries=5, retry_delay=0.12):
-    """Guarda un registro en movimientos con reintentos si la BD está bloqueada."""
-    detalles_json = json.dumps(detalles, ensure_ascii=False) if detalles is not None else None
-    attempt = 0
-    while attempt <= max_retries:
-        try:
-            conn = sqlite3.connect(DB_PATH, timeout=5)
-            cur = conn.cursor()
-            try:
-                cur.execute("PRAGMA busy_timeout=4000")
-                cur.execute("PRAGMA journal_mode=WAL")
-            except Exception:
-                pass
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS movimientos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario TEXT,
-                    accion TEXT,
-                    rowid_producto INTEGER,
-                    sku TEXT,
-                    detalles TEXT,
-                    cuando TEXT
-                )
-                """
-            )
-            cur.execute(
-                "INSERT INTO movimientos (usuario, accion, rowid_producto, sku, detalles, cuando) VALUES (?,?,?,?,?,?)",
-                (usuario, accion, rowid_producto, sku, detalles_json, datetime.now().isoformat())
-            )
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.OperationalError as oe:
-            if 'locked' in str(oe).lower():
-                attempt += 1
-                if attempt > max_retries:
-                    try:
-                        print(f"[WARN] log_movimiento abandonado por lock: accion={accion} sku={sku}")
-                    except Exception:
-                        pass
-                    return False
-                time.sleep(retry_delay)
-                continue
-            else:
-                try:
-                    print(f"[WARN] log_movimiento fallo operativo: {oe}")
-                except Exception:
-                    pass
-                return False
-        except Exception as e:
-            try:
-                print(f"[WARN] log_movimiento excepción: {e}")
-            except Exception:
-                pass
-            return False
-
-
-def get_db():
-    """Devuelve una conexión SQLite con configuración segura.
-    Uso recomendado: with get_db() as conn:
-    """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Escritor asíncrono: las rutas encolan y un hilo confirma por lotes
+audit_writer = AuditWriter(get_pool().acquire)
+audit_writer.start()
+
+# Exportaciones XLSX en segundo plano; los artefactos se reutilizan si la BD no cambió
+EXPORT_DIR = os.environ.get('EXPORT_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports')
+EXPORT_ESPERA = 120  # segundos que esperan las rutas /exportar_* clásicas
+export_jobs = ExportJobs(get_pool(readonly=True), EXPORT_DIR)
+export_jobs.start()
+
+# Tickets PDF/HTML ya generados (direccionados por contenido) y depuración opcional
+TICKETS_CACHE_DIR = os.environ.get('TICKETS_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tickets')
+TICKET_DEBUG = os.environ.get('TICKET_DEBUG', '').lower() in ('1', 'true', 'si')
+ticket_cache = TicketCache(TICKETS_CACHE_DIR)
+LOTES_TICKETS_DIR = os.path.join(TICKETS_CACHE_DIR, 'lotes')  # PDF con todos los tickets de un evento
+ETIQUETAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'etiquetas')
+ETIQUETAS_GUARDADAS = 10  # hojas de etiquetas que se conservan para reimprimir
+
+# PDF (xhtml2pdf) en un pool de procesos para no acaparar el GIL de los hilos de waitress
+PDF_PROCESOS = int(os.environ.get('PDF_PROCESOS') or 0) or None  # por omisión, uno por núcleo
+PDF_TIMEOUT = 60
+pdf_service = ServicioPDF(procesos=PDF_PROCESOS, timeout=PDF_TIMEOUT)
+# Motor por omisión de tickets y reporte ('reportlab' nativo o 'xhtml2pdf'); ?motor= lo cambia por petición
+PDF_MOTOR = (os.environ.get('PDF_MOTOR') or 'reportlab').lower()
+
+# Variantes del logo (QR, encabezado de PDF, web) generadas una sola vez
+logos = LogoVariantes(os.path.join(app.static_folder, 'images', 'CCClogo.jpg'),
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'imagenes'))
+logos.preparar()
+
+# PNG de QR ya generados (LRU en memoria; lo desalojado se derrama a disco)
+QR_CACHE_DIR = os.environ.get('QR_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'qr')
+qr_cache = QRCache(max_entradas=512, directorio=QR_CACHE_DIR)
+QR_MAX_AGE = 7 * 24 * 3600
+
+
+@app.template_global()
+def logo_url(variante='web'):
+    """URL versionada de una variante del logo (cae al original si no hay variantes)."""
+    if logos.datos(variante) is None:
+        return url_for('static', filename='images/CCClogo.jpg')
+    return url_for('logo_variante', variante=variante, v=logos.etag(variante))
+
+
+@app.route('/logo/<variante>')
+def logo_variante(variante):
+    datos = logos.datos(variante) if variante in VARIANTES_LOGO else None
+    if datos is None:
+        return "Not found", 404
+    resp = app.response_class(datos, mimetype=logos.mimetype(variante))
+    resp.set_etag(logos.etag(variante))
+    # La URL lleva la huella (?v=), así que puede guardarse indefinidamente
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp.make_conditional(request)
+
+
+def log_movimiento(usuario, accion, rowid_producto=None, sku=None, detalles=None):
+    """Encola un registro para movimientos; la escritura ocurre en segundo plano."""
     try:
-        conn.execute("PRAGMA busy_timeout=4000")
-        conn.execute("PRAGMA journal_mode=WAL")
-    except Exception:
-        pass
-    return conn
-
-def ensure_ventas_table():
-    """Garantiza que la tabla ventas exista con todas las columnas necesarias."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS ventas (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        rowid_producto INTEGER,
-        sku TEXT,
-        tipo TEXT,
-        marca TEXT,
-        modelo TEXT,
-        no_serie TEXT,
-        precio_venta REAL,
-        comprador TEXT,
-        vendedor TEXT,
-        observaciones TEXT,
-        fecha_venta TEXT,
-        evento_fecha TEXT,
-        ticket_id INTEGER
-    )""")
-    # Verificar columnas faltantes (por migraciones anteriores parciales)
-    cur.execute("PRAGMA table_info(ventas)")
-    cols = {r[1] for r in cur.fetchall()}
-    required = ["rowid_producto","sku","tipo","marca","modelo","no_serie","precio_venta","comprador","vendedor","observaciones","fecha_venta","evento_fecha","ticket_id"]
-    for col in required:
-        if col not in cols:
-            # Intentar agregar si falta (tipo REAL/TEXT flexible según campo)
-            tipo_sql = "TEXT"
-            if col in ("precio_venta"): tipo_sql = "REAL"
-            if col == "ticket_id": tipo_sql = "INTEGER"
-            cur.execute(f"ALTER TABLE ventas ADD COLUMN {col} {tipo_sql}")
-    conn.commit()
-    conn.close()
-
-
-def ensure_venta_tickets_table():
-    """Tabla que agrupa varias partidas de venta bajo un solo ticket."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS venta_tickets (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        comprador TEXT,
-        vendedor TEXT,
-        observaciones TEXT,
-        fecha_venta TEXT,
-        evento_fecha TEXT,
-        total REAL,
-        total_items INTEGER
-    )""")
-    conn.commit()
-    conn.close()
-
-
-def ensure_ticket_support():
-    """Conveniencia para garantizar que ventas y tickets estén listos."""
-    ensure_ventas_table()
-    ensure_venta_tickets_table()
+        return audit_writer.submit(usuario, accion, rowid_producto, sku, detalles)
+    except Exception as e:
+        try:
+            print(f"[WARN] log_movimiento excepción: {e}")
+        except Exception:
+            pass
+        return False
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -192,7 +146,7 @@ def login():
         usuario = request.form["usuario"]
         password = request.form["password"]
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT * FROM usuarios WHERE usuario=? AND password=?", (usuario, password))
         user = cur.fetchone()
@@ -239,29 +193,16 @@ def admin():
         usuario = usuario
     # Intentar leer datos reales desde la BD
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
 
-        # Total productos
-        cur.execute("SELECT COUNT(*) FROM inventory")
-        total_productos = cur.fetchone()[0] or 0
-
-        # Total categorías (prefijo del SKU antes del guion)
-        cur.execute(
-            "SELECT COUNT(DISTINCT(CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END)) FROM inventory"
-        )
-        total_categorias = cur.fetchone()[0] or 0
-
-        # Entradas recientes (últimos 7 días) — si fecha_registro está presente
-        entradas_recientes = 0
-        try:
-            cur.execute("SELECT COUNT(*) FROM inventory WHERE (julianday('now') - julianday(fecha_registro)) <= 7")
-            entradas_recientes = cur.fetchone()[0] or 0
-        except Exception:
-            entradas_recientes = 0
-
-        # Salidas: no existe tabla de movimientos, por ahora 0
-        salidas_recientes = 0
+        # Totales, categorías y entradas/salidas de los últimos 7 días (stats_counters)
+        cifras = resumen_contadores(cur, dias=7)
+        total_productos = cifras['total_productos']
+        total_categorias = cifras['total_categorias']
+        entradas_recientes = cifras['entradas_recientes']
+        salidas_recientes = cifras['salidas_recientes']
+        total_usuarios = cifras['total_usuarios']
 
         # Actividad reciente: últimos 9 registros por orden de inserción (rowid)
         recent_activity = []
@@ -282,13 +223,6 @@ def admin():
         except Exception:
             recent_activity = []
 
-        # Total usuarios
-        try:
-            cur.execute("SELECT COUNT(*) FROM usuarios")
-            total_usuarios = cur.fetchone()[0] or 0
-        except Exception:
-            total_usuarios = 0
-
         conn.close()
     except Exception:
         total_productos = 0
@@ -319,6 +253,9 @@ def invitado():
 def entradas():
     # Obtener el prefijo y los campos mantenidos (para casos de error)
     prefijo_mantener = request.args.get('prefijo', '')
+    # SKU guardado en el registro anterior (puede diferir de la vista previa)
+    registrado = request.args.get('registrado', '')
+    vista_previa = request.args.get('vista_previa', '')
     
     # También obtener valores de campos mantenidos si vienen en los parámetros
     # (esto pasa cuando hay error de validación)
@@ -332,10 +269,9 @@ def entradas():
     
     # Mostrar formulario para registrar nuevas entradas
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        cur.execute("SELECT DISTINCT(CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END) as pref FROM inventory ORDER BY pref")
-        prefs = [r[0] for r in cur.fetchall()]
+        prefs = listar_prefijos(cur)
         conn.close()
     except Exception:
         prefs = []
@@ -343,6 +279,8 @@ def entradas():
     # Pasar todos los valores a la plantilla
     return render_template("entradas.html", 
                          prefixes=prefs, 
+                         registrado=registrado,
+                         vista_previa=vista_previa,
                          prefijo_mantener=prefijo_mantener,
                          tipo_mantener=tipo_mantener,
                          marca_mantener=marca_mantener,
@@ -358,15 +296,14 @@ def entradas_options():
     if not pref:
         return jsonify({'ok': False, 'msg': 'prefijo requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        like_pat = f"{pref}-%"
-        data = {}
-        for col in ('tipo','marca','modelo','estado','ubicacion','volts'):
-            cur.execute(f"SELECT DISTINCT {col} FROM inventory WHERE sku LIKE ? AND {col} IS NOT NULL AND {col}!='' LIMIT 200", (like_pat,))
-            data[col] = [r[0] for r in cur.fetchall() if r[0] is not None]
+        # Una consulta por prefijo (cacheada); valores ordenados por frecuencia
+        facetas = facetas_prefijo(cur, pref)
         conn.close()
-        return jsonify({'ok': True, 'data': data})
+        data = {col: [valor for valor, _ in pares] for col, pares in facetas.items()}
+        conteos = {col: [[valor, n] for valor, n in pares] for col, pares in facetas.items()}
+        return jsonify({'ok': True, 'data': data, 'conteos': conteos})
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
@@ -375,22 +312,15 @@ def entradas_options():
 def entradas_skus():
     pref = request.args.get('prefijo', '').strip()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         if pref:
             # Return SKUs for the given prefix (detailed rows)
-            cur.execute("SELECT rowid, sku, tipo, marca, modelo FROM inventory WHERE sku LIKE ? ORDER BY sku LIMIT 500", (f"{pref}-%",))
+            cur.execute("SELECT rowid, sku, tipo, marca, modelo FROM inventory WHERE prefijo = ? COLLATE NOCASE ORDER BY sku LIMIT 500", (pref,))
+            rows = cur.fetchall()
         else:
-            # No prefijo: return a directory of SKU prefixes (part before '-') with one representative tipo per prefix.
-            # Extract prefix = part before first '-' (or whole sku if no dash).
-            cur.execute("""
-                SELECT pref, tipo FROM (
-                  SELECT CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END AS pref,
-                         tipo
-                  FROM inventory
-                ) GROUP BY pref ORDER BY pref LIMIT 2000
-            """)
-        rows = cur.fetchall()
+            # No prefijo: return the directory of SKU prefixes (part before '-') with one representative tipo per prefix.
+            rows = directorio(cur, limit=2000)
         conn.close()
         if pref:
             data = [{'rowid': r[0], 'sku': r[1], 'tipo': r[2], 'marca': r[3], 'modelo': r[4]} for r in rows]
@@ -407,7 +337,7 @@ def product_by_sku():
     if not sku:
         return jsonify({'ok': False, 'msg': 'sku requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, estado, ubicacion, fecha_registro, observacion FROM inventory WHERE sku = ? LIMIT 1", (sku,))
         row = cur.fetchone()
@@ -421,27 +351,40 @@ def product_by_sku():
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
 
+@app.route('/product_by_serial')
+def product_by_serial():
+    no = request.args.get('no', '').strip()
+    if not no:
+        return jsonify({'ok': False, 'msg': 'no requerido'}), 400
+    try:
+        conn = get_db()
+        cur = conn.cursor()
+        cols = "rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, estado, ubicacion, fecha_registro, observacion"
+        rows = buscar_por_serie(cur, no, limit=2, columnas=cols)
+        conn.close()
+        if not rows:
+            return jsonify({'ok': False, 'msg': 'not found'}), 404
+        keys = ['rowid','sku','id_original','tipo','marca','modelo','no_serie','volts','precio','estado','ubicacion','fecha_registro','observacion']
+        data = dict(zip(keys, rows[0]))
+        # 'unico' en False indica que la serie está repetida en inventario
+        return jsonify({'ok': True, 'data': data, 'unico': len(rows) == 1})
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 500
+
+
 @app.route('/entradas/next_sku')
 def entradas_next_sku():
     pref = request.args.get('prefijo', '').strip()
     if not pref:
         return jsonify({'ok': False, 'msg': 'prefijo requerido'}), 400
     try:
-        # Normalize prefix: remove trailing '-' if present and compare case-insensitively
+        # Normalize prefix: remove trailing '-' if present (sku_sequences compares case-insensitively)
         pref_clean = pref.rstrip('-')
-        pref_lower = pref_clean.lower()
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        # Use lower(sku) to match prefix case-insensitively and extract numeric suffix
-        cur.execute(
-            "SELECT MAX(CAST(substr(sku, instr(sku,'-')+1) AS INTEGER)) "
-            "FROM inventory WHERE lower(sku) LIKE ?",
-            (f"{pref_lower}-%",)
-        )
-        r = cur.fetchone()
+        # Consulta sin reservar; el número definitivo se asigna al registrar
+        nextnum = siguiente_numero(cur, pref_clean)
         conn.close()
-        maxnum = r[0] if r and r[0] is not None else 0
-        nextnum = int(maxnum or 0) + 1
         next_sku = f"{pref_clean}-{nextnum}"
         return jsonify({'ok': True, 'next_sku': next_sku, 'next_number': nextnum})
     except Exception as e:
@@ -472,25 +415,23 @@ def entradas_register():
     # ---------------- VALIDACIÓN DE DUPLICADO ----------------
     if no_serie:
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_db()
             cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM inventory WHERE no_serie = ?", (no_serie,))
-            exists_count = cur.fetchone()[0]
+            duplicado = serie_existe(cur, no_serie)
             conn.close()
 
-            if exists_count and exists_count > 0:
+            if duplicado:
                 try:
-                    conn = sqlite3.connect(DB_PATH)
+                    conn = get_db()
                     cur = conn.cursor()
-                    cur.execute("SELECT DISTINCT(CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END) as pref FROM inventory ORDER BY pref")
-                    prefs = [r[0] for r in cur.fetchall()]
+                    prefs = listar_prefijos(cur)
                     conn.close()
                 except Exception:
                     prefs = []
 
                 # ✅ PRESERVAR LOS CAMPOS MANTENIDOS CUANDO HAY ERROR
                 form_values = {
-                    'prefijo': sku.split('-')[0] if '-' in sku else sku,
+                    'prefijo': prefijo_de(sku),
                     'tipo': tipo if 'tipo' in campos_mantenidos else '',
                     'marca': marca if 'marca' in campos_mantenidos else '',
                     'modelo': modelo if 'modelo' in campos_mantenidos else '',
@@ -509,8 +450,15 @@ def entradas_register():
 
     # ---------------- INSERTAR PRODUCTO ----------------
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
+        # El SKU autogenerado del formulario (campo de solo lectura) es solo una
+        # vista previa: el número definitivo se reserva aquí, en la misma
+        # transacción que el INSERT, para que dos capturas simultáneas del mismo
+        # prefijo no choquen. El SKU guardado se muestra al volver al formulario.
+        vista_previa = sku
+        if es_sku_secuencial(sku):
+            sku = reservar_skus(cur, prefijo_de(sku))[0]
         cur.execute(
             "INSERT INTO inventory (sku, id_original, tipo, marca, modelo, no_serie, volts, precio, estado, ubicacion, fecha_registro, origen_hoja, observacion, extras) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
             (sku, id_original, tipo, marca, modelo, no_serie, volts, precio, estado, ubicacion, fecha_registro, None, observacion, None)
@@ -518,6 +466,7 @@ def entradas_register():
         lastid = cur.lastrowid
         conn.commit()
         conn.close()
+        invalidar_facetas(prefijo_de(sku))
 
         # Registrar movimiento
         try:
@@ -527,10 +476,10 @@ def entradas_register():
             pass
 
         # ✅ CORRECTO: Solo mantener el prefijo
-        prefijo = sku.split('-')[0] if '-' in sku else sku
+        prefijo = prefijo_de(sku)
         
-        # Redirigir solo con el prefijo
-        return redirect(url_for('entradas') + '?prefijo=' + prefijo)
+        # Redirigir con el prefijo y el SKU realmente guardado
+        return redirect(url_for('entradas', prefijo=prefijo, registrado=sku, vista_previa=vista_previa))
 
     except Exception as e:
         return f"Error al insertar: {e}", 500
@@ -542,13 +491,10 @@ def categorias_list():
     # Build categories from inventory prefixes and optional overrides stored in DB
     categorias_map = {}
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        # ensure categorias table exists
-        cur.execute("CREATE TABLE IF NOT EXISTS categorias_prefijos (prefijo TEXT PRIMARY KEY, nombre TEXT)")
-        # get distinct prefixes from inventory
-        cur.execute("SELECT DISTINCT(CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END) as pref FROM inventory ORDER BY pref")
-        prefs = [r[0] for r in cur.fetchall()]
+        # prefixes from the materialized category directory
+        prefs = listar_prefijos(cur)
         # load overrides
         cur.execute("SELECT prefijo, nombre FROM categorias_prefijos")
         overrides = {r[0]: r[1] for r in cur.fetchall()}
@@ -573,9 +519,8 @@ def categorias_update():
     if not prefijo:
         return jsonify({'ok': False, 'msg': 'prefijo requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS categorias_prefijos (prefijo TEXT PRIMARY KEY, nombre TEXT)")
         cur.execute("INSERT INTO categorias_prefijos(prefijo,nombre) VALUES(?,?) ON CONFLICT(prefijo) DO UPDATE SET nombre=excluded.nombre", (prefijo, nombre))
         conn.commit()
         conn.close()
@@ -590,21 +535,17 @@ def productos_por_categoria(prefijo):
     nombre_categoria = CATEGORIAS.get(prefijo, prefijo)
 
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        # Usamos la tabla `inventory` y seleccionamos todas las columnas relevantes
-        base_query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                  "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                  "FROM inventory WHERE sku LIKE ?")
-        parametros.append(f"{prefijo}-%")
-
         if q:
-            base_query += " AND (sku LIKE ? OR marca LIKE ? OR modelo LIKE ? OR observacion LIKE ? OR id_original LIKE ? )"
-            like_q = f"%{q}%"
-            parametros.extend([like_q, like_q, like_q, like_q, like_q])
-
-        cur.execute(base_query, parametros)
-        productos = cur.fetchall()
+            # Búsqueda de texto (FTS5) limitada a la categoría
+            productos = buscar_inventario(cur, q, prefijo=prefijo, limit=None)
+        else:
+            # Usamos la tabla `inventory` y seleccionamos todas las columnas relevantes
+            base_query = f"SELECT {COLUMNAS_PRODUCTO} FROM inventory WHERE prefijo = ? COLLATE NOCASE"
+            parametros.append(prefijo)
+            cur.execute(base_query, parametros)
+            productos = cur.fetchall()
         conn.close()
     except Exception:
         # En caso de fallo con la BD, devolver ejemplo estático
@@ -621,26 +562,19 @@ def productos_all():
     q = request.args.get('q', '').strip()
     search_field = request.args.get('search_field', '').strip()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         if q:
             if search_field == 'no_serie':
-                # Búsqueda exacta por número de serie
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE no_serie = ? LIMIT 1000")
-                cur.execute(query, (q,))
+                # Búsqueda exacta por número de serie (normalizado)
+                productos = buscar_por_serie(cur, q, limit=1000)
             else:
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE sku LIKE ? OR marca LIKE ? OR modelo LIKE ? OR observacion LIKE ? OR id_original LIKE ? LIMIT 1000")
-                like_q = f"%{q}%"
-                cur.execute(query, (like_q, like_q, like_q, like_q, like_q))
+                productos = buscar_inventario(cur, q, limit=1000)
         else:
             query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
                      "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras FROM inventory LIMIT 1000")
             cur.execute(query)
-        productos = cur.fetchall()
+            productos = cur.fetchall()
         conn.close()
     except Exception:
         # Si hay algún problema con la BD, mostramos datos simulados
@@ -689,8 +623,10 @@ def editar_producto(rowid):
         observacion = request.form.get('observacion')
 
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_db()
             cur = conn.cursor()
+            cur.execute("SELECT sku FROM inventory WHERE rowid=?", (rowid,))
+            anterior = cur.fetchone()
             cur.execute(
                 """
                 UPDATE inventory SET sku=?, id_original=?, tipo=?, marca=?, modelo=?, no_serie=?, volts=?, precio=?, estado=?, ubicacion=?, fecha_registro=?, observacion=?
@@ -700,6 +636,7 @@ def editar_producto(rowid):
             )
             conn.commit()
             conn.close()
+            invalidar_facetas(prefijo_de(sku), prefijo_de(anterior[0]) if anterior else None)
             # Registrar edición en movimientos
             try:
                 detalles = {'observacion': observacion}
@@ -714,7 +651,7 @@ def editar_producto(rowid):
 
     # GET: obtener datos actuales del producto
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute(
             "SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, estado, ubicacion, fecha_registro, origen_hoja, observacion, extras FROM inventory WHERE rowid=?",
@@ -756,7 +693,7 @@ def salidas():
     q = request.args.get('q', '').strip()
     search_field = request.args.get('search_field', '').strip()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         # Productos que están en VENTA y tienen precio (VERSIÓN ORIGINAL QUE SÍ FUNCIONA)
         cur.execute(("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
@@ -768,17 +705,9 @@ def salidas():
         search_results = []
         if q:
             if search_field == 'no_serie':
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE no_serie = ? LIMIT 1000")
-                cur.execute(query, (q,))
+                search_results = buscar_por_serie(cur, q, limit=1000)
             else:
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE sku LIKE ? OR marca LIKE ? OR modelo LIKE ? OR observacion LIKE ? OR id_original LIKE ? LIMIT 1000")
-                like_q = f"%{q}%"
-                cur.execute(query, (like_q, like_q, like_q, like_q, like_q))
-            search_results = cur.fetchall()
+                search_results = buscar_inventario(cur, q, limit=1000)
 
         conn.close()
     except Exception:
@@ -803,8 +732,7 @@ def registrar_venta():
         return jsonify({'ok': False, 'msg': 'Precio inválido'}), 400
     
     try:
-        ensure_ticket_support()
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
         # Obtener información del producto
@@ -856,6 +784,7 @@ def registrar_venta():
         
         conn.commit()
         conn.close()
+        invalidar_facetas(prefijo_de(sku))
         
         # Registrar movimiento
         try:
@@ -889,8 +818,7 @@ def registrar_ventas_bulk():
         if not fecha_evento:
             return jsonify({'ok': False, 'msg': 'Fecha de evento requerida'}), 400
 
-        ensure_ticket_support()
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT estado FROM venta_eventos WHERE fecha=?", (fecha_evento,))
         ev = cur.fetchone()
@@ -965,6 +893,7 @@ def registrar_ventas_bulk():
                 })
 
             conn.commit()
+            invalidar_facetas(*{prefijo_de(item['sku']) for item in prepared_items})
             try:
                 print(f"[DEBUG] registrar_ventas_bulk: inserted_ids={inserted_ids} ticket_id={ticket_id} comprador={comprador} evento_fecha={fecha_evento}")
             except Exception:
@@ -995,7 +924,7 @@ def salidas_mark_sold():
     if not rowid:
         return jsonify({'ok': False, 'msg': 'rowid requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         # obtener info para log
         cur.execute("SELECT sku, precio FROM inventory WHERE rowid=?", (rowid,))
@@ -1006,6 +935,7 @@ def salidas_mark_sold():
         cur.execute("UPDATE inventory SET estado='VENDIDO' WHERE rowid=?", (rowid,))
         conn.commit()
         conn.close()
+        invalidar_facetas(prefijo_de(sku))
         # Registrar movimiento
         try:
             log_movimiento(session.get('usuario'), 'VENDIDO', rowid, sku, {'precio': precio})
@@ -1026,7 +956,7 @@ def salidas_mark_out():
     if accion == 'BASURA':
         accion = 'OBSOLETO'
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT sku FROM inventory WHERE rowid=?", (rowid,))
         r = cur.fetchone()
@@ -1034,6 +964,7 @@ def salidas_mark_out():
         cur.execute("UPDATE inventory SET estado=? WHERE rowid=?", (accion, rowid))
         conn.commit()
         conn.close()
+        invalidar_facetas(prefijo_de(sku))
         try:
             log_movimiento(session.get('usuario'), accion, rowid, sku, None)
         except Exception:
@@ -1049,7 +980,7 @@ def venta():
     q = request.args.get('q', '').strip()
     search_field = request.args.get('search_field', '').strip()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         # A) productos que ya están en estado VENTA
         cur.execute(("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
@@ -1061,20 +992,11 @@ def venta():
         search_results = []
         if q:
             if search_field == 'no_serie':
-                # Búsqueda exacta por número de serie
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE no_serie = ? AND estado != 'VENTA' LIMIT 1000")
-                cur.execute(query, (q,))
+                # Búsqueda exacta por número de serie (normalizado)
+                search_results = buscar_por_serie(cur, q, excluir_estado='VENTA', limit=1000)
             else:
                 # Búsqueda general excluyendo productos ya en VENTA
-                query = ("SELECT rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                         "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                         "FROM inventory WHERE (sku LIKE ? OR marca LIKE ? OR modelo LIKE ? OR observacion LIKE ? OR id_original LIKE ?) "
-                         "AND estado != 'VENTA' LIMIT 1000")
-                like_q = f"%{q}%"
-                cur.execute(query, (like_q, like_q, like_q, like_q, like_q))
-            search_results = cur.fetchall()
+                search_results = buscar_inventario(cur, q, excluir_estado='VENTA', limit=1000)
 
         conn.close()
     except Exception as e:
@@ -1099,13 +1021,15 @@ def venta_update_status():
         if not ids:
             return redirect(url_for('venta'))
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_db()
             cur = conn.cursor()
+            prefijos = set()
             for rid in ids:
                 # obtener sku para el log
                 cur.execute("SELECT sku FROM inventory WHERE rowid=?", (rid,))
                 r = cur.fetchone()
                 sku = r[0] if r else None
+                prefijos.add(prefijo_de(sku))
                 if precio:
                     cur.execute("UPDATE inventory SET estado='VENTA', precio=? WHERE rowid=?", (precio, rid))
                 else:
@@ -1116,6 +1040,7 @@ def venta_update_status():
                     pass
             conn.commit()
             conn.close()
+            invalidar_facetas(*prefijos)
         except Exception:
             pass
         return redirect(url_for('venta'))
@@ -1124,7 +1049,7 @@ def venta_update_status():
         return redirect(url_for('venta'))
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
         if scope == 'category':
@@ -1133,19 +1058,17 @@ def venta_update_status():
             r = cur.fetchone()
             if r and r[0]:
                 sku = r[0]
-                if '-' in sku: 
-                    pref = sku.split('-')[0]
-                else:
-                    pref = sku
+                pref = prefijo_de(sku)
                 
                 # Actualizar todos los productos de la categoría
                 if precio:
-                    cur.execute("UPDATE inventory SET estado='VENTA', precio=? WHERE sku LIKE ?", (precio, f"{pref}-%"))
+                    cur.execute("UPDATE inventory SET estado='VENTA', precio=? WHERE prefijo = ? COLLATE NOCASE", (precio, pref))
                 else:
-                    cur.execute("UPDATE inventory SET estado='VENTA' WHERE sku LIKE ?", (f"{pref}-%",))
+                    cur.execute("UPDATE inventory SET estado='VENTA' WHERE prefijo = ? COLLATE NOCASE", (pref,))
                 
                 conn.commit()
                 conn.close()
+                invalidar_facetas(pref)
                 try:
                     log_movimiento(session.get('usuario'), 'PONER_VENTA_CATEGORIA', None, pref, {'precio': precio})
                 except Exception:
@@ -1164,6 +1087,7 @@ def venta_update_status():
         
         conn.commit()
         conn.close()
+        invalidar_facetas(prefijo_de(sku))
         try:
             log_movimiento(session.get('usuario'), 'PONER_VENTA', rowid, sku, {'precio': precio})
         except Exception:
@@ -1183,7 +1107,7 @@ def venta_update_price():
     if not rowid or not precio:
         return redirect(url_for('venta'))
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         if scope == 'category':
             # obtener sku del producto para extraer prefijo
@@ -1191,22 +1115,23 @@ def venta_update_price():
             r = cur.fetchone()
             if r and r[0]:
                 sku = r[0]
-                if '-' in sku: 
-                    pref = sku.split('-')[0]
-                else:
-                    pref = sku
-                cur.execute("UPDATE inventory SET precio=? WHERE sku LIKE ?", (precio, f"{pref}-%"))
+                pref = prefijo_de(sku)
+                cur.execute("UPDATE inventory SET precio=? WHERE prefijo = ? COLLATE NOCASE", (precio, pref))
                 conn.commit()
                 conn.close()
+                invalidar_facetas(pref)
                 try:
                     log_movimiento(session.get('usuario'), 'CAMBIAR_PRECIO_CATEGORIA', None, pref, {'precio': precio})
                 except Exception:
                     pass
                 return redirect(url_for('venta'))
         else:
+            cur.execute("SELECT sku FROM inventory WHERE rowid=?", (rowid,))
+            r = cur.fetchone()
             cur.execute("UPDATE inventory SET precio=? WHERE rowid=?", (precio, rowid))
             conn.commit()
             conn.close()
+            invalidar_facetas(prefijo_de(r[0]) if r else None)
             try:
                 log_movimiento(session.get('usuario'), 'CAMBIAR_PRECIO', rowid, None, {'precio': precio})
             except Exception:
@@ -1220,7 +1145,7 @@ def venta_update_price():
 @app.route("/historial")
 def historial():
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT usuario, accion, sku, detalles, cuando FROM movimientos ORDER BY id DESC LIMIT 200")
         rows = cur.fetchall()
@@ -1256,7 +1181,7 @@ def historial():
 @app.route("/usuarios")
 def usuarios():
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT id, usuario, nivel FROM usuarios ORDER BY usuario")
         usuarios_db = cur.fetchall()
@@ -1289,7 +1214,7 @@ def agregar_usuario():
         if not usuario or not password:
             return jsonify({'success': False, 'message': 'Usuario y contraseña son requeridos'})
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
         # Verificar si el usuario ya existe
@@ -1323,7 +1248,7 @@ def editar_usuario():
         password = request.form.get('password', '').strip()
         nivel = 1  # Siempre será Administrador
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
         # Verificar si el usuario existe
@@ -1362,7 +1287,7 @@ def eliminar_usuario():
         
         # Prevenir eliminación del usuario actual
         usuario_actual = session.get('usuario')
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
         cur.execute("SELECT usuario FROM usuarios WHERE id = ?", (user_id,))
@@ -1391,8 +1316,6 @@ def eliminar_usuario():
         return jsonify({'success': False, 'message': f'Error del servidor: {str(e)}'})
 
 
-import pandas as pd
-import io
 from flask import send_file
 import sqlite3
 from datetime import datetime
@@ -1410,22 +1333,13 @@ def config():
     }
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         
-        # Obtener estadísticas
-        cur.execute("SELECT COUNT(*) FROM inventory")
-        settings["total_productos"] = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM usuarios")
-        settings["total_usuarios"] = cur.fetchone()[0]
-        
-        cur.execute("SELECT COUNT(*) FROM movimientos")
-        settings["total_movimientos"] = cur.fetchone()[0]
-        
-        # Obtener total de ventas
-        cur.execute("SELECT COUNT(*) FROM ventas")
-        settings["total_ventas"] = cur.fetchone()[0]
+        # Obtener estadísticas (contadores mantenidos por triggers)
+        cifras = resumen_contadores(cur)
+        for clave in ("total_productos", "total_usuarios", "total_movimientos", "total_ventas"):
+            settings[clave] = cifras[clave]
         
         conn.close()
     except Exception as e:
@@ -1433,45 +1347,146 @@ def config():
     
     return render_template("config.html", settings=settings)
 
+
+@app.route("/audit/stats")
+def audit_stats():
+    """Profundidad de la cola y latencia de commit del escritor de movimientos."""
+    return jsonify({'ok': True, 'stats': audit_writer.stats()})
+
+def _trabajo_publico(trabajo):
+    """Campos del trabajo de exportación que se exponen por JSON."""
+    datos = {k: v for k, v in trabajo.items() if k not in ('archivo', 'llave')}
+    datos['url_estado'] = url_for('exportar_trabajo_estado', trabajo_id=trabajo['id'])
+    if trabajo['estado'] == 'listo':
+        datos['url_descarga'] = url_for('exportar_trabajo_archivo', trabajo_id=trabajo['id'])
+    return datos
+
+
+def _enviar_artefacto(trabajo):
+    """Sirve el archivo ya generado y registra la exportación."""
+    info = EXPORTACIONES[trabajo['tipo']]
+    detalles = {'archivo': trabajo['descarga'], 'registros': trabajo['registros'] or None,
+                'reutilizado': trabajo['reutilizado']}
+    if trabajo['tipo'] == 'respaldo':
+        detalles['tablas'] = list(info['tablas'])
+    detalles.update(trabajo['params'])
+    try:
+        log_movimiento(session.get('usuario'), info['accion'], None, None, detalles)
+    except Exception:
+        pass
+    return send_file(trabajo['archivo'], as_attachment=True, download_name=trabajo['descarga'],
+                     mimetype=MIME_XLSX, conditional=True, max_age=0)
+
+
+def _exportar_excel(tipo, params=None):
+    """Rutas clásicas /exportar_*: usan la cola y esperan el artefacto.
+
+    La generación ocurre en el hilo de exportaciones (y se reutiliza si la BD
+    no cambió); si tarda más de EXPORT_ESPERA segundos se responde 202 con el
+    trabajo para consultarlo después.
+    """
+    trabajo = export_jobs.submit(tipo, params)
+    trabajo = export_jobs.wait(trabajo['id'], timeout=EXPORT_ESPERA)
+    if trabajo['estado'] == 'listo':
+        return _enviar_artefacto(trabajo)
+    if trabajo['estado'] == 'error':
+        return f"Error al exportar: {trabajo['error']}", 500
+    return jsonify({'ok': True, 'trabajo': _trabajo_publico(trabajo)}), 202
+
+
+@app.route("/exportar/trabajos", methods=["POST"])
+def exportar_trabajo_crear():
+    datos = request.get_json(silent=True) or request.form
+    tipo = (datos.get('tipo') or '').strip()
+    params = {}
+    if tipo == 'categoria':
+        params = {'prefijo': (datos.get('prefijo') or '').strip(), 'q': (datos.get('q') or '').strip()}
+        if not params['prefijo']:
+            return jsonify({'ok': False, 'msg': 'prefijo requerido'}), 400
+    if tipo not in EXPORTACIONES:
+        return jsonify({'ok': False, 'msg': 'tipo de exportación inválido'}), 400
+    try:
+        trabajo = export_jobs.submit(tipo, params)
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 500
+    return jsonify({'ok': True, 'trabajo': _trabajo_publico(trabajo)}), 202
+
+
+@app.route("/exportar/trabajos/<trabajo_id>")
+def exportar_trabajo_estado(trabajo_id):
+    trabajo = export_jobs.get(trabajo_id)
+    if not trabajo:
+        return jsonify({'ok': False, 'msg': 'trabajo no encontrado'}), 404
+    return jsonify({'ok': True, 'trabajo': _trabajo_publico(trabajo)})
+
+
+@app.route("/exportar/trabajos/<trabajo_id>/archivo")
+def exportar_trabajo_archivo(trabajo_id):
+    trabajo = export_jobs.get(trabajo_id)
+    if not trabajo:
+        return jsonify({'ok': False, 'msg': 'trabajo no encontrado'}), 404
+    if trabajo['estado'] != 'listo' or not os.path.exists(trabajo['archivo']):
+        return jsonify({'ok': False, 'msg': 'el archivo aún no está listo', 'trabajo': _trabajo_publico(trabajo)}), 409
+    return _enviar_artefacto(trabajo)
+
+
+@app.route("/exportar/stats")
+def exportar_stats():
+    return jsonify({'ok': True, 'stats': export_jobs.stats()})
+
+
+@app.route("/exportar/<nombre>.<formato>")
+def exportar_volcado(nombre, formato):
+    """Volcado CSV/NDJSON en streaming (inventario, movimientos o ventas).
+
+    Filtros opcionales: `prefijo`, `q` (solo inventario) y `since` (fecha
+    ISO). Se comprime con gzip si el cliente lo acepta o si `gzip=1`.
+    """
+    if nombre not in VOLCADOS or formato not in FORMATOS:
+        return jsonify({'ok': False, 'msg': 'volcado no disponible'}), 404
+    prefijo = request.args.get('prefijo', '').strip().rstrip('-') or None
+    q = request.args.get('q', '').strip() or None
+    try:
+        since = normalizar_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'since debe ser una fecha ISO (AAAA-MM-DD)'}), 400
+    forzar_gzip = request.args.get('gzip', '').lower()
+    comprimir = forzar_gzip in ('1', 'true', 'si') or (forzar_gzip == '' and 'gzip' in request.accept_encodings)
+
+    # Conexión propia: se devuelve al pool cuando termina (o se corta) el envío
+    pool = get_pool(readonly=True)
+    conn = pool.acquire()
+    try:
+        sql, params = consulta_volcado(conn.cursor(), nombre, prefijo=prefijo, q=q, since=since)
+    except Exception as e:
+        pool.release(conn)
+        print(f"Error al preparar volcado {nombre}: {e}")
+        return jsonify({'ok': False, 'msg': str(e)}), 500
+
+    archivo = f"{nombre}_{prefijo}" if prefijo else nombre
+    archivo = f"{archivo}_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    try:
+        log_movimiento(session.get('usuario'), VOLCADOS[nombre][2], None, None, {
+            'archivo': archivo, 'formato': formato, 'prefijo': prefijo, 'filtro': q, 'since': since
+        })
+    except Exception:
+        pass
+
+    liberar = una_vez(lambda: pool.release(conn))
+    cuerpo = generar_volcado(conn, sql, params, formato, comprimir, al_terminar=liberar)
+    resp = app.response_class(cuerpo, content_type=FORMATOS[formato], direct_passthrough=True)
+    resp.call_on_close(liberar)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{archivo}"'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    if comprimir:
+        resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+
 @app.route("/exportar_excel")
 def exportar_excel():
     try:
-        # Conectar a la base de datos
-        conn = sqlite3.connect(DB_PATH)
-        
-        # Leer datos de todas las tablas
-        df_inventory = pd.read_sql_query("SELECT * FROM inventory", conn)
-        df_usuarios = pd.read_sql_query("SELECT * FROM usuarios", conn)
-        df_movimientos = pd.read_sql_query("SELECT * FROM movimientos", conn)
-        df_ventas = pd.read_sql_query("SELECT * FROM ventas", conn)  # Nueva tabla
-        
-        conn.close()
-        
-        # Crear un archivo Excel en memoria
-        output = io.BytesIO()
-        
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_inventory.to_excel(writer, sheet_name='Inventario', index=False)
-            df_usuarios.to_excel(writer, sheet_name='Usuarios', index=False)
-            df_movimientos.to_excel(writer, sheet_name='Movimientos', index=False)
-            df_ventas.to_excel(writer, sheet_name='Ventas', index=False)  # Nueva hoja
-        
-        output.seek(0)
-        
-        # Registrar en movimientos
-        log_movimiento(session.get('usuario'), 'EXPORTAR_EXCEL', None, None, {
-            'archivo': 'backup_completo.xlsx',
-            'tablas': ['inventory', 'usuarios', 'movimientos', 'ventas']  # Actualizar
-        })
-        
-        # Enviar el archivo
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"backup_inventario_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
+        return _exportar_excel('respaldo')
     except Exception as e:
         print(f"Error al exportar Excel completo: {e}")
         return f"Error al exportar: {str(e)}", 500
@@ -1479,27 +1494,7 @@ def exportar_excel():
 @app.route("/exportar_inventario_excel")
 def exportar_inventario_excel():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM inventory", conn)
-        conn.close()
-        
-        output = io.BytesIO()
-        df.to_excel(output, engine='openpyxl', index=False, sheet_name='Inventario')
-        output.seek(0)
-        
-        # Registrar en movimientos
-        log_movimiento(session.get('usuario'), 'EXPORTAR_INVENTARIO', None, None, {
-            'archivo': 'inventario.xlsx',
-            'registros': len(df)
-        })
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"inventario_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
+        return _exportar_excel('inventario')
     except Exception as e:
         print(f"Error al exportar inventario: {e}")
         return f"Error al exportar inventario: {str(e)}", 500
@@ -1507,26 +1502,7 @@ def exportar_inventario_excel():
 @app.route("/exportar_usuarios_excel")
 def exportar_usuarios_excel():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM usuarios", conn)
-        conn.close()
-        
-        output = io.BytesIO()
-        df.to_excel(output, engine='openpyxl', index=False, sheet_name='Usuarios')
-        output.seek(0)
-        
-        log_movimiento(session.get('usuario'), 'EXPORTAR_USUARIOS', None, None, {
-            'archivo': 'usuarios.xlsx',
-            'registros': len(df)
-        })
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"usuarios_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
+        return _exportar_excel('usuarios')
     except Exception as e:
         print(f"Error al exportar usuarios: {e}")
         return f"Error al exportar usuarios: {str(e)}", 500
@@ -1534,52 +1510,14 @@ def exportar_usuarios_excel():
 @app.route("/exportar_movimientos_excel")
 def exportar_movimientos_excel():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM movimientos", conn)
-        conn.close()
-        
-        output = io.BytesIO()
-        df.to_excel(output, engine='openpyxl', index=False, sheet_name='Movimientos')
-        output.seek(0)
-        
-        log_movimiento(session.get('usuario'), 'EXPORTAR_MOVIMIENTOS', None, None, {
-            'archivo': 'movimientos.xlsx',
-            'registros': len(df)
-        })
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"movimientos_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
+        return _exportar_excel('movimientos')
     except Exception as e:
         print(f"Error al exportar movimientos: {e}")
         return f"Error al exportar movimientos: {str(e)}", 500
 @app.route("/exportar_ventas_excel")
 def exportar_ventas_excel():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM ventas", conn)
-        conn.close()
-        
-        output = io.BytesIO()
-        df.to_excel(output, engine='openpyxl', index=False, sheet_name='Ventas')
-        output.seek(0)
-        
-        log_movimiento(session.get('usuario'), 'EXPORTAR_VENTAS', None, None, {
-            'archivo': 'ventas.xlsx',
-            'registros': len(df)
-        })
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"ventas_ccc_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
+        return _exportar_excel('ventas')
     except Exception as e:
         print(f"Error al exportar ventas: {e}")
         return f"Error al exportar ventas: {str(e)}", 500
@@ -1592,38 +1530,7 @@ def exportar_categoria_excel(prefijo):
     """
     q = request.args.get('q', '').strip()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        # construir query similar a productos_por_categoria
-        parametros = [f"{prefijo}-%"]
-        base_sql = ("SELECT rowid AS id, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
-                    "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras "
-                    "FROM inventory WHERE sku LIKE ?")
-        if q:
-            base_sql += " AND (sku LIKE ? OR marca LIKE ? OR modelo LIKE ? OR observacion LIKE ? OR id_original LIKE ?)"
-            like_q = f"%{q}%"
-            parametros.extend([like_q, like_q, like_q, like_q, like_q])
-
-        df = pd.read_sql_query(base_sql, conn, params=parametros)
-        conn.close()
-
-        output = io.BytesIO()
-        df.to_excel(output, engine='openpyxl', index=False, sheet_name=f'Productos_{prefijo}')
-        output.seek(0)
-
-        # Registrar en movimientos
-        try:
-            log_movimiento(session.get('usuario'), 'EXPORTAR_CATEGORIA', None, None, {
-                'archivo': f'productos_{prefijo}.xlsx', 'prefijo': prefijo, 'filtro': q, 'registros': len(df)
-            })
-        except Exception:
-            pass
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"productos_{prefijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return _exportar_excel('categoria', {'prefijo': prefijo, 'q': q})
     except Exception as e:
         print(f"Error al exportar categoria {prefijo}: {e}")
         return f"Error al exportar: {str(e)}", 500
@@ -1642,148 +1549,280 @@ def scan_code():
     code = request.values.get('code')
     if not code:
         return "Missing code", 400
+    if request.values.get('format') == 'json' or request.is_json:
+        # Clientes (lector/forwarder) que solo quieren saber qué producto es
+        conn = get_db()
+        cur = conn.cursor()
+        rows = buscar_por_serie(cur, code, limit=50, columnas="rowid, sku, tipo, marca, modelo, no_serie, estado")
+        conn.close()
+        keys = ['rowid', 'sku', 'tipo', 'marca', 'modelo', 'no_serie', 'estado']
+        return jsonify({'ok': bool(rows), 'data': [dict(zip(keys, r)) for r in rows]})
     # redirigir a /productos indicando que la búsqueda es por no_serie
     return redirect(url_for('productos_all', q=code, search_field='no_serie'))
 
 
-# ------------------ Scanner/Serial support ------------------
-scanner_thread = None
-scanner_running = False
-scanner_lock = threading.Lock()
-last_scanned = None
+SERVICIO = 'sistemaccc-inventario'  # los forwarders lo buscan en /health al descubrir el servidor
+_ARRANQUE = time.monotonic()
 
-def find_serial_port():
-    if serial is None:
-        return None
-    
-    ports = list(serial.tools.list_ports.comports())
-    if not ports:
-        return None
 
-    # Keywords universales de dispositivos USB a Serial y escáneres
-    keywords = [
-        "usb", "serial", "scanner", "barcode", "dispositivo serie",
-        "usb-to-serial", "ftdi", "prolific", "ch340", "uart", "hid"
-    ]
-
-    candidate_ports = []
+@app.route('/health')
+def health():
+    """Chequeo barato para monitoreo y descubrimiento en la LAN: una consulta mínima a la BD."""
+    inicio = time.perf_counter()
+    try:
+        esquema = get_db().execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+        error = None
+    except Exception as e:
+        esquema, error = None, str(e)
+    datos = {
+        'ok': error is None,
+        'servicio': SERVICIO,
+        'version': esquema,
+        'db_ms': round((time.perf_counter() - inicio) * 1000, 2),
+        'activo_s': int(time.monotonic() - _ARRANQUE),
+    }
+    if error:
+        datos['msg'] = error
+    resp = jsonify(datos)
+    resp.status_code = 200 if error is None else 503
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
-    # 1) Escanear todos los puertos
-    for p in ports:
-        desc = (p.description or "").lower()
-        hwid = (p.hwid or "").lower()
 
-        # Cualquier puerto que parezca USB-Serial
-        if any(k in desc for k in keywords) or any(k in hwid for k in keywords):
-            candidate_ports.append(p.device)
+# ------------------ Scanner/Serial support ------------------
+# Escaneos publicados a los clientes por SSE (/escaneos/stream) o long-poll (/escaneos/esperar)
+# Flujos SSE y long-polls retienen un hilo de waitress cada uno: se acotan para dejar hilos libres.
+# Los topes alcanzan para unas decenas de estaciones con su pestaña abierta (un hilo en espera
+# cuesta poca memoria); run.py suma estos hilos a los de peticiones normales.
+ESCANEOS_MAX_FLUJOS = int(os.environ.get('ESCANEOS_MAX_FLUJOS', '48'))
+ESCANEOS_MAX_ESPERAS = int(os.environ.get('ESCANEOS_MAX_ESPERAS', '16'))
+app.config['HILOS_ESCANEO'] = ESCANEOS_MAX_FLUJOS + ESCANEOS_MAX_ESPERAS
+escaneos = ScanBus(max_suscriptores=ESCANEOS_MAX_FLUJOS)
+ESCANEOS_DURACION_SSE = 300  # s; EventSource se reconecta solo con Last-Event-ID
+ESCANEOS_LATIDO = 15
+ESCANEOS_ESPERA_MAX = 20  # s por long-poll
+_esperas_escaneo = threading.BoundedSemaphore(ESCANEOS_MAX_ESPERAS)
 
-    # 2) Si encontramos puertos candidatos, devolver el primero
-    if candidate_ports:
-        return candidate_ports[0]
 
-    # 3) Si no encontramos nada, devolver el primer COM disponible
-    return ports[0].device
+def _publicar_serie(code, puerto, estacion):
+    escaneos.publicar(code, origen=f'serial:{puerto}', estacion=estacion)
 
 
-
-def serial_worker(port, baud=9600):
-    global scanner_running, last_scanned
-    while scanner_running:
-        try:
-            with serial.Serial(port, baud, timeout=1) as ser:
-                buffer = ""
-                while scanner_running:
-                    chunk = ser.read().decode("utf-8", errors="ignore")
-                    if not chunk:
-                        time.sleep(0.01)
-                        continue
-                    if chunk in ("\r", "\n"):
-                        code = buffer.strip()
-                        buffer = ""
-                        if code:
-                            with scanner_lock:
-                                last_scanned = code
-                    else:
-                        buffer += chunk
-
-        except Exception as e:
-            print("Serial error:", e)
-            time.sleep(1)  # espera y vuelve a intentar abrir puerto
-            port = find_serial_port()
+# Un lector por escáner conectado; ESCANER_ESTACIONES="COM3=caja1,COM4=caja2" asigna estaciones
+escaneres = GestorEscaneres(_publicar_serie, estaciones=leer_estaciones(os.environ.get('ESCANER_ESTACIONES')))
 
 
 @app.route('/start_scanner')
 def start_scanner():
-         
-    global scanner_thread, scanner_running
-    if serial is None:
+    if not lectores_disponibles():
         return jsonify({'ok': False, 'msg': 'pyserial no está disponible.'}), 500
 
-    if scanner_running:
+    if escaneres.activo:
         return jsonify({'ok': True, 'msg': 'Scanner ya estaba corriendo.'})
 
-    port = find_serial_port()
-    if not port:
+    puertos = escaneres.iniciar()
+    if not puertos:
         return jsonify({'ok': False, 'msg': 'No se detectó ningún escáner USB-COM-STD.'}), 404
 
-    scanner_running = True
-    
-    scanner_thread = threading.Thread(target=serial_worker, args=(port,), daemon=True)
-    
-    scanner_thread.start()
-
-    return jsonify({'ok': True, 'msg': f'Scanner iniciado en {port}'})
+    return jsonify({'ok': True, 'msg': f"Scanner iniciado en {', '.join(puertos)}", 'puertos': puertos})
 
 
 @app.route('/stop_scanner')
 def stop_scanner():
-    global scanner_running
-    scanner_running = False
+    escaneres.detener()
     return jsonify({'ok': True, 'msg': 'Scanner detenido.'})
 
 
+@app.route('/scanner/stats')
+def scanner_stats():
+    return jsonify({'ok': True, 'stats': escaneres.stats()})
+
+
 @app.route('/last_scanned')
 def get_last_scanned():
-    global last_scanned
-    with scanner_lock:
-        code = last_scanned
-        last_scanned = None
-    return jsonify({'code': code})
+    """Compatibilidad: último código no leído por esta ruta. Las páginas usan /escaneos/stream."""
+    try:
+        return jsonify({'code': escaneos.tomar_ultimo(request.args.get('estacion'))})
+    except EstacionInvalida as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 400
 
 
-@app.route('/push_scan', methods=['POST'])
-def push_scan():
-    """Permite que otra PC envíe un código (modo red)."""
-    global last_scanned
+def _cursor_escaneos(valor):
     try:
-        data = request.get_json(silent=True) or request.form.to_dict()
-        code = data.get("code") if isinstance(data, dict) else request.values.get("code")
+        return int(valor) if valor not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _estacion_escaneo(data=None):
+    """Estación pedida en `?estacion=`, en el cuerpo (`estacion`) o en la cabecera X-Estacion."""
+    valor = request.args.get('estacion')
+    if not valor and isinstance(data, dict):
+        valor = data.get('estacion')
+    return valor or request.headers.get('X-Estacion')
+
+
+@app.route('/escaneos/stream')
+def escaneos_stream():
+    """Flujo Server-Sent Events de escaneos de una estación (evento `escaneo`, con latidos)."""
+    try:
+        sub = escaneos.suscribir(_estacion_escaneo())
+    except EstacionInvalida as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 400
+    if sub is None:
+        # Cada flujo ocupa un hilo de waitress: pasado el tope, el cliente usa long-poll
+        resp = jsonify({'ok': False, 'msg': 'demasiados flujos abiertos; usa /escaneos/esperar'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '30'
+        return resp
+    cursor = _cursor_escaneos(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+    resp = app.response_class(flujo_sse(escaneos, sub, cursor, ESCANEOS_DURACION_SSE, ESCANEOS_LATIDO),
+                              mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.call_on_close(lambda: escaneos.cancelar(sub))
+    return resp
 
-        if not code:
-            return jsonify({'ok': False, 'msg': 'code required'}), 400
 
-        with scanner_lock:
-            last_scanned = str(code).strip()
+@app.route('/escaneos/esperar')
+def escaneos_esperar():
+    """Long-poll: eventos de la estación posteriores a `cursor`, esperando hasta `timeout` s (máx. 20).
 
-        return jsonify({'ok': True, 'msg': 'scan received', 'code': last_scanned})
+    Sin cursor responde de inmediato con el cursor actual, para empezar desde ahora.
+    """
+    try:
+        estacion = escaneos.estacion(_estacion_escaneo())
+    except EstacionInvalida as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 400
+    cursor = _cursor_escaneos(request.args.get('cursor'))
+    actual = estacion.cursor()
+    if cursor is None or cursor > actual:
+        return jsonify({'ok': True, 'estacion': estacion.nombre, 'cursor': actual, 'eventos': []})
+    try:
+        timeout = min(float(request.args.get('timeout') or ESCANEOS_ESPERA_MAX), ESCANEOS_ESPERA_MAX)
+    except ValueError:
+        timeout = ESCANEOS_ESPERA_MAX
+    if not _esperas_escaneo.acquire(blocking=False):
+        resp = jsonify({'ok': False, 'msg': 'demasiadas esperas abiertas'})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = '15'
+        return resp
+    try:
+        eventos, siguiente = estacion.esperar(cursor, max(timeout, 0))
+    finally:
+        _esperas_escaneo.release()
+    return jsonify({'ok': True, 'estacion': estacion.nombre, 'cursor': siguiente, 'eventos': eventos,
+                    'incompleto': estacion.incompleto(cursor)})
+
+
+@app.route('/escaneos/estaciones')
+def escaneos_estaciones():
+    return jsonify({'ok': True, 'estaciones': escaneos.estaciones()})
+
+
+@app.route('/escaneos/stats')
+def escaneos_stats():
+    return jsonify({'ok': True, 'stats': escaneos.stats()})
+
+
+def _publicar_escaneo(origen, msg):
+    data = request.get_json(silent=True) or request.form.to_dict()
+    code = data.get("code") if isinstance(data, dict) else request.values.get("code")
+
+    if not code:
+        return jsonify({'ok': False, 'msg': 'code required'}), 400
+
+    try:
+        evento = escaneos.publicar(code, origen=origen, estacion=_estacion_escaneo(data))
+    except EstacionInvalida as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 400
+    if evento is None:
+        return jsonify({'ok': False, 'msg': 'code required'}), 400
+
+    return jsonify({'ok': True, 'msg': msg, 'code': evento['code'], 'id': evento['id'],
+                    'estacion': evento['estacion']})
+
+
+@app.route('/push_scan', methods=['POST'])
+def push_scan():
+    """Permite que otra PC envíe un código (modo red) a su estación (`estacion` o X-Estacion)."""
+    try:
+        return _publicar_escaneo('red', 'scan received')
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
 
-@app.route('/simulate_scan', methods=['POST'])
-def simulate_scan():
-    global last_scanned
-    try:
-        data = request.get_json(silent=True) or request.form.to_dict()
-        code = data.get("code") if isinstance(data, dict) else request.values.get("code")
+ESCANEOS_MAX_LOTE = 500
+# Escaneos guardados en la bandeja de un forwarder durante una caída: pasado este
+# tiempo ya no corresponden a lo que la página tiene abierto y no se publican.
+ESCANEOS_MAX_EDAD = float(os.environ.get('ESCANEOS_MAX_EDAD', '120'))
 
+
+def _escaneo_vencido(ts, ahora):
+    """True si la hora `ts` (ISO, del forwarder) es más vieja que ESCANEOS_MAX_EDAD.
+
+    Una hora ilegible o en el futuro (reloj adelantado) no vence.
+    """
+    try:
+        escaneado = datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return False
+    if escaneado.tzinfo is not None:
+        escaneado = escaneado.astimezone().replace(tzinfo=None)
+    return (ahora - escaneado).total_seconds() > ESCANEOS_MAX_EDAD
+
+
+@app.route('/push_scan/lote', methods=['POST'])
+def push_scan_lote():
+    """Versión en lote de /push_scan para los forwarders con bandeja de salida.
+
+    Cuerpo: {"estacion": "caja1", "escaneos": [{"id": "...", "code": "...", "ts": "..."}]}.
+    `id` (opcional, hasta 64 caracteres) hace el envío idempotente: un id ya
+    recibido en esa estación no se vuelve a publicar. Un escaneo con `ts`
+    más viejo que ESCANEOS_MAX_EDAD (bandeja que se vacía tras una caída)
+    no se publica: ya no corresponde a lo que muestran las páginas. Responde
+    qué ids quedaron publicados, cuáles eran duplicados, cuáles vencidos y
+    cuáles se rechazaron; todos pueden borrarse de la bandeja del forwarder.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('escaneos'), list):
+        return jsonify({'ok': False, 'msg': 'escaneos requerido (lista)'}), 400
+    if len(data['escaneos']) > ESCANEOS_MAX_LOTE:
+        return jsonify({'ok': False, 'msg': f'máximo {ESCANEOS_MAX_LOTE} escaneos por lote'}), 413
+
+    lote, rechazados, vencidos = [], [], []
+    ahora = datetime.now()
+    for item in data['escaneos']:
+        item = item if isinstance(item, dict) else {}
+        id_cliente = str(item.get('id') or '')[:64] or None
+        code = str(item.get('code') or '').strip()
         if not code:
-            return jsonify({'ok': False, 'msg': 'code required'}), 400
+            rechazados.append(id_cliente)
+            continue
+        ts = str(item.get('ts') or '')[:32] or None
+        if ts and _escaneo_vencido(ts, ahora):
+            vencidos.append(id_cliente)
+            continue
+        lote.append((id_cliente, code, ts))
+    try:
+        resultado = escaneos.publicar_lote(lote, origen='red', estacion=_estacion_escaneo(data))
+    except EstacionInvalida as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 400
+
+    return jsonify({
+        'ok': True,
+        'publicados': [id_cliente for id_cliente, _, duplicado in resultado if not duplicado],
+        'duplicados': [id_cliente for id_cliente, _, duplicado in resultado if duplicado],
+        'vencidos': vencidos,
+        'rechazados': rechazados,
+        'ultimo_id': max((id_evento for _, id_evento, _ in resultado), default=None),
+    })
 
-        with scanner_lock:
-            last_scanned = str(code).strip()
 
-        return jsonify({'ok': True, 'msg': 'simulated', 'code': last_scanned})
+@app.route('/simulate_scan', methods=['POST'])
+def simulate_scan():
+    try:
+        return _publicar_escaneo('simulado', 'simulated')
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)}), 500
  
@@ -1797,24 +1836,8 @@ def simulate_scan():
 def ensure_today_event():
     """Crea el evento de venta del día si no existe y cierra los anteriores abiertos."""
     hoy = datetime.now().date().isoformat()  # YYYY-MM-DD
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cur = conn.cursor()
-    # Crear tablas por si aún no existen
-    cur.execute("""CREATE TABLE IF NOT EXISTS venta_eventos (
-        fecha TEXT PRIMARY KEY,
-        estado TEXT NOT NULL DEFAULT 'OPEN',
-        creado_cuando TEXT,
-        cerrado_cuando TEXT
-    )""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS venta_evento_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        evento_fecha TEXT NOT NULL,
-        rowid_producto INTEGER NOT NULL,
-        precio_asignado REAL,
-        agregado_por TEXT,
-        agregado_cuando TEXT,
-        UNIQUE(evento_fecha,rowid_producto)
-    )""")
     # Cerrar eventos anteriores abiertos
     cur.execute("SELECT fecha FROM venta_eventos WHERE estado='OPEN' AND fecha < ?", (hoy,))
     antiguos = [r[0] for r in cur.fetchall()]
@@ -1841,17 +1864,8 @@ def venta_evento_hoy():
     """Devuelve estado del evento de hoy sin crearlo automáticamente y total vendido."""
     hoy = datetime.now().date().isoformat()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db(readonly=False)
         cur = conn.cursor()
-        # Asegurar la tabla de eventos para consultar sin errores
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS venta_eventos (
-                fecha TEXT PRIMARY KEY,
-                estado TEXT NOT NULL DEFAULT 'OPEN',
-                creado_cuando TEXT,
-                cerrado_cuando TEXT
-            )
-        """)
         # Cerrar eventos abiertos de días anteriores (auto-cierre a medianoche)
         cur.execute("UPDATE venta_eventos SET estado='CERRADA', cerrado_cuando=? WHERE estado='OPEN' AND fecha < ?", (datetime.now().isoformat(), hoy))
         conn.commit()
@@ -1882,7 +1896,7 @@ def venta_evento_agregar():
     if not rowid:
         return jsonify({'ok': False, 'msg': 'rowid requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         # Verificar estado evento
         cur.execute("SELECT estado FROM venta_eventos WHERE fecha=?", (fecha,))
@@ -1917,7 +1931,7 @@ def venta_evento_agregar():
 def venta_evento_cerrar():
     fecha = request.form.get('fecha') or (request.json.get('fecha') if request.is_json else None) or datetime.now().date().isoformat()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT estado FROM venta_eventos WHERE fecha=?", (fecha,))
         r = cur.fetchone()
@@ -1942,7 +1956,7 @@ def venta_evento_cerrar():
 def venta_evento_reporte():
     fecha = request.args.get('fecha', '').strip() or datetime.now().date().isoformat()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT estado, creado_cuando, cerrado_cuando FROM venta_eventos WHERE fecha=?", (fecha,))
         evt = cur.fetchone()
@@ -1965,19 +1979,9 @@ def venta_evento_page():
     """Página de gestión de la venta del día: solo muestra si el evento existe."""
     hoy = datetime.now().date().isoformat()
     try:
-        ensure_ventas_table()
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db(readonly=False)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        # Asegurar la tabla de eventos exista para evitar errores si aún no se creó
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS venta_eventos (
-                fecha TEXT PRIMARY KEY,
-                estado TEXT NOT NULL DEFAULT 'OPEN',
-                creado_cuando TEXT,
-                cerrado_cuando TEXT
-            )
-        """)
         # Cerrar eventos anteriores abiertos
         cur.execute("UPDATE venta_eventos SET estado='CERRADA', cerrado_cuando=? WHERE estado='OPEN' AND fecha < ?", (datetime.now().isoformat(), hoy))
         conn.commit()
@@ -2037,8 +2041,7 @@ def venta_evento_page():
 
 def build_ticket_bundle(venta_id):
     """Obtiene metadata del ticket y todas las partidas asociadas."""
-    ensure_ticket_support()
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute(
@@ -2112,8 +2115,7 @@ def build_ticket_bundle(venta_id):
 
 def build_event_report(fecha):
     """Devuelve resumen de ventas y tickets para una fecha determinada."""
-    ensure_ticket_support()
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute("SELECT fecha, estado FROM venta_eventos WHERE fecha=?", (fecha,))
@@ -2189,15 +2191,56 @@ def build_event_report(fecha):
     }
 
 
+def _enviar_artefacto_ticket(art, mimetype, filename=None):
+    """Envía un artefacto de ticket con su digest como ETag (304 si no cambió)."""
+    resp = send_file(art.ruta, mimetype=mimetype, as_attachment=bool(filename), download_name=filename,
+                     etag=art.digest, conditional=True, max_age=0)
+    # Se puede guardar pero siempre se revalida: una reversión cambia el ticket
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    if not filename:
+        resp.headers.pop('Content-Disposition', None)
+    return resp
+
+
+def _pdf_no_disponible(e):
+    """503 cuando el servicio de PDF está saturado o el trabajo venció."""
+    resp = jsonify({'ok': False, 'msg': str(e)})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = '5'
+    return resp
+
+
+@app.route('/pdf/stats')
+def pdf_stats():
+    return jsonify({'ok': True, 'stats': pdf_service.stats()})
+
+
+def _ticket_html(venta_id):
+    """Artefacto HTML del ticket (vista y descarga), o None si la venta no existe."""
+    # La base pública (no el Host de la petición) va en el QR del HTML y en la llave
+    base = (app.config.get('PUBLIC_BASE_URL') or request.host_url).rstrip('/')
+    variante = 'html:' + base
+    art = ticket_cache.buscar(venta_id, variante)
+    if art:
+        return art
+    generacion = ticket_cache.generacion
+    bundle = build_ticket_bundle(venta_id)
+    if not bundle:
+        return None
+    ticket, items = bundle
+    html = render_template('venta_ticket.html', ticket=ticket, items=items, base_publica=base)
+    return ticket_cache.registrar(venta_id, ticket['id'], variante, html, lambda h: h.encode('utf-8'),
+                                  generacion=generacion)
+
+
 @app.route('/venta/ticket/<int:venta_id>')
 def venta_ticket(venta_id):
     """Muestra el ticket de una venta con detalles y opción de descarga/imprimir."""
     try:
-        bundle = build_ticket_bundle(venta_id)
-        if not bundle:
+        art = _ticket_html(venta_id)
+        if not art:
             return jsonify({'ok': False, 'msg': 'Venta no encontrada'}), 404
-        ticket, items = bundle
-        return render_template('venta_ticket.html', ticket=ticket, items=items)
+        return _enviar_artefacto_ticket(art, 'text/html; charset=utf-8')
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
@@ -2205,31 +2248,55 @@ def venta_ticket(venta_id):
 def venta_ticket_download(venta_id):
     """Devuelve el ticket como archivo descargable (HTML adjunto)."""
     try:
-        bundle = build_ticket_bundle(venta_id)
-        if not bundle:
+        art = _ticket_html(venta_id)
+        if not art:
             return jsonify({'ok': False, 'msg': 'Venta no encontrada'}), 404
-        ticket, items = bundle
-        html = render_template('venta_ticket.html', ticket=ticket, items=items)
-        from flask import Response
-        filename = f"ticket-venta-{ticket['id']}.html"
-        resp = Response(html)
-        resp.headers['Content-Type'] = 'text/html; charset=utf-8'
-        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-        return resp
+        return _enviar_artefacto_ticket(art, 'text/html; charset=utf-8', f"ticket-venta-{art.ticket_id}.html")
     except Exception as e:
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
+def _motor_pdf():
+    """Motor de PDF de la petición: ?motor=reportlab|xhtml2pdf, o PDF_MOTOR."""
+    motor = (request.args.get('motor') or PDF_MOTOR).lower()
+    if motor not in pdf_nativo.MOTORES:
+        motor = PDF_MOTOR
+    if motor == 'reportlab' and not pdf_nativo.disponible():
+        return 'xhtml2pdf'
+    return motor
+
+
+def _ticket_pdf_nativo(venta_id, ticket, items, generacion):
+    """Artefacto PDF del ticket dibujado con ReportLab (sin HTML ni pool de procesos)."""
+    logo = logos.datos('ticket')
+    # La "fuente" del digest son los datos del ticket más la versión del diseño y del logo
+    fuente = json.dumps([pdf_nativo.VERSION, logos.etag('ticket'), ticket, items],
+                        sort_keys=True, default=str, ensure_ascii=False)
+    return ticket_cache.registrar(venta_id, ticket['id'], 'pdf:reportlab', fuente,
+                                  lambda _: pdf_nativo.ticket_pdf(ticket, items, logo), generacion=generacion)
+
+
 @app.route('/venta/ticket/<int:venta_id>/pdf')
 def venta_ticket_pdf(venta_id):
-    if pisa is None:
+    motor = _motor_pdf()
+    if motor == 'xhtml2pdf' and pisa is None:
         return jsonify({'ok': False, 'msg': 'Generación de PDF no disponible (falta xhtml2pdf)'}), 500
+    variante = 'pdf' if motor == 'xhtml2pdf' else 'pdf:' + motor
 
     try:
+        # Ticket ya generado: no se consulta la BD ni se vuelve a renderizar
+        art = ticket_cache.buscar(venta_id, variante)
+        if art:
+            return _enviar_artefacto_ticket(art, 'application/pdf', f"ticket-venta-{art.ticket_id}.pdf")
+
+        generacion = ticket_cache.generacion
         bundle = build_ticket_bundle(venta_id)
         if not bundle:
             return jsonify({'ok': False, 'msg': 'Venta no encontrada'}), 404
 
         ticket, items = bundle
+        if motor == 'reportlab':
+            art = _ticket_pdf_nativo(venta_id, ticket, items, generacion)
+            return _enviar_artefacto_ticket(art, 'application/pdf', f"ticket-venta-{ticket.get('id', venta_id)}.pdf")
 
         # Asegurar strings seguros para Jinja
         for item in items:
@@ -2240,80 +2307,52 @@ def venta_ticket_pdf(venta_id):
             item['no_serie'] = str(item.get('no_serie', '') or '')
             # dejar item['precio'] como numérico si existe
 
-        # Leer CSS desde static
+        # CSS desde static (se relee solo si el archivo cambia)
         css_path = os.path.join(app.static_folder, 'css', 'venta_ticket_pdf.css')
-        ticket_css = ""
-        if os.path.exists(css_path):
-            try:
-                with open(css_path, 'r', encoding='utf-8') as css_file:
-                    ticket_css = css_file.read()
-            except Exception as e:
-                print(f"[WARN] Error leyendo CSS: {e}")
-        else:
+        try:
+            ticket_css = leer_texto(css_path) or ""
+        except Exception as e:
+            print(f"[WARN] Error leyendo CSS: {e}")
+            ticket_css = ""
+        if not ticket_css:
             print(f"[WARN] CSS no encontrado en: {css_path}")
 
-        # Preparar logo como file:// (xhtml2pdf lo entiende mejor)
-        logo_fs = os.path.join(app.static_folder, 'images', 'CCClogo.jpg')
-        logo_url = None
-        if os.path.exists(logo_fs):
-            # convert Windows backslashes a slashes y anteponer file://
-            logo_url = 'file://' + logo_fs.replace('\\', '/')
+        # Logo reducido embebido como data URI (no depende de rutas file:// del equipo)
+        logo_pdf = logos.data_uri('ticket')
 
         # Generar HTML con Jinja (plantilla debe usar .page con page-break-after)
-        html = render_template('venta_ticket_pdf.html', ticket=ticket, items=items, logo_path=logo_url)
+        # con el CSS inline: el digest del artefacto cubre también los estilos
+        html = con_css(render_template('venta_ticket_pdf.html', ticket=ticket, items=items, logo_path=logo_pdf),
+                       ticket_css)
 
-        # Inyectar CSS dentro del <head> (xhtml2pdf lo necesita inline)
-        if ticket_css:
-            style_tag = f"<style>\n{ticket_css}\n</style>\n"
-            if '</head>' in html:
-                html = html.replace('</head>', f"{style_tag}</head>", 1)
-            else:
-                # si no hay head, añadir al inicio del documento
-                html = style_tag + html
-
-        # Guardar HTML de depuración para abrir en navegador
+        # Depuración opcional (TICKET_DEBUG=1), escrita en segundo plano
         debug_dir = os.path.join(app.root_path, 'debug')
-        os.makedirs(debug_dir, exist_ok=True)
-        debug_html_path = os.path.join(debug_dir, f'ticket_{venta_id}.html')
-        with open(debug_html_path, 'w', encoding='utf-8') as f:
-            f.write(html)
-        print(f"[DEBUG] HTML guardado en: {debug_html_path}")
-
-        # Generar PDF con pisa (sin default_css agresivo)
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(
-            html,
-            dest=pdf_buffer,
-            encoding='utf-8',
-            show_error_as_pdf=True
-        )
+        if TICKET_DEBUG:
+            volcar_debug(os.path.join(debug_dir, f'ticket_{venta_id}.html'), html)
 
-        if pisa_status.err:
-            print(f"[ERROR] pisa error: {pisa_status.err}")
-            # Guardar PDF parcial para depuración
+        def generar_pdf(fuente):
+            # Generar PDF con pisa (sin default_css agresivo) en el pool de procesos
             try:
-                with open(os.path.join(debug_dir, f'ticket_{venta_id}_error.pdf'), 'wb') as pf:
-                    pf.write(pdf_buffer.getvalue())
-            except Exception:
-                pass
-            return jsonify({'ok': False, 'msg': 'No se pudo generar el PDF del ticket'}), 500
+                return pdf_service.renderizar(fuente, encoding='utf-8', show_error_as_pdf=True)
+            except ErrorPDF as e:
+                print(f"[ERROR] pisa error: {e}")
+                if TICKET_DEBUG:
+                    # Guardar PDF parcial para depuración
+                    volcar_debug(os.path.join(debug_dir, f'ticket_{venta_id}_error.pdf'), e.parcial)
+                raise RuntimeError('No se pudo generar el PDF del ticket')
 
-        pdf_buffer.seek(0)
-        filename = f"ticket-venta-{ticket.get('id', venta_id)}.pdf"
+        try:
+            art = ticket_cache.registrar(venta_id, ticket['id'], 'pdf', html, generar_pdf, generacion=generacion)
+        except (ServicioOcupado, TimeoutError) as e:
+            return _pdf_no_disponible(e)
+        except RuntimeError as e:
+            return jsonify({'ok': False, 'msg': str(e)}), 500
 
-        # Guardar copia de depuración del PDF
-        pdf_debug_path = os.path.join(debug_dir, f'ticket_{venta_id}.pdf')
-        with open(pdf_debug_path, 'wb') as f:
-            f.write(pdf_buffer.getvalue())
-        pdf_buffer.seek(0)
-        print(f"[DEBUG] PDF guardado en: {pdf_debug_path}")
+        if TICKET_DEBUG:
+            with open(art.ruta, 'rb') as f:
+                volcar_debug(os.path.join(debug_dir, f'ticket_{venta_id}.pdf'), f.read())
 
-        # Enviar archivo al navegador; compat con Flask viejas/nuevas
-        try:
-            return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, download_name=filename)
-        except TypeError:
-            # fallback para Flask antiguo que usa attachment_filename
-            return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, attachment_filename=filename)
+        return _enviar_artefacto_ticket(art, 'application/pdf', f"ticket-venta-{ticket.get('id', venta_id)}.pdf")
 
     except Exception as e:
         import traceback
@@ -2321,6 +2360,27 @@ def venta_ticket_pdf(venta_id):
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
 
+def _enviar_qr(url, logo_min):
+    """PNG del QR de `url` desde la caché, con ETag fuerte (la llave) y caché HTTP larga."""
+    if qrcode is None or Image is None:
+        # Fallback: redirigir a servicio externo de QR si faltan dependencias
+        fallback = f"https://chart.googleapis.com/chart?chs=200x200&cht=qr&chl={url}&chco=000000"
+        return redirect(fallback)
+    llave = llave_qr(url, logo_min, logos.etag('qr'))
+    resp = app.response_class(mimetype='image/png')
+    resp.set_etag(llave)
+    resp.headers['Cache-Control'] = f'public, max-age={QR_MAX_AGE}'
+    if request.if_none_match.contains(llave):
+        # Revalidación: ni siquiera se busca el PNG
+        return resp.make_conditional(request)
+
+    def generar():
+        print(f"[QR] Generando QR url={url}")
+        return generar_qr_png(url, logos, logo_min)
+    resp.set_data(qr_cache.obtener(llave, generar))
+    return resp.make_conditional(request)
+
+
 @app.route('/venta/ticket/<int:venta_id>/qr.png')
 def venta_ticket_qr(venta_id):
     """Genera un PNG QR dinámico con la URL del ticket y logo CCC."""
@@ -2330,64 +2390,25 @@ def venta_ticket_qr(venta_id):
         base = (app.config.get('PUBLIC_BASE_URL') or request.host_url).rstrip('/')
         # Que el QR apunte al endpoint de descarga directa en PDF
         url_ticket = base + url_for('venta_ticket_pdf', venta_id=venta_id)
-        try:
-            print(f"[QR] Generando QR para venta_id={venta_id} url={url_ticket}")
-        except Exception:
-            pass
     except Exception:
         # Fallback simple si request fallara
         url_ticket = f"/venta/ticket/{venta_id}"
 
-    if qrcode is None or Image is None:
-        # Fallback: redirigir a servicio externo de QR si faltan dependencias
-        from flask import redirect
-        fallback = f"https://chart.googleapis.com/chart?chs=200x200&cht=qr&chl={url_ticket}&chco=000000"
-        return redirect(fallback)
-
-    # Generar QR
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=8,
-        border=2,
-    )
-    qr.add_data(url_ticket)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-    # Intentar overlay de logo
-    try:
-        logo_path = os.path.join(app.static_folder, 'images', 'CCClogo.jpg')
-        if os.path.exists(logo_path):
-            logo = Image.open(logo_path).convert('RGBA')
-            # Redimensionar logo al ~25% del QR
-            w, h = img_qr.size
-            target_w = max(70, int(w * 0.25))
-            aspect = logo.width / logo.height if logo.height else 1
-            logo = logo.resize((target_w, int(target_w / aspect)), Image.LANCZOS)
-            # Centrar
-            lx = (w - logo.width) // 2
-            ly = (h - logo.height) // 2
-            img_qr.paste(logo, (lx, ly), mask=logo)
-    except Exception:
-        # Si falla el logo, devolver solo QR
-        pass
-
-    buf = BytesIO()
-    img_qr.save(buf, format='PNG')
-    buf.seek(0)
-    from flask import send_file
-    return send_file(buf, mimetype='image/png')
+    return _enviar_qr(url_ticket, logo_min=70)
 
 
 @app.route('/venta/evento/reporte/pdf')
 def venta_evento_reporte_pdf():
-    if pisa is None:
+    motor = _motor_pdf()
+    if motor == 'xhtml2pdf' and pisa is None:
         return jsonify({'ok': False, 'msg': 'Generación de PDF no disponible'}), 500
     fecha = request.args.get('fecha') or datetime.now().date().isoformat()
+    filename = f"reporte-ventas-{fecha}.pdf"
     try:
         report = build_event_report(fecha)
-        logo_path = os.path.join(app.static_folder, 'images', 'CCClogo.jpg')
+        if motor == 'reportlab':
+            pdf = pdf_nativo.reporte_pdf(report, fecha, datetime.now(), logo=logos.datos('ticket'))
+            return send_file(BytesIO(pdf), mimetype='application/pdf', as_attachment=True, download_name=filename)
         html = render_template(
             'venta_evento_pdf.html',
             evento_fecha=fecha,
@@ -2397,16 +2418,114 @@ def venta_evento_reporte_pdf():
             total_items=report['total_items'],
             total_tickets=report['total_tickets'],
             generado=datetime.now(),
-            logo_path=logo_path if os.path.exists(logo_path) else None
+            logo_path=logos.data_uri('ticket')
         )
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(html, dest=pdf_buffer)
-        if pisa_status.err:
+        try:
+            pdf = pdf_service.renderizar(html)
+        except ErrorPDF:
             return jsonify({'ok': False, 'msg': 'No se pudo generar el PDF del reporte'}), 500
-        pdf_buffer.seek(0)
-        filename = f"reporte-ventas-{fecha}.pdf"
-        return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, download_name=filename)
+        except (ServicioOcupado, TimeoutError) as e:
+            return _pdf_no_disponible(e)
+        return send_file(BytesIO(pdf), mimetype='application/pdf', as_attachment=True, download_name=filename)
+    except Exception as e:
+        return jsonify({'ok': False, 'msg': str(e)}), 500
+
+
+@app.route('/venta/evento/tickets/pdf')
+def venta_evento_tickets_pdf():
+    """Todos los tickets de una fecha de evento en un solo PDF (dos copias por ticket)."""
+    if not pdf_nativo.disponible():
+        return jsonify({'ok': False, 'msg': 'Generación de PDF no disponible (falta reportlab)'}), 500
+    fecha = request.args.get('fecha') or datetime.now().date().isoformat()
+    try:
+        fecha = datetime.strptime(fecha, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'fecha inválida (AAAA-MM-DD)'}), 400
+    try:
+        # Una sola consulta para todas las partidas del evento, ya agrupadas por ticket
+        report = build_event_report(fecha)
+        if not report['tickets']:
+            return jsonify({'ok': False, 'msg': 'No hay tickets para esa fecha'}), 404
+        lote = [(dict(t, evento_fecha=fecha), t['items']) for t in report['tickets']]
+        fuente = json.dumps([pdf_nativo.VERSION, logos.etag('ticket'), lote],
+                            sort_keys=True, default=str, ensure_ascii=False)
+        digest = hashlib.sha256(fuente.encode('utf-8')).hexdigest()
+        ruta = os.path.join(LOTES_TICKETS_DIR, f"tickets-{fecha}-{digest[:16]}.pdf")
+        if not os.path.exists(ruta):
+            os.makedirs(LOTES_TICKETS_DIR, exist_ok=True)
+            # Solo se conserva el lote vigente de cada fecha
+            for nombre in os.listdir(LOTES_TICKETS_DIR):
+                if nombre.startswith(f"tickets-{fecha}-") and nombre.endswith('.pdf'):
+                    try:
+                        os.remove(os.path.join(LOTES_TICKETS_DIR, nombre))
+                    except OSError:
+                        pass
+            pdf_nativo.lote_tickets(pdf_service, lote, logos.datos('ticket'), ruta, titulo=f"Tickets {fecha}")
+        return _enviar_artefacto_ticket(Artefacto(digest, ruta, None), 'application/pdf', f"tickets-{fecha}.pdf")
+    except (ServicioOcupado, TimeoutError) as e:
+        return _pdf_no_disponible(e)
+    except Exception as e:
+        import traceback
+        print(f"Error completo: {traceback.format_exc()}")
+        return jsonify({'ok': False, 'msg': str(e)}), 500
+
+
+@app.route('/etiquetas/pdf', methods=['GET', 'POST'])
+def etiquetas_pdf():
+    """Hoja de etiquetas (QR del SKU + Code128 de la serie) de los productos filtrados.
+
+    Filtros combinables: `prefijo`, `ubicacion`, `skus` (lista o texto
+    separado por comas o renglones) y `q` (búsqueda de texto, como en la
+    exportación por categoría). `formato`: ver `etiquetas.FORMATOS`.
+    """
+    if not etiquetas.disponible():
+        return jsonify({'ok': False, 'msg': 'Generación de PDF no disponible (falta reportlab)'}), 500
+    datos = request.get_json(silent=True) or request.values
+    formato = (datos.get('formato') or 'a4-3x8').strip()
+    if formato not in etiquetas.FORMATOS:
+        return jsonify({'ok': False, 'msg': f"formato inválido ({', '.join(etiquetas.FORMATOS)})"}), 400
+    skus = datos.get('skus') or []
+    if isinstance(skus, str):
+        # Los SKU pueden llevar espacios ("ADAPTADOR DE PC-1"): separar por comas, ; o renglones
+        skus = skus.replace(';', ',').replace('\n', ',').split(',')
+    filtros = {
+        'prefijo': (datos.get('prefijo') or '').strip().rstrip('-') or None,
+        'ubicacion': (datos.get('ubicacion') or '').strip() or None,
+        'skus': [str(s).strip() for s in skus if str(s).strip()] or None,
+        'q': (datos.get('q') or '').strip() or None,
+    }
+    if not any(filtros.values()):
+        return jsonify({'ok': False, 'msg': 'indica prefijo, ubicacion, skus o q'}), 400
+    try:
+        conn = get_db()
+        try:
+            lista = etiquetas.leer_etiquetas(conn.cursor(), **filtros)
+        finally:
+            conn.close()
+        if not lista:
+            return jsonify({'ok': False, 'msg': 'No hay productos con esos filtros'}), 404
+        fuente = json.dumps([etiquetas.VERSION, formato, logos.etag('qr'), lista], sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(fuente.encode('utf-8')).hexdigest()
+        ruta = os.path.join(ETIQUETAS_DIR, f"etiquetas-{digest[:16]}.pdf")
+        if not os.path.exists(ruta):
+            os.makedirs(ETIQUETAS_DIR, exist_ok=True)
+            etiquetas.hoja_etiquetas(pdf_service, lista, formato, logos.datos('qr'), ruta,
+                                     titulo=f"Etiquetas ({len(lista)})")
+            hojas = sorted((os.path.join(ETIQUETAS_DIR, n) for n in os.listdir(ETIQUETAS_DIR) if n.endswith('.pdf')),
+                           key=os.path.getmtime, reverse=True)
+            for vieja in hojas[ETIQUETAS_GUARDADAS:]:
+                try:
+                    os.remove(vieja)
+                except OSError:
+                    pass
+        nombre = f"etiquetas-{filtros['prefijo'] or filtros['ubicacion'] or 'seleccion'}.pdf"
+        return _enviar_artefacto_ticket(Artefacto(digest, ruta, None), 'application/pdf',
+                                        secure_filename(nombre) or 'etiquetas.pdf')
+    except (ServicioOcupado, TimeoutError) as e:
+        return _pdf_no_disponible(e)
     except Exception as e:
+        import traceback
+        print(f"Error completo: {traceback.format_exc()}")
         return jsonify({'ok': False, 'msg': str(e)}), 500
 
 
@@ -2419,40 +2538,7 @@ def venta_evento_reporte_qr():
     except Exception:
         url_pdf = f"/venta/evento/reporte/pdf?fecha={fecha}"
 
-    if qrcode is None or Image is None:
-        from flask import redirect
-        fallback = f"https://chart.googleapis.com/chart?chs=200x200&cht=qr&chl={url_pdf}&chco=000000"
-        return redirect(fallback)
-
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=8,
-        border=2,
-    )
-    qr.add_data(url_pdf)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-
-    # Intentar overlay de logo
-    try:
-        logo_path = os.path.join(app.static_folder, 'images', 'CCClogo.jpg')
-        if os.path.exists(logo_path):
-            logo = Image.open(logo_path).convert('RGBA')
-            w, h = img_qr.size
-            target_w = max(40, int(w * 0.25))
-            aspect = logo.width / logo.height if logo.height else 1
-            logo = logo.resize((target_w, int(target_w / aspect)), Image.LANCZOS)
-            lx = (w - logo.width) // 2
-            ly = (h - logo.height) // 2
-            img_qr.paste(logo, (lx, ly), mask=logo)
-    except Exception:
-        pass
-
-    buf = BytesIO()
-    img_qr.save(buf, format='PNG')
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png')
+    return _enviar_qr(url_pdf, logo_min=40)
 
 
 def revertir_ventas_por_ids(venta_ids, actor=None):
@@ -2460,8 +2546,7 @@ def revertir_ventas_por_ids(venta_ids, actor=None):
     if not venta_ids:
         raise ValueError('venta_ids requerido')
 
-    ensure_ticket_support()
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     placeholders = ','.join(['?'] * len(venta_ids))
@@ -2487,6 +2572,10 @@ def revertir_ventas_por_ids(venta_ids, actor=None):
         conn.rollback()
         conn.close()
         raise RuntimeError(f'No se pudieron revertir ventas: {e}')
+    invalidar_facetas(*{prefijo_de(info['sku']) for info in restored})
+
+    # Los tickets afectados cambian (o desaparecen): descartar sus PDF/HTML
+    ticket_cache.invalidar(venta_ids=[info['venta_id'] for info in restored], ticket_ids=ticket_ids)
 
     try:
         for tid in ticket_ids:
@@ -2547,7 +2636,7 @@ def venta_evento_abrir():
     """Abre (o reabre) el evento de venta del día actual."""
     try:
         hoy = ensure_today_event()
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("UPDATE venta_eventos SET estado='OPEN', cerrado_cuando=NULL WHERE fecha=?", (hoy,))
         conn.commit()
@@ -2578,15 +2667,8 @@ def ubicaciones_agregar():
         return jsonify({'ok': False, 'msg': 'Nombre demasiado largo'}), 400
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS ubicaciones_catalogo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            nivel TEXT NOT NULL,
-            nota TEXT,
-            UNIQUE(nivel,nombre)
-        )""")
         cur.execute("INSERT OR IGNORE INTO ubicaciones_catalogo (nombre,nivel,nota) VALUES (?,?,?)", 
                     (nombre, nivel, nota))
         conn.commit()
@@ -2613,7 +2695,7 @@ def ubicaciones_editar():
     if not rid or not nombre or not nivel:
         return jsonify({'ok': False, 'msg': 'id, nombre y nivel requeridos'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT nombre,nivel FROM ubicaciones_catalogo WHERE id=?", (rid,))
         prev = cur.fetchone()
@@ -2637,7 +2719,7 @@ def ubicaciones_eliminar():
     if not rid:
         return jsonify({'ok': False, 'msg': 'id requerido'}), 400
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT nombre,nivel FROM ubicaciones_catalogo WHERE id=?", (rid,))
         prev = cur.fetchone()
@@ -2663,16 +2745,9 @@ def ubicaciones_catalogo():
     """
     nivel = (request.args.get('nivel') or '').strip().upper()
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS ubicaciones_catalogo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            nivel TEXT NOT NULL,
-            nota TEXT,
-            UNIQUE(nivel,nombre)
-        )""")
         if nivel:
             cur.execute("SELECT id, nombre, nivel, nota FROM ubicaciones_catalogo WHERE nivel=? ORDER BY nombre", (nivel,))
         else:
@@ -19,6 +19,10 @@ def create_app() -> Any:
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
     try:
-        return module.app  # type: ignore[attr-defined]
+        flask_app = module.app  # type: ignore[attr-defined]
     except AttributeError:
         raise ImportError("El módulo app.py no expone la instancia Flask 'app'")
+    # Esquema al día una sola vez por proceso; las rutas ya no ejecutan DDL
+    from app.migrations import migrate
+    migrate(module.DB_PATH)
+    return flask_app
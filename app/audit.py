@@ -0,0 +1,164 @@
+"""Escritor asíncrono de la bitácora `movimientos`.
+
+`log_movimiento` solo encola el registro y regresa de inmediato; un único
+hilo escritor toma lo acumulado en la cola y lo inserta en una sola
+transacción (group commit). La cola es acotada: si se llena, quien registra
+espera hasta `put_timeout` segundos antes de descartar el registro.
+Al salir del proceso se vacía lo pendiente (atexit).
+"""
+
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+INSERT_SQL = ("INSERT INTO movimientos (usuario, accion, rowid_producto, sku, detalles, cuando) "
+              "VALUES (?,?,?,?,?,?)")
+
+_FIN = object()
+
+
+class AuditWriter:
+    """Hilo único que agrupa registros de auditoría y los confirma por lotes."""
+
+    def __init__(self, connect, maxsize=10000, batch_max=500, linger=0.01, put_timeout=2.0):
+        self._connect = connect
+        self._cola = queue.Queue(maxsize=maxsize)
+        self.batch_max = batch_max
+        self.linger = linger
+        self.put_timeout = put_timeout
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'encolados': 0,
+            'escritos': 0,
+            'descartados': 0,
+            'lotes': 0,
+            'errores': 0,
+            'ultimo_lote': 0,
+            'ultima_latencia_ms': 0.0,
+            'max_latencia_ms': 0.0,
+            'total_latencia_ms': 0.0,
+        }
+
+    # ---------------- API pública ----------------
+    def start(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._hilo.start()
+        atexit.register(self.stop)
+
+    def submit(self, usuario, accion, rowid_producto=None, sku=None, detalles=None):
+        """Encola un movimiento. Devuelve False si la cola siguió llena tras esperar."""
+        detalles_json = json.dumps(detalles, ensure_ascii=False, default=str) if detalles is not None else None
+        registro = (usuario, accion, rowid_producto, sku, detalles_json, datetime.now().isoformat())
+        try:
+            self._cola.put(registro, timeout=self.put_timeout)
+        except queue.Full:
+            self._stats['descartados'] += 1
+            print(f"[WARN] bitácora llena, movimiento descartado: accion={accion} sku={sku}")
+            return False
+        self._stats['encolados'] += 1
+        return True
+
+    def flush(self, timeout=5.0):
+        """Espera a que la cola se vacíe (útil antes de leer la bitácora)."""
+        limite = time.monotonic() + timeout
+        while self._cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.005)
+        return not self._cola.unfinished_tasks
+
+    def stop(self, timeout=10.0):
+        hilo = self._hilo
+        if hilo is None or not hilo.is_alive():
+            return
+        self._cola.put(_FIN)
+        hilo.join(timeout)
+
+    def stats(self):
+        data = dict(self._stats)
+        lotes = data['lotes'] or 1
+        data['promedio_latencia_ms'] = round(data.pop('total_latencia_ms') / lotes, 3)
+        data['en_cola'] = self._cola.qsize()
+        data['capacidad'] = self._cola.maxsize
+        data['activo'] = bool(self._hilo and self._hilo.is_alive())
+        return data
+
+    # ---------------- Hilo escritor ----------------
+    def _juntar_lote(self, primero):
+        lote = [primero]
+        fin = False
+        limite = time.monotonic() + self.linger
+        while len(lote) < self.batch_max:
+            try:
+                restante = limite - time.monotonic()
+                item = self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if item is _FIN:
+                self._cola.task_done()
+                fin = True
+                break
+            lote.append(item)
+        return lote, fin
+
+    def _escribir(self, conn, lote):
+        intentos = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                conn.executemany(INSERT_SQL, lote)
+                conn.commit()
+            except sqlite3.OperationalError as oe:
+                conn.rollback()
+                intentos += 1
+                if 'locked' in str(oe).lower() and intentos <= 5:
+                    time.sleep(0.1 * intentos)
+                    continue
+                raise
+            ms = (time.perf_counter() - inicio) * 1000.0
+            st = self._stats
+            st['lotes'] += 1
+            st['escritos'] += len(lote)
+            st['ultimo_lote'] = len(lote)
+            st['ultima_latencia_ms'] = round(ms, 3)
+            st['max_latencia_ms'] = max(st['max_latencia_ms'], round(ms, 3))
+            st['total_latencia_ms'] += ms
+            return
+
+    def _run(self):
+        conn = None
+        fin = False
+        while not fin:
+            primero = self._cola.get()
+            if primero is _FIN:
+                self._cola.task_done()
+                break
+            lote, fin = self._juntar_lote(primero)
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._escribir(conn, lote)
+            except Exception as e:
+                self._stats['errores'] += 1
+                self._stats['descartados'] += len(lote)
+                print(f"[WARN] bitácora: no se pudo escribir lote de {len(lote)}: {e}")
+                try:
+                    if conn is not None:
+                        conn.close()
+                except Exception:
+                    pass
+                conn = None
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
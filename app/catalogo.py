@@ -0,0 +1,94 @@
+"""Consultas de categorías (prefijos de SKU) sobre el directorio materializado.
+
+`inventory.prefijo` es una columna generada e indexada (parte del SKU antes
+del primer guion) y `categorias_directorio` guarda por prefijo el total de
+artículos, un `tipo` representativo y la última modificación; ambos los
+mantienen triggers (migración 5). Listar categorías ya no agrega toda la
+tabla de inventario.
+
+Las opciones de captura por prefijo (facetas de /entradas/options) se
+calculan con una sola consulta y quedan en un caché en memoria hasta que
+una ruta que escribe en inventory toca ese prefijo (alta, edición, venta,
+salida, cambio de precio, reversión) o vence `FACETAS_TTL`.
+"""
+
+import threading
+import time
+from collections import Counter
+
+FACETAS = ('tipo', 'marca', 'modelo', 'estado', 'ubicacion', 'volts')
+FACETAS_LIMITE = 200
+FACETAS_TTL = 300  # segundos; red de seguridad para cambios por otras rutas
+
+_facetas_cache = {}
+_facetas_generacion = {}
+_facetas_lock = threading.Lock()
+
+
+def prefijo_de(sku):
+    """Mismo criterio que la columna generada: texto antes del primer '-'."""
+    sku = sku or ''
+    return sku.split('-', 1)[0] if '-' in sku else sku
+
+
+def listar_prefijos(cur):
+    cur.execute("SELECT prefijo FROM categorias_directorio ORDER BY prefijo")
+    return [r[0] for r in cur.fetchall()]
+
+
+def directorio(cur, limit=2000):
+    """Filas (prefijo, tipo, total, actualizado) del directorio de categorías."""
+    cur.execute(
+        "SELECT prefijo, tipo, total, actualizado FROM categorias_directorio ORDER BY prefijo LIMIT ?",
+        (limit,)
+    )
+    return cur.fetchall()
+
+
+def total_categorias(cur):
+    cur.execute("SELECT COUNT(*) FROM categorias_directorio")
+    return cur.fetchone()[0] or 0
+
+
+def _clave(prefijo):
+    return (prefijo or '').strip().rstrip('-').lower()
+
+
+def calcular_facetas(cur, prefijo):
+    """Una sola pasada sobre el rango del índice de prefijo: valores y frecuencias por campo."""
+    cur.execute(
+        f"SELECT {', '.join(FACETAS)} FROM inventory WHERE prefijo = ? COLLATE NOCASE",
+        (prefijo,)
+    )
+    contadores = {col: Counter() for col in FACETAS}
+    for row in cur:
+        for col, valor in zip(FACETAS, row):
+            if valor is not None and valor != '':
+                contadores[col][valor] += 1
+    return {col: contadores[col].most_common(FACETAS_LIMITE) for col in FACETAS}
+
+
+def facetas_prefijo(cur, prefijo):
+    """Facetas del prefijo desde caché; solo consulta la BD si no hay entrada vigente."""
+    clave = _clave(prefijo)
+    ahora = time.monotonic()
+    with _facetas_lock:
+        entrada = _facetas_cache.get(clave)
+        if entrada and ahora - entrada[0] < FACETAS_TTL:
+            return entrada[1]
+        generacion = _facetas_generacion.get(clave, 0)
+    facetas = calcular_facetas(cur, prefijo.strip().rstrip('-'))
+    with _facetas_lock:
+        # Si se invalidó mientras se calculaba, no guardar un resultado viejo
+        if _facetas_generacion.get(clave, 0) == generacion:
+            _facetas_cache[clave] = (ahora, facetas)
+    return facetas
+
+
+def invalidar_facetas(*prefijos):
+    with _facetas_lock:
+        for prefijo in prefijos:
+            if prefijo:
+                clave = _clave(prefijo)
+                _facetas_cache.pop(clave, None)
+                _facetas_generacion[clave] = _facetas_generacion.get(clave, 0) + 1
@@ -0,0 +1,56 @@
+"""Contadores del dashboard leídos de la tabla `stats_counters`.
+
+Los triggers de la migración 8 mantienen una fila por clave:
+
+- `total:<tabla>` para inventory, usuarios, movimientos, ventas y
+  categorias_directorio;
+- `estado:<estado>` con el número de artículos en cada estado;
+- `entradas:<AAAA-MM-DD>` altas de inventario por día de registro;
+- `salidas:<AAAA-MM-DD>` artículos que pasaron a VENDIDO/DONADO/OBSOLETO ese
+  día (un evento por cambio de estado; revertir una venta no lo descuenta).
+
+Los diarios se conservan `RETENCION_DIAS` días. El total por prefijo ya vive
+en `categorias_directorio` (app/catalogo.py). /admin y /config leen todo por
+clave primaria en lugar de recorrer las tablas.
+"""
+
+from datetime import date, timedelta
+
+TABLAS = ('inventory', 'usuarios', 'movimientos', 'ventas', 'categorias_directorio')
+
+
+def contadores(cur, *claves):
+    """Valores de las claves pedidas (0 si aún no existen)."""
+    marcas = ','.join('?' * len(claves))
+    cur.execute(f"SELECT clave, valor FROM stats_counters WHERE clave IN ({marcas})", claves)
+    valores = dict(cur.fetchall())
+    return {c: valores.get(c, 0) or 0 for c in claves}
+
+
+def totales(cur):
+    """{tabla: filas} para las tablas con contador."""
+    vals = contadores(cur, *(f"total:{t}" for t in TABLAS))
+    return {t: vals[f"total:{t}"] for t in TABLAS}
+
+
+def recientes(cur, tipo, dias=7, hoy=None):
+    """Suma de `entradas` o `salidas` de los últimos `dias` días (incluye hoy)."""
+    hoy = hoy or date.today()
+    desde = (hoy - timedelta(days=dias - 1)).isoformat()
+    cur.execute("SELECT COALESCE(SUM(valor), 0) FROM stats_counters WHERE clave BETWEEN ? AND ?",
+                (f"{tipo}:{desde}", f"{tipo}:{hoy.isoformat()}"))
+    return cur.fetchone()[0] or 0
+
+
+def resumen(cur, dias=7):
+    """Cifras del dashboard de /admin y /config."""
+    t = totales(cur)
+    return {
+        'total_productos': t['inventory'],
+        'total_usuarios': t['usuarios'],
+        'total_movimientos': t['movimientos'],
+        'total_ventas': t['ventas'],
+        'total_categorias': t['categorias_directorio'],
+        'entradas_recientes': recientes(cur, 'entradas', dias),
+        'salidas_recientes': recientes(cur, 'salidas', dias),
+    }
@@ -0,0 +1,187 @@
+"""Capa de conexiones SQLite reutilizables para las rutas de la app.
+
+En lugar de abrir una conexión nueva con `sqlite3.connect(DB_PATH)` en cada
+ruta, se mantienen dos pools:
+
+- escritura: conexiones normales (WAL, busy_timeout, cache, mmap, synchronous).
+- lectura: mismas pragmas más `PRAGMA query_only=ON`, usado por las rutas GET.
+
+Las pragmas se aplican una sola vez, al crear cada conexión. `conn.close()`
+no cierra la conexión: la devuelve al pool (con rollback de lo pendiente), de
+forma que el código existente que llama a `close()` sigue funcionando igual.
+Al terminar la petición, `teardown_appcontext` devuelve lo que quede abierto.
+"""
+
+import queue
+import sqlite3
+import threading
+
+try:
+    from flask import g, has_app_context, has_request_context, request
+except Exception:  # pragma: no cover - scripts sin Flask
+    g = None
+
+    def has_app_context():
+        return False
+
+    def has_request_context():
+        return False
+
+    request = None
+
+
+# Pragmas aplicadas una vez por conexión
+PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",      # ~16 MB de caché de páginas
+    "PRAGMA mmap_size=67108864",     # 64 MB mapeados en memoria
+    "PRAGMA synchronous=NORMAL",     # seguro con WAL
+    "PRAGMA temp_store=MEMORY",
+)
+POOL_SIZE = 8          # igual al número de hilos de waitress (run.py)
+STATEMENT_CACHE = 256  # sentencias preparadas por conexión
+
+_G_KEYS = {True: "_db_lectura", False: "_db_escritura"}
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión cuyo `close()` la devuelve al pool en vez de cerrarla."""
+
+    _pool = None
+    _prestada = False
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            return super().close()
+        pool.release(self)
+
+    def cerrar_definitivo(self):
+        super().close()
+
+
+class ConnectionPool:
+    """Pool acotado de conexiones SQLite con pragmas aplicadas al crearlas."""
+
+    def __init__(self, db_path, readonly=False, size=POOL_SIZE):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.size = size
+        self._libres = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._creadas = 0
+
+    def _crear(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=5,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE,
+            factory=PooledConnection,
+        )
+        cur = conn.cursor()
+        if not self.readonly:
+            try:
+                cur.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.OperationalError:
+                pass
+        for pragma in PRAGMAS:
+            try:
+                cur.execute(pragma)
+            except sqlite3.OperationalError:
+                pass
+        if self.readonly:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+        conn._pool = self
+        with self._lock:
+            self._creadas += 1
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._libres.get_nowait()
+        except queue.Empty:
+            conn = self._crear()
+        conn._prestada = True
+        return conn
+
+    def release(self, conn):
+        if not conn._prestada:
+            return
+        conn._prestada = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            conn.cerrar_definitivo()
+            return
+        try:
+            self._libres.put_nowait(conn)
+        except queue.Full:
+            conn.cerrar_definitivo()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            conn.cerrar_definitivo()
+
+    def stats(self):
+        return {'creadas': self._creadas, 'libres': self._libres.qsize(), 'tamano': self.size}
+
+
+_pools = {}
+
+
+def configure(db_path, size=POOL_SIZE):
+    """Crea (o recrea) los pools de lectura y escritura para `db_path`."""
+    for pool in _pools.values():
+        pool.close_all()
+    _pools[False] = ConnectionPool(db_path, readonly=False, size=size)
+    _pools[True] = ConnectionPool(db_path, readonly=True, size=size)
+
+
+def get_pool(readonly=False):
+    try:
+        return _pools[bool(readonly)]
+    except KeyError:
+        raise RuntimeError("Pool de conexiones no configurado; llama a db.configure()")
+
+
+def get_db(readonly=None):
+    """Devuelve una conexión del pool para la petición actual.
+
+    Por defecto las peticiones GET/HEAD reciben una conexión de solo lectura;
+    las rutas GET que escriben deben pedir `readonly=False`. Dentro de una
+    petición la misma conexión se reutiliza hasta que se llama a `close()`.
+    Fuera de contexto de Flask se entrega una conexión de escritura que debe
+    devolverse con `close()`.
+    """
+    if readonly is None:
+        readonly = has_request_context() and request.method in ('GET', 'HEAD')
+    readonly = bool(readonly)
+    if not has_app_context():
+        return get_pool(readonly).acquire()
+    key = _G_KEYS[readonly]
+    conn = g.get(key)
+    if conn is None or not conn._prestada:
+        conn = get_pool(readonly).acquire()
+        setattr(g, key, conn)
+    return conn
+
+
+def release_db(exc=None):
+    """Devuelve al pool las conexiones que la petición dejó abiertas."""
+    for key in _G_KEYS.values():
+        conn = g.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+
+def init_app(app, db_path):
+    configure(db_path)
+    app.teardown_appcontext(release_db)
@@ -0,0 +1,402 @@
+"""Bus de escaneos: entrega por empuje (SSE / long-poll) en lugar de sondear /last_scanned.
+
+Antes había una sola ranura global `last_scanned` que se vaciaba al leerla:
+cada pestaña abierta la consultaba cada 700 ms aunque nadie escaneara, y un
+código podía perderse o llegarle a otra pestaña. Aquí cada escaneo
+(`serial_worker`, `/push_scan`, `/simulate_scan`) se publica como un evento
+con id creciente en una *estación* con nombre: cada PC con escáner
+(`scripts/serial_forwarder.py --estacion caja1`) publica en la suya y cada
+navegador se suscribe a una, así dos cajas no se pisan los códigos. Los que
+no dicen estación usan `ESTACION_PRINCIPAL`.
+
+Cada estación tiene su propio candado, su secuencia y su historial circular:
+
+- el historial deja que un cliente que se reconecta con su cursor (el último
+  id que vio) reciba lo que se perdió;
+- cada escaneo se copia a la cola propia de los suscriptores de esa estación
+  (flujo SSE) y despierta solo a los long-poll de esa estación.
+
+Los forwarders envían ráfagas en lote (`publicar_lote`) con un id propio por
+escaneo; cada estación recuerda los últimos ids vistos, así un lote
+reenviado tras perder la respuesta no duplica códigos.
+
+Las estaciones que nadie usa se desalojan cuando se llega a
+`max_estaciones`: primero las que nunca recibieron un escaneo (p. ej. una
+página abierta con una estación mal escrita), después las inactivas desde
+hace más de `inactiva` segundos. Una estación con flujos o long-polls
+abiertos nunca se desaloja.
+
+Publicar en una estación no bloquea a las demás. Los ids parten de la hora
+de arranque en milisegundos, así que siguen creciendo tras reiniciar el
+servidor y un cursor viejo nunca oculta eventos nuevos.
+"""
+
+import json
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+ESTACION_PRINCIPAL = 'principal'
+_NOMBRE_VALIDO = re.compile(r'^[a-z0-9][a-z0-9_.-]{0,39}$')
+
+
+class EstacionInvalida(ValueError):
+    pass
+
+
+def nombre_estacion(valor):
+    """Normaliza el nombre de una estación (minúsculas, sin espacios); vacío = principal."""
+    nombre = str(valor or '').strip().lower().replace(' ', '-')
+    if not nombre:
+        return ESTACION_PRINCIPAL
+    if not _NOMBRE_VALIDO.match(nombre):
+        raise EstacionInvalida('estación inválida: usa letras, números, "-", "_" o "." (máx. 40)')
+    return nombre
+
+
+class Suscripcion:
+    """Cola de eventos de un cliente; si se llena se descartan los más viejos."""
+
+    def __init__(self, max_cola, canal=None):
+        self._cola = queue.Queue(maxsize=max_cola)
+        self.canal = canal  # Estacion; None tras cancelar
+        self.descartados = 0
+
+    def entregar(self, evento):
+        while True:
+            try:
+                self._cola.put_nowait(evento)
+                return
+            except queue.Full:
+                try:
+                    self._cola.get_nowait()
+                    self.descartados += 1
+                except queue.Empty:
+                    pass
+
+    def obtener(self, timeout):
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Estacion:
+    """Canal de una estación: secuencia, historial acotado y suscriptores propios."""
+
+    def __init__(self, nombre, historial, max_vistos=5000):
+        self.nombre = nombre
+        self._eventos = deque(maxlen=historial)
+        self._vistos = OrderedDict()  # id del cliente -> id del evento (idempotencia de lotes)
+        self.max_vistos = max_vistos
+        self._seq = int(time.time() * 1000)
+        self._cond = threading.Condition()
+        self._suscriptores = set()
+        self._leido_legacy = self._seq  # cursor de /last_scanned
+        self._esperando = 0  # long-polls en curso
+        self.desalojada = False
+        self.publicados = 0
+        self.origen = None
+        self.ultimo = None  # hora del último escaneo
+        self.actividad = time.monotonic()  # creación o último escaneo, para desalojar
+
+    def cursor(self):
+        with self._cond:
+            return self._seq
+
+    def _nuevo_evento(self, code, origen, escaneado=None):
+        # Con self._cond tomado
+        self._seq += 1
+        evento = {'id': self._seq, 'code': code, 'estacion': self.nombre, 'origen': origen,
+                  'ts': datetime.now().isoformat(timespec='milliseconds')}
+        if escaneado:
+            evento['escaneado'] = escaneado
+        self._eventos.append(evento)
+        self.publicados += 1
+        self.origen = origen
+        self.ultimo = evento['ts']
+        self.actividad = time.monotonic()
+        return evento
+
+    def publicar(self, code, origen):
+        """Publica un escaneo; None si la estación ya fue desalojada (hay que pedirla de nuevo)."""
+        with self._cond:
+            if self.desalojada:
+                return None
+            evento = self._nuevo_evento(code, origen)
+            suscriptores = list(self._suscriptores)
+            self._cond.notify_all()
+        for sub in suscriptores:
+            sub.entregar(evento)
+        return evento
+
+    def publicar_lote(self, escaneos, origen):
+        """Publica [(id_cliente, code, escaneado)] de una vez, despertando a los clientes una sola vez.
+
+        Devuelve [(id_cliente, id del evento, duplicado)]: un id_cliente ya
+        visto no se publica de nuevo y devuelve el evento original.
+        """
+        resultado, nuevos = [], []
+        with self._cond:
+            if self.desalojada:
+                return None
+            for id_cliente, code, escaneado in escaneos:
+                previo = self._vistos.get(id_cliente) if id_cliente else None
+                if previo is not None:
+                    resultado.append((id_cliente, previo, True))
+                    continue
+                evento = self._nuevo_evento(code, origen, escaneado)
+                nuevos.append(evento)
+                resultado.append((id_cliente, evento['id'], False))
+                if id_cliente:
+                    self._vistos[id_cliente] = evento['id']
+                    if len(self._vistos) > self.max_vistos:
+                        self._vistos.popitem(last=False)
+            suscriptores = list(self._suscriptores)
+            if nuevos:
+                self._cond.notify_all()
+        for sub in suscriptores:
+            for evento in nuevos:
+                sub.entregar(evento)
+        return resultado
+
+    def desde(self, cursor):
+        with self._cond:
+            return [e for e in self._eventos if e['id'] > cursor]
+
+    def incompleto(self, cursor):
+        with self._cond:
+            return bool(self._eventos) and cursor < self._eventos[0]['id'] - 1
+
+    def esperar(self, cursor, timeout):
+        """(eventos posteriores a `cursor`, cursor desde el que seguir).
+
+        Si la secuencia avanzó sin eventos que entregar (estación recreada o
+        historial desbordado) se devuelve la secuencia actual, para que el
+        cliente no vuelva a preguntar en seguida con el mismo cursor.
+        """
+        with self._cond:
+            self._esperando += 1
+            try:
+                self._cond.wait_for(lambda: self._seq > cursor or self.desalojada, timeout)
+            finally:
+                self._esperando -= 1
+            eventos = [e for e in self._eventos if e['id'] > cursor]
+            return eventos, (eventos[-1]['id'] if eventos else max(cursor, self._seq))
+
+    def desalojable(self, inactiva):
+        """Prioridad para desalojarla (menor primero), o None si está en uso o activa."""
+        with self._cond:
+            if self._suscriptores or self._esperando:
+                return None
+            if not self.publicados:
+                return (0, self.actividad)
+            if time.monotonic() - self.actividad > inactiva:
+                return (1, self.actividad)
+            return None
+
+    def desalojar(self):
+        with self._cond:
+            self.desalojada = True
+            self._cond.notify_all()
+
+    def agregar(self, sub):
+        with self._cond:
+            self._suscriptores.add(sub)
+
+    def quitar(self, sub):
+        with self._cond:
+            self._suscriptores.discard(sub)
+
+    def tomar_ultimo(self):
+        with self._cond:
+            if self._eventos and self._eventos[-1]['id'] > self._leido_legacy:
+                self._leido_legacy = self._eventos[-1]['id']
+                return self._eventos[-1]['code']
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'estacion': self.nombre,
+                'cursor': self._seq,
+                'publicados': self.publicados,
+                'historial': len(self._eventos),
+                'suscriptores': len(self._suscriptores),
+                'descartados': sum(s.descartados for s in self._suscriptores),
+                'origen': self.origen,
+                'ultimo': self.ultimo,
+            }
+
+
+class ScanBus:
+    """Estaciones de escaneo por nombre; se crean al primer uso (hasta `max_estaciones`).
+
+    El tope de suscriptores es global: cada flujo SSE retiene un hilo de
+    waitress sin importar la estación.
+    """
+
+    def __init__(self, historial=500, max_cola=100, max_suscriptores=4, max_estaciones=64, inactiva=600):
+        self.historial = historial
+        self.max_cola = max_cola
+        self.max_suscriptores = max_suscriptores
+        self.max_estaciones = max_estaciones
+        self.inactiva = inactiva
+        self._lock = threading.Lock()
+        self._estaciones = {}
+        self._suscriptores = 0
+
+    def estacion(self, nombre=None):
+        """La estación `nombre` (normalizado), creándola si no existe.
+
+        Lanza `EstacionInvalida` si el nombre no es válido o ya hay
+        `max_estaciones` estaciones en uso (ninguna se puede desalojar).
+        """
+        nombre = nombre_estacion(nombre)
+        est = self._estaciones.get(nombre)
+        if est is not None:
+            return est
+        with self._lock:
+            return self._obtener(nombre)
+
+    def _obtener(self, nombre):
+        # Con self._lock tomado
+        est = self._estaciones.get(nombre)
+        if est is None:
+            if len(self._estaciones) >= self.max_estaciones:
+                self._desalojar()
+            est = self._estaciones[nombre] = Estacion(nombre, self.historial)
+        return est
+
+    def _desalojar(self):
+        # Con self._lock tomado
+        candidatas = []
+        for est in self._estaciones.values():
+            prioridad = est.desalojable(self.inactiva)
+            if prioridad is not None:
+                candidatas.append((prioridad, est.nombre))
+        if not candidatas:
+            raise EstacionInvalida(f'demasiadas estaciones en uso (máx. {self.max_estaciones})')
+        _, nombre = min(candidatas)
+        self._estaciones.pop(nombre).desalojar()
+
+    def estaciones(self):
+        with self._lock:
+            return sorted(self._estaciones)
+
+    def cursor(self, estacion=None):
+        return self.estacion(estacion).cursor()
+
+    def publicar(self, code, origen=None, estacion=None):
+        """Publica un escaneo en `estacion`; devuelve el evento (None si el código está vacío)."""
+        code = str(code or '').strip()
+        if not code:
+            return None
+        while True:
+            evento = self.estacion(estacion).publicar(code, origen)
+            if evento is not None:
+                return evento
+
+    def publicar_lote(self, escaneos, origen=None, estacion=None):
+        """Publica un lote [(id_cliente, code, escaneado)] en `estacion`; ver `Estacion.publicar_lote`."""
+        while True:
+            resultado = self.estacion(estacion).publicar_lote(escaneos, origen)
+            if resultado is not None:
+                return resultado
+
+    def desde(self, cursor, estacion=None):
+        """Eventos del historial de `estacion` posteriores a `cursor`."""
+        return self.estacion(estacion).desde(cursor)
+
+    def incompleto(self, cursor, estacion=None):
+        """True si hubo eventos después de `cursor` que ya salieron del historial."""
+        return self.estacion(estacion).incompleto(cursor)
+
+    def esperar(self, cursor, timeout, estacion=None):
+        """Long-poll: espera hasta `timeout` segundos a que `estacion` tenga eventos después de `cursor`.
+
+        Devuelve (eventos, cursor siguiente); ver `Estacion.esperar`.
+        """
+        return self.estacion(estacion).esperar(cursor, timeout)
+
+    def suscribir(self, estacion=None):
+        """Nueva cola para un flujo SSE de `estacion`, o None si ya hay `max_suscriptores` abiertos."""
+        nombre = nombre_estacion(estacion)
+        with self._lock:
+            if self._suscriptores >= self.max_suscriptores:
+                return None
+            # Dentro del candado: la estación no puede desalojarse antes de tener el suscriptor
+            est = self._obtener(nombre)
+            self._suscriptores += 1
+            sub = Suscripcion(self.max_cola, est)
+            est.agregar(sub)
+        return sub
+
+    def cancelar(self, sub):
+        """Quita la suscripción; se puede llamar más de una vez."""
+        with self._lock:
+            est, sub.canal = sub.canal, None
+            if est is None:
+                return
+            self._suscriptores -= 1
+        est.quitar(sub)
+
+    def tomar_ultimo(self, estacion=None):
+        """Compatibilidad con /last_scanned: el último código de `estacion` aún no leído por esa ruta."""
+        return self.estacion(estacion).tomar_ultimo()
+
+    def stats(self):
+        with self._lock:
+            estaciones = list(self._estaciones.values())
+            suscriptores = self._suscriptores
+        por_estacion = [e.stats() for e in sorted(estaciones, key=lambda e: e.nombre)]
+        return {
+            'estaciones': por_estacion,
+            'publicados': sum(e['publicados'] for e in por_estacion),
+            'suscriptores': suscriptores,
+            'max_suscriptores': self.max_suscriptores,
+        }
+
+
+def formato_sse(evento, nombre='escaneo'):
+    datos = json.dumps(evento, ensure_ascii=False)
+    return f"id: {evento['id']}\nevent: {nombre}\ndata: {datos}\n\n"
+
+
+def flujo_sse(bus, sub, cursor, duracion, latido):
+    """Generador del flujo SSE de una suscripción (ya creada con `bus.suscribir()`).
+
+    Primero reenvía lo que el cliente se perdió desde `cursor` (Last-Event-ID),
+    luego los eventos en vivo de la estación; manda un comentario de latido
+    cada `latido` segundos y cierra tras `duracion` segundos (EventSource se
+    reconecta solo, con su último id). La suscripción se cancela siempre al
+    terminar.
+    """
+    est = sub.canal
+    if cursor is not None and cursor > est.cursor():
+        cursor = None  # cursor de otro arranque con el reloj adelantado: empezar desde ahora
+    try:
+        yield "retry: 2000\n\n"
+        ultimo = est.cursor() if cursor is None else cursor
+        if cursor is not None:
+            for evento in est.desde(cursor):
+                yield formato_sse(evento)
+                ultimo = evento['id']
+        # Primer id para que Last-Event-ID tenga valor aunque aún no haya escaneos
+        yield formato_sse({'id': ultimo, 'estacion': est.nombre,
+                           'incompleto': cursor is not None and est.incompleto(cursor)}, 'hola')
+        fin = time.monotonic() + duracion
+        while time.monotonic() < fin:
+            evento = sub.obtener(timeout=min(latido, max(0.1, fin - time.monotonic())))
+            if evento is None:
+                yield ": latido\n\n"
+                continue
+            if evento['id'] <= ultimo:
+                continue
+            ultimo = evento['id']
+            yield formato_sse(evento)
+    finally:
+        bus.cancelar(sub)
@@ -0,0 +1,193 @@
+"""Hojas de etiquetas de activo (QR + Code128) para imprimir en lote.
+
+Cada etiqueta lleva un QR con el SKU (con el logo al centro), el Code128
+del número de serie (o del SKU si no tiene), y los datos de `inventory`
+(SKU, marca/modelo, tipo, ubicación, serie). Los códigos se dibujan como
+vectores con ReportLab: el QR se traza como un solo path de rectángulos a
+partir de la matriz de `qrcode` (con caché por texto) y el Code128 con el
+widget de ReportLab, sin generar imágenes. El logo es la variante `qr` ya
+precalculada y se incrusta una sola vez por documento.
+
+Las hojas grandes se reparten en partes de varias páginas completas que se
+dibujan en paralelo en el pool de `app.pdf` (`ServicioPDF.por_partes`), así
+que miles de etiquetas salen en una sola petición.
+"""
+
+from functools import lru_cache
+from io import BytesIO
+
+from app.search import plan_busqueda
+
+try:
+    import qrcode
+except Exception:
+    qrcode = None
+
+try:
+    from reportlab.graphics.barcode import code128, qrencoder
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.pdfgen import canvas
+except Exception:
+    canvas = None
+
+VERSION = 1  # forma parte de la llave de las hojas ya generadas
+MAX_ETIQUETAS = 10000
+PAGINAS_POR_PARTE = 10
+COLUMNAS = ('sku', 'tipo', 'marca', 'modelo', 'no_serie', 'ubicacion')
+
+# nombre -> (columnas, filas, ancho, alto, margen izquierdo, margen superior, separación horizontal,
+#            separación vertical), en mm sobre A4 vertical
+FORMATOS = {
+    'a4-3x8': (3, 8, 70, 37, 0, 0.5, 0, 0),
+    'a4-2x7': (2, 7, 99.1, 38.1, 4.65, 15.15, 2.5, 0),  # L7163
+}
+
+
+def disponible():
+    return canvas is not None
+
+
+def consulta_etiquetas(cur, prefijo=None, ubicacion=None, skus=None, q=None, limit=MAX_ETIQUETAS):
+    """(sql, params) de los productos a etiquetar; los filtros se combinan, orden por SKU."""
+    columnas = ', '.join(f"i.{c}" for c in COLUMNAS)
+    if q:
+        sql, params = plan_busqueda(cur, q, prefijo=prefijo, columnas=columnas)
+        sql, params, where = f"SELECT * FROM ({sql}) i", list(params), []
+    else:
+        sql, params, where = f"SELECT {columnas} FROM inventory i", [], []
+        if prefijo:
+            where.append("i.prefijo = ? COLLATE NOCASE")
+            params.append(prefijo)
+    if ubicacion:
+        where.append("i.ubicacion = ? COLLATE NOCASE")
+        params.append(ubicacion)
+    if skus:
+        where.append(f"i.sku IN ({','.join('?' * len(skus))})")
+        params += list(skus)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY i.sku LIMIT ?"
+    params.append(limit)
+    return sql, params
+
+
+def leer_etiquetas(cur, **filtros):
+    sql, params = consulta_etiquetas(cur, **filtros)
+    cur.execute(sql, params)
+    return [dict(zip(COLUMNAS, row)) for row in cur.fetchall()]
+
+
+def por_hoja(formato):
+    columnas, filas = FORMATOS[formato][:2]
+    return columnas * filas
+
+
+@lru_cache(maxsize=4096)
+def _matriz_qr(texto):
+    if qrcode is not None:
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_H, border=0)
+        qr.add_data(texto)
+        qr.make(fit=True)
+        return tuple(tuple(fila) for fila in qr.get_matrix())
+    qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.H)
+    qr.addData(texto)
+    qr.make()
+    return tuple(tuple(bool(m) for m in fila) for fila in qr.modules)
+
+
+def _dibujar_qr(c, texto, x, y, lado):
+    """QR como un solo path: un rectángulo por tramo horizontal de módulos negros."""
+    matriz = _matriz_qr(texto)
+    n = len(matriz)
+    modulo = lado / n
+    path = c.beginPath()
+    for r, fila in enumerate(matriz):
+        col = 0
+        while col < n:
+            if fila[col]:
+                inicio = col
+                while col < n and fila[col]:
+                    col += 1
+                path.rect(x + inicio * modulo, y + (n - 1 - r) * modulo, (col - inicio) * modulo, modulo)
+            else:
+                col += 1
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def _recortar(texto, fuente, tamano, ancho):
+    texto = '' if texto is None else str(texto)
+    if stringWidth(texto, fuente, tamano) <= ancho:
+        return texto
+    while texto and stringWidth(texto + '…', fuente, tamano) > ancho:
+        texto = texto[:-1]
+    return texto + '…'
+
+
+def _etiqueta(c, e, x, y, ancho, alto, logo):
+    pad = 2 * mm
+    lado = alto - 2 * pad
+    _dibujar_qr(c, e['sku'] or '', x + pad, y + pad, lado)
+    if logo is not None:
+        # Logo al centro del QR, como en los QR de tickets (corrección H: tolera el hueco)
+        lado_logo = lado * 0.22
+        lx, ly = x + pad + (lado - lado_logo) / 2, y + pad + (lado - lado_logo) / 2
+        c.setFillColorRGB(1, 1, 1)
+        c.rect(lx - 1, ly - 1, lado_logo + 2, lado_logo + 2, stroke=0, fill=1)
+        c.setFillColorRGB(0, 0, 0)
+        c.drawImage(logo, lx, ly, lado_logo, lado_logo, preserveAspectRatio=True, mask='auto')
+
+    tx = x + 2 * pad + lado
+    disponible_x = x + ancho - pad - tx
+    tope = y + alto - pad
+    # El SKU se achica (hasta 6 pt) antes de recortarse: es el dato que más importa
+    tamano = 9
+    while tamano > 6 and stringWidth(e['sku'] or '', 'Helvetica-Bold', tamano) > disponible_x:
+        tamano -= 0.5
+    c.setFont('Helvetica-Bold', tamano)
+    c.drawString(tx, tope - 8, _recortar(e['sku'], 'Helvetica-Bold', tamano, disponible_x))
+    c.setFont('Helvetica', 7)
+    marca_modelo = ' '.join(v for v in (e.get('marca'), e.get('modelo')) if v)
+    c.drawString(tx, tope - 17, _recortar(marca_modelo, 'Helvetica', 7, disponible_x))
+    c.setFont('Helvetica', 6)
+    detalle = ' · '.join(v for v in (e.get('tipo'), e.get('ubicacion')) if v)
+    c.drawString(tx, tope - 25, _recortar(detalle, 'Helvetica', 6, disponible_x))
+    if e.get('no_serie'):
+        c.drawString(tx, tope - 32, _recortar(f"S/N: {e['no_serie']}", 'Helvetica', 6, disponible_x))
+
+    valor = e.get('no_serie') or e['sku'] or ''
+    if valor:
+        barras = code128.Code128(valor, barHeight=7 * mm, barWidth=0.25 * mm, quiet=False)
+        if barras.width > disponible_x:
+            barras = code128.Code128(valor, barHeight=7 * mm, barWidth=0.25 * mm * disponible_x / barras.width,
+                                     quiet=False)
+        barras.drawOn(c, tx, y + pad)
+
+
+def etiquetas_pdf(etiquetas, formato='a4-3x8', logo=None, destino=None):
+    """PDF (bytes) con `etiquetas` en la cuadrícula de `formato`; se escribe en `destino` si se indica."""
+    columnas, filas, ancho, alto, izq, sup, sep_x, sep_y = FORMATOS[formato]
+    ancho, alto, izq, sup, sep_x, sep_y = (v * mm for v in (ancho, alto, izq, sup, sep_x, sep_y))
+    buf = destino or BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    c.setTitle('Etiquetas')
+    imagen = ImageReader(BytesIO(logo)) if logo else None
+    por_pagina = columnas * filas
+    for i, e in enumerate(etiquetas):
+        if i and i % por_pagina == 0:
+            c.showPage()
+        fila, col = divmod(i % por_pagina, columnas)
+        x = izq + col * (ancho + sep_x)
+        y = A4[1] - sup - (fila + 1) * alto - fila * sep_y
+        _etiqueta(c, e, x, y, ancho, alto, imagen)
+    c.save()
+    return None if destino else buf.getvalue()
+
+
+def hoja_etiquetas(servicio, etiquetas, formato, logo, destino, titulo='Etiquetas'):
+    """Genera la hoja en `destino` en partes de páginas completas, en paralelo."""
+    por_parte = por_hoja(formato) * PAGINAS_POR_PARTE
+    partes = [(etiquetas[i:i + por_parte], formato, logo) for i in range(0, len(etiquetas), por_parte)]
+    return servicio.por_partes(etiquetas_pdf, partes, destino, titulo=titulo)
@@ -0,0 +1,123 @@
+"""Exportaciones XLSX en streaming, sin pandas.
+
+Las filas se leen del cursor por lotes (`fetchmany`) y se agregan a un libro
+openpyxl en modo `write_only`, que vuelca cada hoja a disco conforme se
+escribe, así que la memoria queda plana sin importar el número de filas.
+El .xlsx (un zip) se genera en el hilo de exportaciones (app/trabajos.py) y
+se sirve desde disco. Las columnas de cada tabla salen de `PRAGMA
+table_info`, que omite las columnas generadas (`prefijo`, `no_serie_norm`),
+así que los respaldos conservan el formato de siempre.
+"""
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from app.search import columnas_producto, plan_busqueda
+
+MIME_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+LOTE_FILAS = 1000
+MAX_FILAS_HOJA = 1048575  # límite de Excel menos el encabezado
+
+# Hojas del respaldo completo, en el orden de siempre
+RESPALDO = (('Inventario', 'inventory'), ('Usuarios', 'usuarios'),
+            ('Movimientos', 'movimientos'), ('Ventas', 'ventas'))
+
+# Exportaciones conocidas: tablas que leen (para la llave del artefacto),
+# nombre base del archivo y acción que se registra en movimientos
+EXPORTACIONES = {
+    'respaldo': {'tablas': ('inventory', 'usuarios', 'movimientos', 'ventas'),
+                 'archivo': 'backup_inventario_ccc', 'accion': 'EXPORTAR_EXCEL'},
+    'inventario': {'tablas': ('inventory',), 'archivo': 'inventario_ccc', 'accion': 'EXPORTAR_INVENTARIO'},
+    'usuarios': {'tablas': ('usuarios',), 'archivo': 'usuarios_ccc', 'accion': 'EXPORTAR_USUARIOS'},
+    'movimientos': {'tablas': ('movimientos',), 'archivo': 'movimientos_ccc', 'accion': 'EXPORTAR_MOVIMIENTOS'},
+    'ventas': {'tablas': ('ventas',), 'archivo': 'ventas_ccc', 'accion': 'EXPORTAR_VENTAS'},
+    'categoria': {'tablas': ('inventory',), 'archivo': 'productos_{prefijo}', 'accion': 'EXPORTAR_CATEGORIA'},
+}
+_TITULOS = {tabla: titulo for titulo, tabla in RESPALDO}
+
+
+def columnas_tabla(cur, tabla):
+    cur.execute(f"PRAGMA table_info({tabla})")
+    return [r[1] for r in cur.fetchall()]
+
+
+def consulta_tabla(cur, tabla):
+    """(sql, params) para volcar una tabla completa con sus columnas reales."""
+    cols = ', '.join(columnas_tabla(cur, tabla))
+    return f"SELECT {cols} FROM {tabla}", []
+
+
+def hoja_tabla(cur, titulo, tabla):
+    sql, params = consulta_tabla(cur, tabla)
+    return (titulo, sql, params)
+
+
+def hojas_exportacion(cur, tipo, params=None):
+    """Hojas [(titulo, sql, params)] de una exportación de `EXPORTACIONES`."""
+    params = params or {}
+    if tipo == 'categoria':
+        prefijo, q = params['prefijo'], params.get('q') or ''
+        # misma búsqueda que productos_por_categoria
+        columnas = columnas_producto('i', rowid_como='id')
+        if q:
+            sql, args = plan_busqueda(cur, q, prefijo=prefijo, columnas=columnas)
+        else:
+            sql, args = f"SELECT {columnas} FROM inventory i WHERE i.prefijo = ? COLLATE NOCASE", [prefijo]
+        return [(f'Productos_{prefijo}', sql, args)]
+    return [hoja_tabla(cur, _TITULOS[t], t) for t in EXPORTACIONES[tipo]['tablas']]
+
+
+def nombre_archivo(tipo, params=None):
+    return EXPORTACIONES[tipo]['archivo'].format(**(params or {}))
+
+
+def _celda(valor):
+    if isinstance(valor, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', valor)
+    if isinstance(valor, bytes):
+        return valor.hex()
+    return valor
+
+
+def filas(cur):
+    """Genera las filas de un cursor ya ejecutado leyéndolas por lotes."""
+    while True:
+        lote = cur.fetchmany(LOTE_FILAS)
+        if not lote:
+            break
+        yield from lote
+
+
+def escribir_xlsx(conn, hojas, destino, progreso=None):
+    """Escribe `hojas` [(titulo, sql, params)] en `destino`. Devuelve {titulo: filas}.
+
+    Una hoja que pase el límite de filas de Excel continúa en 'Titulo (2)', etc.
+    `progreso(titulo, filas)` se llama cada `LOTE_FILAS` filas si se indica.
+    """
+    wb = Workbook(write_only=True)
+    conteos = {}
+    cur = conn.cursor()
+    for titulo, sql, params in hojas:
+        titulo = titulo[:31]
+        cur.execute(sql, params)
+        encabezado = [d[0] for d in cur.description]
+        ws, parte, en_hoja, total = None, 0, MAX_FILAS_HOJA, 0
+        for row in filas(cur):
+            if en_hoja >= MAX_FILAS_HOJA:
+                parte += 1
+                nombre = titulo if parte == 1 else f"{titulo[:26]} ({parte})"
+                ws = wb.create_sheet(nombre)
+                ws.append(encabezado)
+                en_hoja = 0
+            ws.append([_celda(v) for v in row])
+            en_hoja += 1
+            total += 1
+            if progreso and total % LOTE_FILAS == 0:
+                progreso(titulo, total)
+        if ws is None:
+            wb.create_sheet(titulo).append(encabezado)
+        conteos[titulo] = total
+        if progreso:
+            progreso(titulo, total)
+    wb.save(destino)
+    return conteos
@@ -0,0 +1,113 @@
+"""Variantes precalculadas del logo (static/images/CCClogo.jpg, 2048x2048).
+
+El original pesa ~800 KB; decodificarlo y redimensionarlo en cada QR o PDF
+era lo más caro de esas rutas. `LogoVariantes.preparar()` genera una sola
+vez, al arrancar, cada variante de `VARIANTES` en el directorio de caché y
+las deja en memoria. Los nombres de archivo llevan una huella del original
+(tamaño + mtime) y de la especificación, así que en arranques posteriores
+solo se leen los archivos chicos; el original solo se vuelve a decodificar
+si cambia.
+
+- `qr`: PNG RGBA para superponer al centro de los QR (se reescala desde
+  esta variante, con caché por ancho);
+- `ticket`: JPEG para el encabezado de los PDF, embebido como data URI;
+- `web`: JPEG para las páginas (servido por /logo/web.jpg).
+"""
+
+import base64
+import hashlib
+import os
+import threading
+from io import BytesIO
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+# nombre -> (lado mayor en px, formato PIL, extensión, mimetype)
+VARIANTES = {
+    'qr': (160, 'PNG', 'png', 'image/png'),
+    'ticket': (144, 'JPEG', 'jpg', 'image/jpeg'),
+    'web': (256, 'JPEG', 'jpg', 'image/jpeg'),
+}
+
+
+class LogoVariantes:
+    def __init__(self, origen, directorio):
+        self.origen = origen
+        self.directorio = directorio
+        self._datos = {}  # variante -> bytes
+        self._digest = {}  # variante -> huella (sirve como ETag)
+        self._qr_base = None
+        self._qr_por_ancho = {}
+        self._lock = threading.Lock()
+
+    def _huella(self, variante):
+        st = os.stat(self.origen)
+        spec = f"{st.st_size}:{st.st_mtime_ns}:{VARIANTES[variante]}"
+        return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:12]
+
+    def preparar(self):
+        """Genera (si hace falta) y carga en memoria todas las variantes."""
+        if not os.path.exists(self.origen):
+            print(f"[WARN] logo no encontrado: {self.origen}")
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        original = None
+        for variante, (lado, formato, ext, _) in VARIANTES.items():
+            huella = self._huella(variante)
+            ruta = os.path.join(self.directorio, f"logo-{variante}-{huella}.{ext}")
+            if not os.path.exists(ruta):
+                if Image is None:
+                    continue
+                if original is None:
+                    original = Image.open(self.origen)
+                    original.load()
+                img = original.convert('RGBA' if formato == 'PNG' else 'RGB')
+                img.thumbnail((lado, lado), Image.LANCZOS)
+                buf = BytesIO()
+                opciones = {'optimize': True}
+                if formato == 'JPEG':
+                    opciones['quality'] = 88
+                img.save(buf, format=formato, **opciones)
+                temporal = f"{ruta}.tmp"
+                with open(temporal, 'wb') as f:
+                    f.write(buf.getvalue())
+                os.replace(temporal, ruta)
+            with open(ruta, 'rb') as f:
+                self._datos[variante] = f.read()
+            self._digest[variante] = huella
+
+    def datos(self, variante):
+        return self._datos.get(variante)
+
+    def etag(self, variante):
+        return self._digest.get(variante)
+
+    def mimetype(self, variante):
+        return VARIANTES[variante][3]
+
+    def data_uri(self, variante):
+        """La variante como data URI (para xhtml2pdf: no depende de rutas ni de file://)."""
+        datos = self._datos.get(variante)
+        if not datos:
+            return None
+        return f"data:{self.mimetype(variante)};base64,{base64.b64encode(datos).decode('ascii')}"
+
+    def para_qr(self, ancho):
+        """Logo RGBA de `ancho` px para pegar sobre un QR (None si no hay variante)."""
+        with self._lock:
+            img = self._qr_por_ancho.get(ancho)
+            if img is not None:
+                return img
+            if self._qr_base is None:
+                datos = self._datos.get('qr')
+                if not datos or Image is None:
+                    return None
+                self._qr_base = Image.open(BytesIO(datos)).convert('RGBA')
+            base = self._qr_base
+            aspecto = base.width / base.height if base.height else 1
+            img = base.resize((ancho, max(1, int(ancho / aspecto))), Image.LANCZOS)
+            self._qr_por_ancho[ancho] = img
+            return img
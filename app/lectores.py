@@ -0,0 +1,267 @@
+"""Lectores de escáneres serie del servidor: un hilo por puerto, lectura en bloque.
+
+Antes un solo `serial_worker` leía byte a byte con `ser.read()`, dormía 10 ms
+cada vez que no llegaba nada y armaba el código concatenando cadenas; solo
+atendía el puerto que elegía `find_serial_port`, y `/start_scanner` y
+`/stop_scanner` se pisaban con las globales `scanner_running` /
+`scanner_thread`.
+
+`GestorEscaneres` abre un `LectorPuerto` por cada escáner conectado. Cada
+lector lee de una vez todo lo que hay en el búfer del puerto
+(`ser.read(ser.in_waiting or 1)`: bloquea hasta el timeout por el primer
+byte, sin dormir) y corta los códigos en `\\r`/`\\n` sobre un `bytearray`.
+Si el puerto falla, el lector se reconecta solo. Un hilo vigía vuelve a
+listar los puertos cada `intervalo` segundos: arranca lectores para los
+escáneres que se conectan y detiene los de los que se desconectan.
+
+Cada puerto puede publicar en su propia estación de `app.escaneos`
+(`ESCANER_ESTACIONES="COM3=caja1,COM4=caja2"`); los demás van a la estación
+por defecto.
+"""
+
+import atexit
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+try:
+    import serial
+    import serial.tools.list_ports
+except Exception:
+    serial = None
+
+# Palabras clave universales de dispositivos USB a serie y escáneres
+PALABRAS_ESCANER = (
+    "usb", "serial", "scanner", "barcode", "dispositivo serie",
+    "usb-to-serial", "ftdi", "prolific", "ch340", "uart", "hid",
+)
+MAX_LINEA = 512  # bytes sin fin de línea: ruido, se descarta
+VENTANA_TASA = 60  # s para códigos/seg
+_FIN_LINEA = re.compile(rb'[\r\n]')
+
+
+def disponible():
+    return serial is not None
+
+
+def puertos_escaner():
+    """Puertos que parecen escáneres (USB-serie); si ninguno lo parece, el primero disponible."""
+    if serial is None:
+        return []
+    puertos = list(serial.tools.list_ports.comports())
+    candidatos = []
+    for p in puertos:
+        desc = (p.description or "").lower()
+        hwid = (p.hwid or "").lower()
+        if any(k in desc or k in hwid for k in PALABRAS_ESCANER):
+            candidatos.append(p.device)
+    if candidatos:
+        return candidatos
+    return [puertos[0].device] if puertos else []
+
+
+def leer_estaciones(texto):
+    """Mapa puerto -> estación desde "COM3=caja1,COM4=caja2"."""
+    estaciones = {}
+    for par in (texto or '').split(','):
+        puerto, _, estacion = par.partition('=')
+        if puerto.strip() and estacion.strip():
+            estaciones[puerto.strip()] = estacion.strip()
+    return estaciones
+
+
+class LectorPuerto:
+    """Hilo que lee códigos de un puerto serie y los entrega a `publicar(code, puerto, estacion)`."""
+
+    def __init__(self, puerto, publicar, baud=9600, estacion=None, timeout=0.5):
+        self.puerto = puerto
+        self.estacion = estacion
+        self._publicar = publicar
+        self.baud = baud
+        self.timeout = timeout
+        self._parar = threading.Event()
+        self._hilo = None
+        self._recientes = deque(maxlen=2000)  # horas (monotonic) de los últimos códigos
+        self.conectado = False
+        self.codigos = 0
+        self.bytes = 0
+        self.errores = 0
+        self.reconexiones = 0
+        self.ultimo_error = None
+        self.ultimo_codigo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._ciclo, name=f'escaner-{self.puerto}', daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera=2.0):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(espera)
+
+    def vivo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def _ciclo(self):
+        abierto_antes = False
+        while not self._parar.is_set():
+            try:
+                with serial.Serial(self.puerto, self.baud, timeout=self.timeout) as ser:
+                    if abierto_antes:
+                        self.reconexiones += 1
+                    abierto_antes = True
+                    self.conectado = True
+                    self._leer(ser)
+            except Exception as e:
+                self.errores += 1
+                self.ultimo_error = str(e)
+                print(f"Serial error en {self.puerto}:", e)
+            finally:
+                self.conectado = False
+            self._parar.wait(1)  # espera y vuelve a intentar abrir el puerto
+
+    def _leer(self, ser):
+        buffer = bytearray()
+        while not self._parar.is_set():
+            datos = ser.read(ser.in_waiting or 1)
+            if not datos:
+                continue
+            self.bytes += len(datos)
+            buffer += datos
+            if not _FIN_LINEA.search(datos):
+                if len(buffer) > MAX_LINEA:
+                    buffer.clear()
+                    self.errores += 1
+                continue
+            *lineas, resto = _FIN_LINEA.split(buffer)
+            buffer = bytearray(resto)
+            for linea in lineas:
+                code = linea.decode('utf-8', errors='ignore').strip()
+                if code:
+                    self._entregar(code)
+
+    def _entregar(self, code):
+        try:
+            self._publicar(code, self.puerto, self.estacion)
+        except Exception as e:
+            self.errores += 1
+            self.ultimo_error = str(e)
+            return
+        self.codigos += 1
+        self._recientes.append(time.monotonic())
+        self.ultimo_codigo = datetime.now().isoformat(timespec='seconds')
+
+    def stats(self):
+        limite = time.monotonic() - VENTANA_TASA
+        recientes = sum(1 for t in list(self._recientes) if t >= limite)
+        return {
+            'puerto': self.puerto,
+            'estacion': self.estacion,
+            'conectado': self.conectado,
+            'codigos': self.codigos,
+            'codigos_por_seg': round(recientes / VENTANA_TASA, 3),
+            'bytes': self.bytes,
+            'errores': self.errores,
+            'reconexiones': self.reconexiones,
+            'ultimo_codigo': self.ultimo_codigo,
+            'ultimo_error': self.ultimo_error,
+        }
+
+
+class GestorEscaneres:
+    """Un `LectorPuerto` por escáner conectado, con arranque/parada atómicos y re-escaneo de puertos."""
+
+    def __init__(self, publicar, baud=9600, estaciones=None, intervalo=5.0, buscar=puertos_escaner):
+        self._publicar = publicar
+        self.baud = baud
+        self.estaciones = dict(estaciones or {})
+        self.intervalo = intervalo
+        self._buscar = buscar
+        self._lock = threading.Lock()
+        self._lectores = {}
+        self._parar = None
+        self._vigia = None
+        self._stats = {'arranques': 0, 'rescaneos': 0, 'conectados': 0, 'desconectados': 0}
+        atexit.register(self.detener)
+
+    @property
+    def activo(self):
+        return self._parar is not None
+
+    def iniciar(self):
+        """Arranca un lector por escáner y el vigía de puertos; devuelve los puertos atendidos.
+
+        Si no hay ningún puerto no arranca nada y devuelve []. Llamarlo con el
+        gestor ya activo no hace nada más que devolver los puertos.
+        """
+        with self._lock:
+            if self._parar is not None:
+                return sorted(self._lectores)
+            puertos = self._buscar()
+            if not puertos:
+                return []
+            self._parar = threading.Event()
+            self._stats['arranques'] += 1
+            for puerto in puertos:
+                self._agregar(puerto)
+            self._vigia = threading.Thread(target=self._vigilar, args=(self._parar,),
+                                           name='escaneres-vigia', daemon=True)
+            self._vigia.start()
+            return sorted(self._lectores)
+
+    def detener(self):
+        """Detiene el vigía y todos los lectores; devuelve cuántos lectores había."""
+        with self._lock:
+            if self._parar is None:
+                return 0
+            self._parar.set()
+            self._parar = None
+            lectores = list(self._lectores.values())
+            self._lectores.clear()
+        for lector in lectores:
+            lector.detener()
+        return len(lectores)
+
+    def rescan(self):
+        """Sincroniza los lectores con los puertos conectados; devuelve (nuevos, quitados)."""
+        puertos = set(self._buscar())
+        with self._lock:
+            if self._parar is None:
+                return [], []
+            self._stats['rescaneos'] += 1
+            nuevos = sorted(puertos - set(self._lectores))
+            quitados = sorted(set(self._lectores) - puertos)
+            for puerto in nuevos:
+                self._agregar(puerto)
+            salientes = [self._lectores.pop(p) for p in quitados]
+            self._stats['desconectados'] += len(salientes)
+        for lector in salientes:
+            lector.detener()
+        return nuevos, quitados
+
+    def _agregar(self, puerto):
+        lector = LectorPuerto(puerto, self._publicar, self.baud, self.estaciones.get(puerto))
+        self._lectores[puerto] = lector
+        self._stats['conectados'] += 1
+        lector.iniciar()
+
+    def _vigilar(self, parar):
+        while not parar.wait(self.intervalo):
+            try:
+                nuevos, quitados = self.rescan()
+            except Exception as e:
+                print("Error buscando escáneres:", e)
+                continue
+            for puerto in nuevos:
+                print("Escáner conectado:", puerto)
+            for puerto in quitados:
+                print("Escáner desconectado:", puerto)
+
+    def stats(self):
+        with self._lock:
+            lectores = [self._lectores[p] for p in sorted(self._lectores)]
+            resumen = dict(self._stats, activo=self._parar is not None)
+        resumen['puertos'] = [lector.stats() for lector in lectores]
+        return resumen
@@ -0,0 +1,366 @@
+"""Migraciones versionadas del esquema SQLite.
+
+Cada migración es una función `(cur) -> None` con un número de versión.
+`migrate()` crea la tabla `schema_version`, aplica en orden las que falten
+(cada una en su propia transacción) y se llama una sola vez al construir la
+app en `create_app()`. Así las rutas ya no ejecutan DDL ni `PRAGMA table_info`.
+
+Para agregar un cambio de esquema: escribir una función `_mNNN_...` y
+añadirla al final de `MIGRATIONS`. Nunca editar una migración ya publicada.
+Una migración que depende de algo que este SQLite no tiene (FTS5) lanza
+`MigracionAplazada`: no se registra y se vuelve a intentar al siguiente
+arranque, sin detener las demás.
+"""
+
+import sqlite3
+from datetime import datetime
+
+
+class MigracionAplazada(Exception):
+    """La migración no puede aplicarse con este SQLite; se reintenta en el próximo `migrate()`."""
+
+
+def _columnas(cur, tabla):
+    cur.execute(f"PRAGMA table_info({tabla})")
+    return {r[1] for r in cur.fetchall()}
+
+
+def _m001_esquema_base(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS inventory (
+        sku TEXT PRIMARY KEY,
+        id_original TEXT,
+        tipo TEXT,
+        marca TEXT,
+        modelo TEXT,
+        no_serie TEXT,
+        volts TEXT,
+        precio TEXT,
+        estado TEXT,
+        ubicacion TEXT,
+        fecha_registro TIMESTAMP,
+        origen_hoja TEXT,
+        observacion TEXT,
+        extras TEXT
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        nivel INTEGER NOT NULL
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS movimientos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT,
+        accion TEXT,
+        rowid_producto INTEGER,
+        sku TEXT,
+        detalles TEXT,
+        cuando TEXT
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS ventas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rowid_producto INTEGER,
+        sku TEXT,
+        tipo TEXT,
+        marca TEXT,
+        modelo TEXT,
+        no_serie TEXT,
+        precio_venta REAL,
+        comprador TEXT,
+        vendedor TEXT,
+        observaciones TEXT,
+        fecha_venta TEXT,
+        evento_fecha TEXT,
+        ticket_id INTEGER
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS venta_tickets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        comprador TEXT,
+        vendedor TEXT,
+        observaciones TEXT,
+        fecha_venta TEXT,
+        evento_fecha TEXT,
+        total REAL,
+        total_items INTEGER
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS venta_eventos (
+        fecha TEXT PRIMARY KEY,
+        estado TEXT NOT NULL DEFAULT 'OPEN',
+        creado_cuando TEXT,
+        cerrado_cuando TEXT
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS venta_evento_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        evento_fecha TEXT NOT NULL,
+        rowid_producto INTEGER NOT NULL,
+        precio_asignado REAL,
+        agregado_por TEXT,
+        agregado_cuando TEXT,
+        UNIQUE(evento_fecha,rowid_producto)
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS ubicaciones_catalogo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        nivel TEXT NOT NULL,
+        nota TEXT,
+        UNIQUE(nivel,nombre)
+    )""")
+    cur.execute("CREATE TABLE IF NOT EXISTS categorias_prefijos (prefijo TEXT PRIMARY KEY, nombre TEXT)")
+
+
+def _m002_columnas_ventas(cur):
+    """Completa columnas de ventas en BDs creadas por versiones anteriores."""
+    cols = _columnas(cur, 'ventas')
+    tipos = {'precio_venta': 'REAL', 'ticket_id': 'INTEGER'}
+    for col in ("rowid_producto", "sku", "tipo", "marca", "modelo", "no_serie", "precio_venta",
+                "comprador", "vendedor", "observaciones", "fecha_venta", "evento_fecha", "ticket_id"):
+        if col not in cols:
+            cur.execute(f"ALTER TABLE ventas ADD COLUMN {col} {tipos.get(col, 'TEXT')}")
+
+
+def _m003_indices_ventas(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_evento_fecha ON ventas(evento_fecha)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_ticket_id ON ventas(ticket_id)")
+
+
+def _m004_inventory_fts(cur):
+    """Índice FTS5 sobre inventory sincronizado por triggers."""
+    try:
+        cur.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+            sku, marca, modelo, observacion, id_original,
+            content='inventory', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )""")
+    except sqlite3.OperationalError as e:
+        # SQLite sin FTS5: la búsqueda cae al LIKE de siempre hasta que haya FTS5
+        raise MigracionAplazada(f"FTS5 no disponible, búsqueda sin índice: {e}")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS inventory_fts_ai AFTER INSERT ON inventory BEGIN
+        INSERT INTO inventory_fts(rowid, sku, marca, modelo, observacion, id_original)
+        VALUES (new.rowid, new.sku, new.marca, new.modelo, new.observacion, new.id_original);
+    END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS inventory_fts_ad AFTER DELETE ON inventory BEGIN
+        INSERT INTO inventory_fts(inventory_fts, rowid, sku, marca, modelo, observacion, id_original)
+        VALUES ('delete', old.rowid, old.sku, old.marca, old.modelo, old.observacion, old.id_original);
+    END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS inventory_fts_au
+        AFTER UPDATE OF sku, marca, modelo, observacion, id_original ON inventory BEGIN
+        INSERT INTO inventory_fts(inventory_fts, rowid, sku, marca, modelo, observacion, id_original)
+        VALUES ('delete', old.rowid, old.sku, old.marca, old.modelo, old.observacion, old.id_original);
+        INSERT INTO inventory_fts(rowid, sku, marca, modelo, observacion, id_original)
+        VALUES (new.rowid, new.sku, new.marca, new.modelo, new.observacion, new.id_original);
+    END""")
+    cur.execute("INSERT INTO inventory_fts(inventory_fts) VALUES('rebuild')")
+
+
+PREFIJO_SQL = "CASE WHEN instr(sku,'-')>0 THEN substr(sku,1,instr(sku,'-')-1) ELSE sku END"
+AHORA_SQL = "strftime('%Y-%m-%dT%H:%M:%S','now','localtime')"
+RETENCION_DIAS = 90  # contadores diarios de entradas/salidas en stats_counters
+# Misma regla que app.series.normalizar_serie (marcadores de "sin serie" -> NULL)
+_SERIE_TRIM = "lower(trim(no_serie, ' '||char(9)||char(10)||char(13)))"
+SERIE_SQL = (f"CASE WHEN {_SERIE_TRIM} IN ('', 's/n', 'sn', 'n/a', 'na', 'none', 'sin serie') "
+             f"THEN NULL ELSE {_SERIE_TRIM} END")
+
+
+def _m005_prefijo_y_directorio(cur):
+    """Columna generada `prefijo` indexada y directorio de categorías por triggers."""
+    if 'prefijo' not in _columnas(cur, 'inventory'):
+        cur.execute(f"ALTER TABLE inventory ADD COLUMN prefijo TEXT GENERATED ALWAYS AS ({PREFIJO_SQL}) VIRTUAL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_prefijo ON inventory(prefijo COLLATE NOCASE, sku)")
+    cur.execute("""CREATE TABLE IF NOT EXISTS categorias_directorio (
+        prefijo TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        tipo TEXT,
+        actualizado TEXT
+    )""")
+    alta = f"""INSERT INTO categorias_directorio (prefijo, total, tipo, actualizado)
+        VALUES (new.prefijo, 1, new.tipo, {AHORA_SQL})
+        ON CONFLICT(prefijo) DO UPDATE SET total = total + 1,
+            tipo = COALESCE(categorias_directorio.tipo, excluded.tipo),
+            actualizado = excluded.actualizado;"""
+    baja = f"""UPDATE categorias_directorio SET total = total - 1, actualizado = {AHORA_SQL}
+            WHERE prefijo = old.prefijo;
+        DELETE FROM categorias_directorio WHERE prefijo = old.prefijo AND total <= 0;"""
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS categorias_dir_ai AFTER INSERT ON inventory BEGIN {alta} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS categorias_dir_ad AFTER DELETE ON inventory BEGIN {baja} END")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS categorias_dir_au_sku AFTER UPDATE OF sku ON inventory
+        WHEN old.prefijo IS NOT new.prefijo BEGIN {baja} {alta} END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS categorias_dir_au AFTER UPDATE ON inventory
+        WHEN old.prefijo IS new.prefijo BEGIN
+        UPDATE categorias_directorio SET actualizado = {AHORA_SQL},
+            tipo = COALESCE(tipo, new.tipo)
+            WHERE prefijo = new.prefijo;
+    END""")
+    cur.execute("DELETE FROM categorias_directorio")
+    cur.execute(f"""INSERT INTO categorias_directorio (prefijo, total, tipo, actualizado)
+        SELECT prefijo, COUNT(*), MAX(tipo), COALESCE(MAX(fecha_registro), {AHORA_SQL})
+        FROM inventory GROUP BY prefijo""")
+
+
+def _m006_sku_sequences(cur):
+    """Consecutivo por prefijo, sembrado con el máximo existente en inventory."""
+    cur.execute("""CREATE TABLE IF NOT EXISTS sku_sequences (
+        prefijo TEXT PRIMARY KEY COLLATE NOCASE,
+        ultimo INTEGER NOT NULL DEFAULT 0
+    )""")
+    numero = "CAST(substr(new.sku, instr(new.sku,'-')+1) AS INTEGER)"
+    avance = f"""INSERT INTO sku_sequences (prefijo, ultimo) VALUES (new.prefijo, {numero})
+        ON CONFLICT(prefijo) DO UPDATE SET ultimo = MAX(ultimo, excluded.ultimo);"""
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS sku_sequences_ai AFTER INSERT ON inventory
+        WHEN instr(new.sku,'-') > 0 BEGIN {avance} END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS sku_sequences_au AFTER UPDATE OF sku ON inventory
+        WHEN instr(new.sku,'-') > 0 BEGIN {avance} END""")
+    cur.execute("""INSERT OR REPLACE INTO sku_sequences (prefijo, ultimo)
+        SELECT prefijo, MAX(CAST(substr(sku, instr(sku,'-')+1) AS INTEGER))
+        FROM inventory WHERE instr(sku,'-') > 0
+        GROUP BY prefijo COLLATE NOCASE""")
+
+
+def _m007_serie_normalizada(cur):
+    """Número de serie normalizado como columna generada indexada (ver app/series.py)."""
+    if 'no_serie_norm' not in _columnas(cur, 'inventory'):
+        cur.execute(f"ALTER TABLE inventory ADD COLUMN no_serie_norm TEXT GENERATED ALWAYS AS ({SERIE_SQL}) VIRTUAL")
+    # No UNIQUE: la BD actual ya trae series repetidas; la unicidad se valida al dar de alta
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_no_serie_norm ON inventory(no_serie_norm)")
+
+
+def _sumar(clave_sql, delta):
+    return f"""INSERT INTO stats_counters (clave, valor) VALUES ({clave_sql}, {delta})
+        ON CONFLICT(clave) DO UPDATE SET valor = valor + excluded.valor;"""
+
+
+def _m008_stats_counters(cur):
+    """Contadores del dashboard mantenidos por triggers (ver app/contadores.py)."""
+    cur.execute("""CREATE TABLE IF NOT EXISTS stats_counters (
+        clave TEXT PRIMARY KEY,
+        valor INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID""")
+    hoy = "date('now','localtime')"
+    salida = "upper(trim(coalesce(new.estado,''))) IN ('VENDIDO','DONADO','OBSOLETO')"
+    antes_salida = "upper(trim(coalesce(old.estado,''))) IN ('VENDIDO','DONADO','OBSOLETO')"
+    # Los contadores diarios viejos se purgan en cada alta (rango del PK, barato)
+    purga = f"""DELETE FROM stats_counters WHERE clave >= 'entradas:' AND clave < 'entradas:' || date({hoy}, '-{RETENCION_DIAS} days');
+        DELETE FROM stats_counters WHERE clave >= 'salidas:' AND clave < 'salidas:' || date({hoy}, '-{RETENCION_DIAS} days');"""
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_inventory_ai AFTER INSERT ON inventory BEGIN
+        {_sumar("'total:inventory'", 1)}
+        {_sumar("'estado:' || coalesce(new.estado,'')", 1)}
+        {_sumar(f"'entradas:' || coalesce(date(new.fecha_registro), {hoy})", 1)}
+        {purga}
+    END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_inventory_ad AFTER DELETE ON inventory BEGIN
+        {_sumar("'total:inventory'", -1)}
+        {_sumar("'estado:' || coalesce(old.estado,'')", -1)}
+    END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_inventory_au_estado AFTER UPDATE OF estado ON inventory
+        WHEN old.estado IS NOT new.estado BEGIN
+        {_sumar("'estado:' || coalesce(old.estado,'')", -1)}
+        {_sumar("'estado:' || coalesce(new.estado,'')", 1)}
+    END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_inventory_salida AFTER UPDATE OF estado ON inventory
+        WHEN {salida} AND NOT {antes_salida} BEGIN
+        {_sumar(f"'salidas:' || {hoy}", 1)}
+    END""")
+    for tabla in ('usuarios', 'movimientos', 'ventas', 'categorias_directorio'):
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_{tabla}_ai AFTER INSERT ON {tabla} BEGIN
+            {_sumar(f"'total:{tabla}'", 1)} END""")
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS stats_{tabla}_ad AFTER DELETE ON {tabla} BEGIN
+            {_sumar(f"'total:{tabla}'", -1)} END""")
+
+    cur.execute("DELETE FROM stats_counters")
+    for tabla in ('inventory', 'usuarios', 'movimientos', 'ventas', 'categorias_directorio'):
+        cur.execute(f"INSERT INTO stats_counters (clave, valor) SELECT 'total:{tabla}', COUNT(*) FROM {tabla}")
+    cur.execute("""INSERT INTO stats_counters (clave, valor)
+        SELECT 'estado:' || coalesce(estado,''), COUNT(*) FROM inventory GROUP BY 1""")
+    desde = f"date({hoy}, '-{RETENCION_DIAS} days')"
+    cur.execute(f"""INSERT INTO stats_counters (clave, valor)
+        SELECT 'entradas:' || date(fecha_registro), COUNT(*) FROM inventory
+        WHERE date(fecha_registro) >= {desde} GROUP BY 1""")
+    # Salidas anteriores: las que quedaron en la bitácora de movimientos
+    cur.execute(f"""INSERT INTO stats_counters (clave, valor)
+        SELECT 'salidas:' || date(cuando), COUNT(*) FROM movimientos
+        WHERE accion IN ('VENTA_REGISTRADA','VENDIDO','DONADO','OBSOLETO') AND date(cuando) >= {desde}
+        GROUP BY 1""")
+
+
+def _m009_contadores_de_cambios(cur):
+    """`cambios:<tabla>` en stats_counters: sube con cada escritura (llave de artefactos de exportación)."""
+    condiciones = {
+        # Registrar una exportación no invalida el artefacto que se acaba de generar
+        'movimientos': "WHEN coalesce(new.accion,'') NOT LIKE 'EXPORTAR%'",
+    }
+    for tabla in ('inventory', 'usuarios', 'movimientos', 'ventas'):
+        for evento, sufijo in (('INSERT', 'ai'), ('UPDATE', 'au'), ('DELETE', 'ad')):
+            cond = condiciones.get(tabla, '') if evento == 'INSERT' else ''
+            cur.execute(f"""CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_{sufijo} AFTER {evento} ON {tabla}
+                {cond} BEGIN {_sumar(f"'cambios:{tabla}'", 1)} END""")
+
+
+def _m010_inventory_fts_faltante(cur):
+    """Crea inventory_fts en BDs donde la migración 4 quedó registrada sin FTS5."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='inventory_fts'")
+    if cur.fetchone() is None:
+        _m004_inventory_fts(cur)
+
+
+MIGRATIONS = [
+    (1, 'esquema base', _m001_esquema_base),
+    (2, 'columnas faltantes de ventas', _m002_columnas_ventas),
+    (3, 'índices de ventas por evento y ticket', _m003_indices_ventas),
+    (4, 'índice de texto completo de inventario', _m004_inventory_fts),
+    (5, 'prefijo de SKU indexado y directorio de categorías', _m005_prefijo_y_directorio),
+    (6, 'consecutivos de SKU por prefijo', _m006_sku_sequences),
+    (7, 'número de serie normalizado e indexado', _m007_serie_normalizada),
+    (8, 'contadores del dashboard', _m008_stats_counters),
+    (9, 'contadores de cambios por tabla', _m009_contadores_de_cambios),
+    (10, 'índice de texto completo faltante', _m010_inventory_fts_faltante),
+]
+
+
+def current_version(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        descripcion TEXT,
+        aplicada_cuando TEXT
+    )""")
+    r = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return r[0] or 0
+
+
+def versiones_aplicadas(conn):
+    current_version(conn)  # crea schema_version si falta
+    return {r[0] for r in conn.execute("SELECT version FROM schema_version")}
+
+
+def migrate(db_path):
+    """Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    aplicadas = []
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        for version, descripcion, fn in MIGRATIONS:
+            cur = conn.cursor()
+            # BEGIN IMMEDIATE serializa procesos que arrancan a la vez
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if version in versiones_aplicadas(conn):
+                    cur.execute("COMMIT")
+                    continue
+                try:
+                    fn(cur)
+                except MigracionAplazada as e:
+                    cur.execute("ROLLBACK")
+                    print(f"[WARN] migración {version} aplazada: {e}")
+                    continue
+                cur.execute(
+                    "INSERT INTO schema_version (version, descripcion, aplicada_cuando) VALUES (?,?,?)",
+                    (version, descripcion, datetime.now().isoformat())
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            aplicadas.append(version)
+            print(f"[INFO] migración {version} aplicada: {descripcion}")
+    finally:
+        conn.close()
+    return aplicadas
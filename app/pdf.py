@@ -0,0 +1,193 @@
+"""Servicio de PDF: xhtml2pdf en un pool de procesos, fuera de los hilos de waitress.
+
+`pisa.CreatePDF` es Python puro y acaparaba el GIL: durante un evento, un
+par de descargas de tickets o del reporte frenaban todas las demás rutas
+(incluido el sondeo del escáner). Aquí cada PDF se genera en un proceso
+aparte (uno por núcleo, creados con `spawn` la primera vez que se piden) y
+el hilo de la petición solo espera el resultado.
+
+- `enviar(html, css)` encola un trabajo y devuelve un `Future` con los bytes;
+- `renderizar(html, css, timeout)` hace lo mismo y espera el resultado;
+- `ejecutar(funcion, *args)` encola cualquier otra función de nivel de
+  módulo;
+- `por_partes(funcion, partes, destino)` genera un documento grande (lote
+  de tickets, hoja de etiquetas) por partes en paralelo y las une.
+
+La cola está acotada (`max_pendientes`): si ya hay demasiados PDF en curso
+se lanza `ServicioOcupado` en lugar de acumular peticiones (las rutas
+responden 503). Si un trabajo excede su tiempo se lanza `TimeoutError`; el
+proceso termina ese PDF de todos modos y su lugar en la cola se libera
+hasta entonces.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+
+class ServicioOcupado(RuntimeError):
+    """Hay `max_pendientes` PDF en curso; reintentar más tarde."""
+
+
+class ErrorPDF(RuntimeError):
+    """xhtml2pdf reportó errores; `parcial` trae el PDF que alcanzó a generar."""
+
+    def __init__(self, msg, parcial=b''):
+        super().__init__(msg)
+        self.parcial = parcial
+
+
+def con_css(html, css):
+    """Inyecta `css` dentro del <head> (xhtml2pdf lo necesita inline)."""
+    if not css:
+        return html
+    style_tag = f"<style>\n{css}\n</style>\n"
+    if '</head>' in html:
+        return html.replace('</head>', f"{style_tag}</head>", 1)
+    # si no hay head, añadir al inicio del documento
+    return style_tag + html
+
+
+def _iniciar_proceso():
+    # Importar xhtml2pdf (y reportlab) una vez por proceso, no en cada PDF
+    try:
+        from xhtml2pdf import pisa  # noqa: F401
+    except Exception:
+        pass
+
+
+def _renderizar(html, opciones):
+    """Se ejecuta en el proceso hijo: devuelve (bytes, número de errores)."""
+    from xhtml2pdf import pisa
+    buf = BytesIO()
+    estado = pisa.CreatePDF(html, dest=buf, **opciones)
+    return buf.getvalue(), estado.err
+
+
+def unir_pdfs(rutas, destino, titulo=None):
+    """Concatena los PDF de `rutas` en `destino` (pensada para correr en el pool)."""
+    from pypdf import PdfWriter
+    escritor = PdfWriter()
+    for ruta in rutas:
+        escritor.append(ruta)
+    if titulo:
+        escritor.add_metadata({'/Title': titulo})
+    with open(destino, 'wb') as f:
+        escritor.write(f)
+    return len(escritor.pages)
+
+
+class ServicioPDF:
+    def __init__(self, procesos=None, max_pendientes=None, timeout=60):
+        self.procesos = procesos or os.cpu_count() or 1
+        self.max_pendientes = max_pendientes or self.procesos * 4
+        self.timeout = timeout
+        self._pool = None
+        self._cupos = threading.BoundedSemaphore(self.max_pendientes)
+        self._lock = threading.Lock()
+        self._stats = {'generados': 0, 'errores': 0, 'rechazados': 0, 'vencidos': 0, 'en_curso': 0}
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn también en Linux: no heredar hilos ni conexiones SQLite del servidor
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_iniciar_proceso)
+            return self._pool
+
+    def enviar(self, html, css=None, **opciones):
+        """Encola un PDF; `Future` que resuelve a (bytes, errores). Lanza ServicioOcupado si no hay cupo."""
+        return self.ejecutar(_renderizar, con_css(html, css), opciones)
+
+    def ejecutar(self, funcion, *args, espera=0, **kwargs):
+        """Encola `funcion(*args, **kwargs)` (de nivel de módulo, para poder enviarla al proceso).
+
+        Con `espera` > 0 aguarda hasta ese número de segundos por un lugar en
+        la cola antes de lanzar ServicioOcupado.
+        """
+        cupo = self._cupos.acquire(timeout=espera) if espera else self._cupos.acquire(blocking=False)
+        if not cupo:
+            with self._lock:
+                self._stats['rechazados'] += 1
+            raise ServicioOcupado('Demasiados PDF en curso, intenta de nuevo en unos segundos')
+        try:
+            try:
+                futuro = self._executor().submit(funcion, *args, **kwargs)
+            except BrokenProcessPool:
+                # Un proceso murió (p. ej. sin memoria): rearmar el pool una vez
+                self.stop()
+                futuro = self._executor().submit(funcion, *args, **kwargs)
+        except Exception:
+            self._cupos.release()
+            raise
+        with self._lock:
+            self._stats['en_curso'] += 1
+        futuro.add_done_callback(self._terminado)
+        return futuro
+
+    def por_partes(self, funcion, partes, destino, titulo=None):
+        """Genera un PDF grande en `destino` a partir de varias partes en paralelo.
+
+        Cada elemento de `partes` es la tupla de argumentos de una llamada
+        `funcion(*args, destino=ruta)`, que escribe su parte en un archivo
+        temporal desde un proceso del pool; al final otro proceso las une en
+        orden. El hilo que llama solo coordina: la memoria queda acotada por
+        el tamaño de cada parte.
+        """
+        directorio = os.path.dirname(os.path.abspath(destino))
+        with tempfile.TemporaryDirectory(prefix='lote-', dir=directorio) as tmp:
+            pendientes = []
+            for n, args in enumerate(partes):
+                ruta = os.path.join(tmp, f"parte-{n:04d}.pdf")
+                # espera un lugar en la cola en vez de fallar: el lote es un solo trabajo grande
+                pendientes.append((ruta, self.ejecutar(funcion, *args, destino=ruta, espera=self.timeout)))
+            for _, futuro in pendientes:
+                futuro.result(timeout=self.timeout)
+            temporal = os.path.join(tmp, 'lote.pdf')
+            paginas = self.ejecutar(unir_pdfs, [r for r, _ in pendientes], temporal, titulo,
+                                    espera=self.timeout).result(timeout=self.timeout)
+            os.replace(temporal, destino)
+        return paginas
+
+    def _terminado(self, futuro):
+        with self._lock:
+            self._stats['en_curso'] -= 1
+            if futuro.cancelled() or futuro.exception() is not None:
+                self._stats['errores'] += 1
+            else:
+                self._stats['generados'] += 1
+        self._cupos.release()
+
+    def renderizar(self, html, css=None, timeout=None, **opciones):
+        """Genera el PDF y devuelve sus bytes (ErrorPDF si xhtml2pdf reportó errores)."""
+        futuro = self.enviar(html, css, **opciones)
+        try:
+            datos, errores = futuro.result(timeout=timeout or self.timeout)
+        except FutureTimeout:
+            futuro.cancel()  # solo surte efecto si aún no empezaba
+            with self._lock:
+                self._stats['vencidos'] += 1
+            raise TimeoutError('La generación del PDF tardó demasiado')
+        if errores:
+            raise ErrorPDF(f'xhtml2pdf reportó {errores} error(es)', datos)
+        return datos
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            datos = dict(self._stats)
+        datos['procesos'] = self.procesos
+        datos['max_pendientes'] = self.max_pendientes
+        datos['iniciado'] = self._pool is not None
+        return datos
@@ -0,0 +1,224 @@
+"""Motor de PDF nativo: tickets y reporte del evento dibujados con ReportLab.
+
+La ruta HTML -> xhtml2pdf -> ReportLab pasa casi todo el tiempo
+interpretando HTML y CSS para llegar a un diseño que nunca cambia. Aquí se
+arman directamente los flowables de platypus a partir de lo que devuelven
+`build_ticket_bundle` y `build_event_report`, imitando
+`venta_ticket_pdf.html` / `venta_ticket_pdf.css` y `venta_evento_pdf.html`.
+Un ticket sale en unos pocos milisegundos, así que se genera en el propio
+hilo de la petición (sin el pool de `app.pdf`).
+
+`scripts/bench_pdf.py` compara ambos motores.
+"""
+
+from functools import lru_cache
+from io import BytesIO
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table
+except Exception:
+    colors = None
+
+MOTORES = ('reportlab', 'xhtml2pdf')
+VERSION = 1  # subir si cambia el diseño: forma parte de la llave de la caché de tickets
+TICKETS_POR_PARTE = 25  # tickets por proceso al generar lotes
+
+# Paleta de venta_ticket_pdf.css
+_TINTA = '#0f172a'
+_TITULO = '#1e293b'
+_SECUNDARIO = '#334155'
+_TENUE = '#64748b'
+_BORDE = '#cbd5e1'
+_LINEA = '#e2e8f0'
+_ENCABEZADO = '#f1f5f9'
+_TOTAL = '#eef2ff'
+_COPIAS = (('Caja', '#3b82f6'), ('Cliente', '#10b981'))
+
+
+def disponible():
+    return colors is not None
+
+
+@lru_cache(maxsize=1)
+def _estilos():
+    base = ParagraphStyle('base', fontName='Helvetica', fontSize=10.5, leading=13, textColor=_TINTA)
+    return {
+        'base': base,
+        'titulo': ParagraphStyle('titulo', base, fontName='Helvetica-Bold', fontSize=16, leading=19,
+                                 textColor=_TITULO),
+        'subtitulo': ParagraphStyle('subtitulo', base, fontSize=12, leading=15, textColor=_TENUE),
+        'numero': ParagraphStyle('numero', base, fontName='Helvetica-Bold', fontSize=13.5, leading=17,
+                                 textColor=_SECUNDARIO),
+        'seccion': ParagraphStyle('seccion', base, fontName='Helvetica-Bold', fontSize=11, leading=14,
+                                  textColor=_SECUNDARIO, spaceBefore=8),
+        'celda': ParagraphStyle('celda', base, fontSize=9.5, leading=12),
+        'serie': ParagraphStyle('serie', base, fontSize=8, leading=10, textColor=_TENUE),
+        'derecha': ParagraphStyle('derecha', base, fontSize=9.5, leading=12, alignment=TA_RIGHT),
+        'pie': ParagraphStyle('pie', base, fontSize=9, leading=12, textColor=_TENUE, alignment=TA_CENTER),
+        'centro': ParagraphStyle('centro', base, alignment=TA_CENTER),
+        'etiqueta': ParagraphStyle('etiqueta', base, fontName='Helvetica-Bold', fontSize=9.5, leading=12,
+                                   textColor=colors.white, alignment=TA_CENTER),
+    }
+
+
+def _esc(valor):
+    texto = '' if valor is None else str(valor)
+    return texto.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _dinero(valor):
+    return f"${float(valor or 0):.2f}"
+
+
+def _logo(datos, lado):
+    if not datos:
+        return ''
+    return Image(BytesIO(datos), width=lado, height=lado, kind='proportional')
+
+
+def _copia_ticket(ticket, items, nombre, color, logo, est, ancho):
+    partes = []
+    etiqueta = Table([[Paragraph(f"COPIA {nombre.upper()}", est['etiqueta'])]], colWidths=[32 * mm],
+                     style=[('BACKGROUND', (0, 0), (-1, -1), color),
+                            ('TOPPADDING', (0, 0), (-1, -1), 4), ('BOTTOMPADDING', (0, 0), (-1, -1), 4)])
+    etiqueta.hAlign = 'RIGHT'
+    partes.append(etiqueta)
+
+    titulo = [Paragraph('COLEGIO CRISTÓBAL COLÓN', est['titulo']),
+              Paragraph('Ticket de venta — Inventario CCC', est['subtitulo'])]
+    encabezado = Table([[_logo(logo, 14 * mm), titulo, _logo(logo, 14 * mm)]],
+                       colWidths=[18 * mm, ancho - 36 * mm, 18 * mm],
+                       style=[('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                              ('LINEBELOW', (0, 0), (-1, -1), 0.75, _LINEA),
+                              ('BOTTOMPADDING', (0, 0), (-1, -1), 6)])
+    partes += [encabezado, Spacer(1, 4),
+               Paragraph(f"Ticket #{_esc(ticket.get('codigo'))}", est['numero'])]
+
+    izquierda = (f"<b>Fecha:</b> {_esc(ticket.get('fecha_venta') or '')}<br/>"
+                 f"<b>Evento:</b> {_esc(ticket.get('evento_fecha') or '—')}<br/>"
+                 f"<b>Comprador:</b> {_esc(ticket.get('comprador') or '—')}")
+    derecha = (f"<b>Vendedor:</b> {_esc(ticket.get('vendedor') or '—')}<br/>"
+               f"<b>Artículos:</b> {_esc(ticket.get('total_items'))}<br/>"
+               f"<b>Total:</b> {_dinero(ticket.get('total'))}")
+    info = Table([[Paragraph(izquierda, est['base']), Paragraph(derecha, est['base'])],
+                  [Paragraph(f"<b>Ticket ID:</b> {_esc(ticket.get('id'))}", est['base']), '']],
+                 colWidths=[ancho / 2, ancho / 2],
+                 style=[('SPAN', (0, 1), (1, 1)), ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                        ('LINEABOVE', (0, 0), (-1, 0), 0.75, _LINEA),
+                        ('LINEBELOW', (0, 0), (-1, 0), 0.5, _ENCABEZADO),
+                        ('TOPPADDING', (0, 0), (-1, -1), 6), ('BOTTOMPADDING', (0, 0), (-1, -1), 6)])
+    partes.append(info)
+
+    if ticket.get('observaciones'):
+        partes += [Paragraph('Observaciones', est['seccion']),
+                   Table([[Paragraph(_esc(ticket['observaciones']), est['base'])]], colWidths=[ancho],
+                         style=[('BACKGROUND', (0, 0), (-1, -1), '#f8fafc'),
+                                ('LINEBEFORE', (0, 0), (0, -1), 2, '#3b82f6')])]
+
+    filas = [[Paragraph('<b>SKU</b>', est['celda']), Paragraph('<b>Descripción</b>', est['celda']),
+              Paragraph('<b>Precio</b>', est['derecha'])]]
+    for item in items:
+        descripcion = f"{_esc(item.get('marca') or '')} {_esc(item.get('modelo') or '')}"
+        if item.get('tipo'):
+            descripcion += f" ({_esc(item['tipo'])})"
+        celda = [Paragraph(descripcion, est['celda'])]
+        if item.get('no_serie'):
+            celda.append(Paragraph(f"No. Serie: {_esc(item['no_serie'])}", est['serie']))
+        filas.append([Paragraph(_esc(item.get('sku')), est['celda']), celda,
+                      Paragraph(_dinero(item.get('precio')), est['derecha'])])
+    filas.append(['', Paragraph('<b>TOTAL</b>', est['derecha']),
+                  Paragraph(f"<b>{_dinero(ticket.get('total'))}</b>", est['derecha'])])
+    tabla = Table(filas, colWidths=[38 * mm, ancho - 38 * mm - 28 * mm, 28 * mm], repeatRows=1,
+                  style=[('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                         ('BACKGROUND', (0, 0), (-1, 0), _ENCABEZADO),
+                         ('LINEBELOW', (0, 0), (-1, 0), 0.75, _BORDE),
+                         ('LINEBELOW', (0, 1), (-1, -2), 0.5, _LINEA),
+                         ('LINEBELOW', (0, -1), (-1, -1), 0.75, _BORDE),
+                         ('BACKGROUND', (0, -1), (-1, -1), _TOTAL)])
+    partes += [Paragraph('Artículos vendidos', est['seccion']), Spacer(1, 4), tabla, Spacer(1, 8),
+               Table([[Paragraph('Este ticket es válido como comprobante de venta<br/>Sistema de Inventario CCC',
+                                 est['pie'])]], colWidths=[ancho],
+                     style=[('LINEABOVE', (0, 0), (-1, 0), 0.75, _BORDE, 1, (2, 2))])]
+    return partes
+
+
+def _documento(buf, titulo):
+    return SimpleDocTemplate(buf, pagesize=A4, leftMargin=12 * mm, rightMargin=12 * mm,
+                             topMargin=12 * mm, bottomMargin=12 * mm, title=titulo, author='Inventario CCC')
+
+
+def _historia_tickets(tickets, logo, ancho):
+    est = _estilos()
+    historia = []
+    for ticket, items in tickets:
+        for nombre, color in _COPIAS:
+            if historia:
+                historia.append(PageBreak())
+            historia += _copia_ticket(ticket, items, nombre, color, logo, est, ancho)
+    return historia
+
+
+def ticket_pdf(ticket, items, logo=None):
+    """PDF (bytes) del ticket: una página por copia (Caja y Cliente), como la plantilla HTML."""
+    buf = BytesIO()
+    doc = _documento(buf, f"Ticket {ticket.get('codigo', '')}")
+    doc.build(_historia_tickets([(ticket, items)], logo, doc.width))
+    return buf.getvalue()
+
+
+def tickets_pdf(tickets, logo=None, destino=None, titulo='Tickets'):
+    """Varios tickets (`[(ticket, items), ...]`) en un PDF; se escribe en `destino` si se indica."""
+    buf = destino or BytesIO()
+    doc = _documento(buf, titulo)
+    doc.build(_historia_tickets(tickets, logo, doc.width))
+    return None if destino else buf.getvalue()
+
+
+def lote_tickets(servicio, tickets, logo, destino, por_parte=TICKETS_POR_PARTE, titulo='Tickets'):
+    """Genera `tickets` en `destino` en partes de `por_parte` tickets, en paralelo (ServicioPDF.por_partes)."""
+    partes = [(tickets[i:i + por_parte], logo) for i in range(0, len(tickets), por_parte)]
+    return servicio.por_partes(tickets_pdf, partes, destino, titulo=titulo)
+
+
+def reporte_pdf(report, fecha, generado, logo=None):
+    """PDF (bytes) del reporte de ventas del día a partir de `build_event_report`."""
+    buf = BytesIO()
+    doc = _documento(buf, f"Reporte de ventas {fecha}")
+    est = _estilos()
+    estado = report['evento']['estado']
+    historia = []
+    if logo:
+        historia.append(_logo(logo, 21 * mm))
+    historia += [
+        Paragraph('Reporte de ventas', ParagraphStyle('h2', est['titulo'], alignment=TA_CENTER)),
+        Paragraph(f"Fecha: {_esc(fecha)} — Estado: {_esc(estado)}", est['centro']),
+        Paragraph(f"Generado: {generado.strftime('%d/%m/%Y %H:%M:%S')}",
+                  ParagraphStyle('gen', est['pie'], fontSize=8)),
+        Spacer(1, 14),
+        Paragraph(f"<b>Total vendido:</b> {_dinero(report['total_vendido'])}<br/>"
+                  f"<b>Tickets vendidos:</b> {report['total_tickets']}<br/>"
+                  f"<b>Items (productos) vendidos:</b> {report['total_items']}", est['base']),
+        Spacer(1, 14),
+    ]
+    filas = [[Paragraph(f"<b>{t}</b>", est['celda']) for t in ('# Ticket', 'Cliente', 'Total', 'Productos', 'Estado')]]
+    for ticket in report['tickets']:
+        productos = '<br/>'.join(
+            f"{_esc(p.get('tipo'))} — {_esc(p.get('marca'))} {_esc(p.get('modelo'))} ({_esc(p.get('sku'))})"
+            f" - {_dinero(p.get('precio'))}" for p in ticket['items'])
+        filas.append([Paragraph(_esc(ticket['id']), est['celda']),
+                      Paragraph(_esc(ticket.get('comprador') or 'Consumidor final'), est['celda']),
+                      Paragraph(_dinero(ticket.get('total')), est['derecha']),
+                      Paragraph(productos, est['celda']),
+                      Paragraph(_esc(ticket.get('estado') or estado), est['celda'])])
+    ancho = doc.width
+    historia.append(Table(filas, colWidths=[18 * mm, 38 * mm, 22 * mm, ancho - 104 * mm, 26 * mm], repeatRows=1,
+                          style=[('GRID', (0, 0), (-1, -1), 0.5, '#666666'),
+                                 ('BACKGROUND', (0, 0), (-1, 0), '#e9e9e9'),
+                                 ('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+    doc.build(historia)
+    return buf.getvalue()
@@ -0,0 +1,172 @@
+"""PNG de códigos QR con logo, en un LRU acotado (con derrame opcional a disco).
+
+La imagen es función pura de la URL codificada, del tamaño mínimo del logo
+y de la variante de logo vigente, así que esos tres datos forman la llave
+(SHA-256), que también sirve como ETag fuerte. Volver a mostrar un ticket en
+piso de venta cuesta un hash y una búsqueda en el diccionario; con
+If-None-Match ni siquiera se envía la imagen.
+
+Las entradas que salen del LRU se escriben en `directorio` (si se indica) y
+se recuperan de ahí antes de volver a generar. Cada archivo se escribe en
+un temporal y se mueve con `os.replace`, así que una lectura concurrente
+nunca ve un PNG a medias; el directorio guarda como mucho `max_disco`
+archivos (se borran los menos usados).
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    import qrcode
+except Exception:
+    qrcode = None
+
+_FIRMA_PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def llave_qr(url, logo_min, logo_etag):
+    datos = f"{url}\n{logo_min}\n{logo_etag or ''}"
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+
+def generar_png(url, logo=None, logo_min=70):
+    """QR (corrección M, box 8, borde 2) con `logo.para_qr()` centrado al ~25% del ancho."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=8,
+        border=2,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    img_qr = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+
+    # Intentar overlay de logo
+    try:
+        w, h = img_qr.size
+        img_logo = logo.para_qr(max(logo_min, int(w * 0.25))) if logo is not None else None
+        if img_logo is not None:
+            lx = (w - img_logo.width) // 2
+            ly = (h - img_logo.height) // 2
+            img_qr.paste(img_logo, (lx, ly), mask=img_logo)
+    except Exception:
+        # Si falla el logo, devolver solo QR
+        pass
+
+    buf = BytesIO()
+    img_qr.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class QRCache:
+    """LRU de PNG por llave; opcionalmente derrama a disco lo que desaloja."""
+
+    def __init__(self, max_entradas=512, directorio=None, max_disco=5000):
+        self.max_entradas = max_entradas
+        self.directorio = directorio
+        self.max_disco = max_disco
+        self._lru = OrderedDict()
+        self._en_disco = OrderedDict()  # llave -> None, del menos al más usado
+        self._lock = threading.Lock()
+        self._stats = {'aciertos': 0, 'disco': 0, 'generados': 0}
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+            self._cargar_disco()
+
+    def _cargar_disco(self):
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith('.tmp'):
+                _borrar(ruta)  # escritura interrumpida
+            elif nombre.endswith('.png'):
+                try:
+                    archivos.append((os.path.getmtime(ruta), nombre[:-4]))
+                except OSError:
+                    pass
+        for _, llave in sorted(archivos):
+            self._en_disco[llave] = None
+        self._recortar_disco()
+
+    def _ruta(self, llave):
+        return os.path.join(self.directorio, f"{llave}.png")
+
+    def obtener(self, llave, generar):
+        """PNG de la llave; `generar()` solo se llama si no está en memoria ni en disco."""
+        with self._lock:
+            png = self._lru.get(llave)
+            if png is not None:
+                self._lru.move_to_end(llave)
+                self._stats['aciertos'] += 1
+                return png
+            en_disco = llave in self._en_disco
+            if en_disco:
+                self._en_disco.move_to_end(llave)
+        png = None
+        if en_disco:
+            try:
+                with open(self._ruta(llave), 'rb') as f:
+                    png = f.read()
+            except OSError:
+                png = None
+            if png is not None and png.startswith(_FIRMA_PNG):
+                self._stats['disco'] += 1
+            else:
+                png = None
+                with self._lock:
+                    self._en_disco.pop(llave, None)
+                _borrar(self._ruta(llave))
+        if png is None:
+            png = generar()
+            self._stats['generados'] += 1
+        self._guardar(llave, png)
+        return png
+
+    def _guardar(self, llave, png):
+        desalojados = []
+        with self._lock:
+            self._lru[llave] = png
+            self._lru.move_to_end(llave)
+            while len(self._lru) > self.max_entradas:
+                desalojados.append(self._lru.popitem(last=False))
+        if not self.directorio:
+            return
+        for vieja, datos in desalojados:
+            with self._lock:
+                if vieja in self._en_disco:
+                    continue
+            ruta = self._ruta(vieja)
+            temporal = f"{ruta}.{threading.get_ident()}.tmp"
+            try:
+                with open(temporal, 'wb') as f:
+                    f.write(datos)
+                os.replace(temporal, ruta)
+            except OSError:
+                _borrar(temporal)
+                continue
+            with self._lock:
+                self._en_disco[vieja] = None
+                self._recortar_disco()
+
+    def _recortar_disco(self):
+        # Con self._lock tomado (o durante __init__)
+        while len(self._en_disco) > self.max_disco:
+            vieja, _ = self._en_disco.popitem(last=False)
+            _borrar(self._ruta(vieja))
+
+    def stats(self):
+        with self._lock:
+            datos = dict(self._stats)
+            datos['entradas'] = len(self._lru)
+            datos['en_disco'] = len(self._en_disco)
+        return datos
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
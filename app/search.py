@@ -0,0 +1,104 @@
+"""Búsqueda de inventario sobre el índice FTS5 `inventory_fts`.
+
+El índice cubre sku, marca, modelo, observacion e id_original, se mantiene
+con triggers sobre `inventory` (ver migración 4) y usa el tokenizador
+`unicode61 remove_diacritics 2`, así que "telefono" encuentra "Teléfono" y
+las mayúsculas no importan. Cada palabra de la búsqueda se trata como prefijo
+y los resultados se ordenan por bm25 (con el SKU exacto primero).
+
+Detrás de las coincidencias del índice van, ordenadas por SKU, las del
+LIKE '%q%' de siempre que el índice no encontró, para no perder búsquedas
+por fragmentos a mitad de palabra ("fi" encuentra "UNIFI"). Si el índice no
+existe (SQLite sin FTS5) solo se usa el LIKE.
+"""
+
+import re
+
+COLUMNAS_PRODUCTO = ("rowid, sku, id_original, tipo, marca, modelo, no_serie, volts, precio, "
+                     "estado, ubicacion, fecha_registro, origen_hoja, observacion, extras")
+
+# Pesos bm25 en el orden de columnas del índice: sku, marca, modelo, observacion, id_original
+PESOS_BM25 = "10.0, 4.0, 4.0, 1.0, 6.0"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_fts_disponible = None
+
+
+def fts_disponible(cur):
+    """Detecta una sola vez si la tabla inventory_fts existe."""
+    global _fts_disponible
+    if _fts_disponible is None:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='inventory_fts'")
+        _fts_disponible = cur.fetchone() is not None
+    return _fts_disponible
+
+
+def fts_query(q):
+    """Convierte texto libre en una consulta FTS5 de prefijos: 'ant 1' -> '"ant"* "1"*'."""
+    tokens = _TOKEN_RE.findall(q or '')
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+
+def columnas_producto(alias='i', rowid_como=None):
+    """Lista de columnas de producto calificada con `alias` (y rowid renombrado si se pide)."""
+    cols = [f"{alias}.{c.strip()}" for c in COLUMNAS_PRODUCTO.split(',')]
+    if rowid_como:
+        cols[0] = f"{alias}.rowid AS {rowid_como}"
+    return ', '.join(cols)
+
+
+def _filtros(alias, prefijo, excluir_estado):
+    where, params = [], []
+    if prefijo:
+        where.append(f"{alias}.prefijo = ? COLLATE NOCASE")
+        params.append(prefijo)
+    if excluir_estado:
+        where.append(f"{alias}.estado != ?")
+        params.append(excluir_estado)
+    return where, params
+
+
+_LIKE_SQL = "(i.sku LIKE ? OR i.marca LIKE ? OR i.modelo LIKE ? OR i.observacion LIKE ? OR i.id_original LIKE ?)"
+
+
+def consulta_busqueda(q, prefijo=None, excluir_estado=None, limit=1000, columnas=None, fts=True):
+    """Arma (sql, params) de la búsqueda compartida por rutas y exportaciones.
+
+    Con `fts`: coincidencias del índice por bm25 y luego las del LIKE que el
+    índice no encontró. Sin `fts`: solo LIKE, por SKU.
+    """
+    cols = columnas or columnas_producto('i')
+    where, params = _filtros('i', prefijo, excluir_estado)
+    like_q = f"%{q}%"
+    match = fts_query(q) if fts else ''
+    if match:
+        sql = (f"SELECT {cols} FROM inventory i LEFT JOIN ("
+               f"SELECT rowid AS fts_rowid, bm25(inventory_fts, {PESOS_BM25}) AS rango "
+               f"FROM inventory_fts WHERE inventory_fts MATCH ?) f ON f.fts_rowid = i.rowid "
+               f"WHERE (f.fts_rowid IS NOT NULL OR {_LIKE_SQL})")
+        params = [match] + [like_q] * 5 + params
+        if where:
+            sql += " AND " + " AND ".join(where)
+        sql += (" ORDER BY CASE WHEN i.sku = ? COLLATE NOCASE THEN 0 WHEN f.fts_rowid IS NOT NULL THEN 1 ELSE 2 END, "
+                "f.rango, i.sku")
+        params.append(q)
+    else:
+        where.append(_LIKE_SQL)
+        params.extend([like_q] * 5)
+        sql = f"SELECT {cols} FROM inventory i WHERE " + " AND ".join(where) + " ORDER BY i.sku"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, params
+
+
+def buscar_inventario(cur, q, prefijo=None, excluir_estado=None, limit=1000, columnas=None):
+    """Ejecuta la búsqueda de texto libre y devuelve las filas encontradas."""
+    sql, params = plan_busqueda(cur, q, prefijo, excluir_estado, limit, columnas)
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def plan_busqueda(cur, q, prefijo=None, excluir_estado=None, limit=None, columnas=None):
+    """(sql, params) de la búsqueda, la misma de `buscar_inventario`; las exportaciones la recorren por lotes."""
+    return consulta_busqueda(q, prefijo, excluir_estado, limit, columnas, fts=fts_disponible(cur))
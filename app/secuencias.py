@@ -0,0 +1,47 @@
+"""Asignación de consecutivos de SKU por prefijo (tabla `sku_sequences`).
+
+`sku_sequences` guarda el último número usado por prefijo (sin distinguir
+mayúsculas). Reservar hace INSERT/UPDATE dentro de la transacción de
+escritura del llamador, así que el candado de escritura de SQLite serializa
+a dos capturistas del mismo prefijo: cada uno recibe un número distinto y
+si la transacción se revierte el número no se consume. Un trigger sobre
+`inventory` mantiene la secuencia por delante de cualquier SKU insertado
+por otra vía (migración 6).
+"""
+
+import re
+
+_SKU_SECUENCIAL = re.compile(r"^(?P<prefijo>[^-]+)-(?P<numero>\d+)$")
+
+
+def es_sku_secuencial(sku):
+    """True si el SKU tiene la forma PREFIJO-<número>."""
+    return bool(_SKU_SECUENCIAL.match(sku or ''))
+
+
+def siguiente_numero(cur, prefijo):
+    """Consulta (sin reservar) el número que tocaría al prefijo."""
+    cur.execute("SELECT ultimo FROM sku_sequences WHERE prefijo = ?", (prefijo,))
+    r = cur.fetchone()
+    return int(r[0] or 0) + 1 if r else 1
+
+
+def reservar_numeros(cur, prefijo, n=1):
+    """Reserva `n` números consecutivos para el prefijo y los devuelve.
+
+    Debe llamarse dentro de una transacción de escritura; el commit lo hace
+    el llamador (junto con el INSERT del producto, si aplica).
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError('n debe ser mayor a 0')
+    cur.execute("INSERT INTO sku_sequences (prefijo, ultimo) VALUES (?, 0) ON CONFLICT(prefijo) DO NOTHING", (prefijo,))
+    cur.execute("UPDATE sku_sequences SET ultimo = ultimo + ? WHERE prefijo = ?", (n, prefijo))
+    cur.execute("SELECT ultimo FROM sku_sequences WHERE prefijo = ?", (prefijo,))
+    fin = int(cur.fetchone()[0])
+    return list(range(fin - n + 1, fin + 1))
+
+
+def reservar_skus(cur, prefijo, n=1):
+    prefijo = prefijo.rstrip('-')
+    return [f"{prefijo}-{num}" for num in reservar_numeros(cur, prefijo, n)]
@@ -0,0 +1,63 @@
+"""Búsqueda de productos por número de serie sobre `inventory.no_serie_norm`.
+
+`no_serie_norm` es una columna generada e indexada (migración 7): el número
+de serie sin espacios/saltos de línea en los extremos y en minúsculas, o
+NULL si está vacío o es un marcador como 'S/N'. Todas las búsquedas por
+serie (/scan, /product_by_serial, la validación de duplicados de entradas y
+los modos `search_field=no_serie`) pasan por aquí, así que un código leído
+con '\r' final o en otra capitalización encuentra el mismo producto.
+"""
+
+from app.search import columnas_producto
+
+# Deben coincidir con la expresión de la columna generada en migrations.py
+MARCADORES_SIN_SERIE = ('', 's/n', 'sn', 'n/a', 'na', 'none', 'sin serie')
+_ESPACIOS = ' \t\r\n'
+
+
+def normalizar_serie(serie):
+    """Igual que SQLite: trim de espacios/tab/CR/LF y minúsculas ASCII."""
+    if serie is None:
+        return None
+    valor = str(serie).strip(_ESPACIOS)
+    valor = ''.join(ch.lower() if ch.isascii() else ch for ch in valor)
+    return None if valor in MARCADORES_SIN_SERIE else valor
+
+
+def buscar_por_serie(cur, serie, excluir_estado=None, limit=1000, columnas=None):
+    """Filas de inventory cuyo número de serie normalizado coincide."""
+    norm = normalizar_serie(serie)
+    if norm is None:
+        return []
+    sql = f"SELECT {columnas or columnas_producto('i')} FROM inventory i WHERE i.no_serie_norm = ?"
+    params = [norm]
+    if excluir_estado:
+        sql += " AND i.estado != ?"
+        params.append(excluir_estado)
+    if limit:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def serie_existe(cur, serie):
+    norm = normalizar_serie(serie)
+    if norm is None:
+        return False
+    cur.execute("SELECT 1 FROM inventory WHERE no_serie_norm = ? LIMIT 1", (norm,))
+    return cur.fetchone() is not None
+
+
+def activar_serie_unica(conn):
+    """Crea (opcional) el índice UNIQUE sobre la serie normalizada.
+
+    Falla con sqlite3.IntegrityError si ya hay series repetidas; se deja como
+    paso manual para BDs que ya depuraron sus duplicados
+    (`python scripts/modificarDB.py --serie-unica`).
+    """
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_inventory_no_serie_norm "
+        "ON inventory(no_serie_norm) WHERE no_serie_norm IS NOT NULL"
+    )
+    conn.commit()
@@ -0,0 +1,198 @@
+"""Caché de artefactos de tickets (PDF y HTML) direccionada por contenido.
+
+Un ticket no cambia una vez emitido, salvo que `revertir_ventas_por_ids` le
+quite partidas o lo elimine. Cada artefacto se guarda en disco con el
+SHA-256 del HTML que lo origina como nombre (`<digest>.pdf` / `.html`), y
+un índice en memoria recuerda qué digest corresponde a cada venta y
+variante. Con el índice caliente, servir un ticket no toca la BD ni
+xhtml2pdf; tras un reinicio basta volver a armar el HTML para reencontrar
+el PDF ya generado. El digest es también el ETag (If-None-Match -> 304).
+
+Un archivo se borra cuando sale del índice (LRU o invalidación) y ninguna
+otra entrada apunta a él, y el directorio guarda como mucho `max_disco`
+artefactos (los menos usados se borran primero, también los que quedaron
+de arranques anteriores).
+
+Los volcados de depuración (HTML/PDF en `debug/`) son opcionales y se
+escriben en un hilo aparte para no bloquear la petición.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+Artefacto = namedtuple('Artefacto', 'digest ruta ticket_id')
+
+_EXTENSIONES = {'pdf': '.pdf', 'html': '.html'}
+
+
+class TicketCache:
+    """Índice venta/variante -> artefacto en disco, con invalidación por ticket."""
+
+    def __init__(self, directorio, max_entradas=5000, max_disco=5000):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self.max_disco = max_disco
+        self._indice = OrderedDict()  # (venta_id, variante) -> Artefacto
+        self._en_disco = OrderedDict()  # ruta -> None, del menos al más usado
+        self._lock = threading.Lock()
+        self.generacion = 0  # sube con cada invalidación
+        self._stats = {'aciertos': 0, 'fallos': 0, 'reutilizados': 0, 'generados': 0, 'invalidados': 0}
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar_disco()
+
+    def _cargar_disco(self):
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            if nombre.endswith('.tmp'):
+                _borrar(ruta)  # escritura interrumpida
+            elif os.path.splitext(nombre)[1] in _EXTENSIONES.values():
+                try:
+                    archivos.append((os.path.getmtime(ruta), ruta))
+                except OSError:
+                    pass
+        for _, ruta in sorted(archivos):
+            self._en_disco[ruta] = None
+        self._recortar_disco()
+
+    def buscar(self, venta_id, variante):
+        with self._lock:
+            art = self._indice.get((venta_id, variante))
+            if art is not None and os.path.exists(art.ruta):
+                self._indice.move_to_end((venta_id, variante))
+                if art.ruta in self._en_disco:
+                    self._en_disco.move_to_end(art.ruta)
+                self._stats['aciertos'] += 1
+                return art
+            self._stats['fallos'] += 1
+            return None
+
+    def registrar(self, venta_id, ticket_id, variante, fuente, construir, generacion=None):
+        """Guarda el artefacto de `fuente` (HTML) generándolo con `construir(fuente) -> bytes`
+        solo si no existe ya uno con el mismo contenido.
+
+        Si se pasa `generacion` (leída antes de consultar la BD) y hubo una
+        reversión mientras tanto, el artefacto se devuelve pero no se indexa.
+        """
+        digest = hashlib.sha256(fuente.encode('utf-8')).hexdigest()
+        ext = _EXTENSIONES[variante.split(':', 1)[0]]
+        ruta = os.path.join(self.directorio, digest + ext)
+        art = Artefacto(digest, ruta, ticket_id)
+        # Los borrados se hacen con el candado tomado: si el archivo existe aquí,
+        # queda indexado antes de que otro hilo pueda borrarlo
+        with self._lock:
+            if os.path.exists(ruta):
+                self._stats['reutilizados'] += 1
+                self._indexar(venta_id, variante, art, generacion)
+                return art
+        datos = construir(fuente)
+        with self._lock:
+            _escribir_atomico(ruta, datos)
+            self._stats['generados'] += 1
+            self._indexar(venta_id, variante, art, generacion)
+        return art
+
+    def _indexar(self, venta_id, variante, art, generacion):
+        # Con self._lock tomado
+        self._en_disco[art.ruta] = None
+        self._en_disco.move_to_end(art.ruta)
+        if generacion is None or generacion == self.generacion:
+            self._indice[(venta_id, variante)] = art
+            self._indice.move_to_end((venta_id, variante))
+            salientes = []
+            while len(self._indice) > self.max_entradas:
+                salientes.append(self._indice.popitem(last=False)[1].ruta)
+            self._borrar_sin_uso(salientes)
+        self._recortar_disco()
+
+    def _borrar_sin_uso(self, rutas):
+        # Con self._lock tomado: borra las rutas a las que ya no apunta ninguna entrada
+        if not rutas:
+            return
+        vigentes = {art.ruta for art in self._indice.values()}
+        for ruta in set(rutas) - vigentes:
+            self._en_disco.pop(ruta, None)
+            _borrar(ruta)
+
+    def _recortar_disco(self):
+        # Con self._lock tomado (o durante __init__); respeta los archivos indexados
+        if len(self._en_disco) <= self.max_disco:
+            return
+        vigentes = {art.ruta for art in self._indice.values()}
+        sobran = len(self._en_disco) - self.max_disco
+        for ruta in [r for r in self._en_disco if r not in vigentes][:sobran]:
+            del self._en_disco[ruta]
+            _borrar(ruta)
+
+    def invalidar(self, venta_ids=(), ticket_ids=()):
+        """Olvida (y borra del disco) los artefactos de esas ventas o tickets."""
+        venta_ids, ticket_ids = set(venta_ids), set(t for t in ticket_ids if t)
+        with self._lock:
+            quitar = [k for k, art in self._indice.items()
+                      if k[0] in venta_ids or art.ticket_id in ticket_ids]
+            self._borrar_sin_uso([self._indice.pop(k).ruta for k in quitar])
+            self._stats['invalidados'] += len(quitar)
+            self.generacion += 1
+        return len(quitar)
+
+    def stats(self):
+        with self._lock:
+            datos = dict(self._stats)
+            datos['entradas'] = len(self._indice)
+            datos['en_disco'] = len(self._en_disco)
+        return datos
+
+
+def _escribir_atomico(ruta, datos):
+    temporal = f"{ruta}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+_textos = {}
+
+
+def leer_texto(ruta):
+    """Contenido de un archivo de texto (p. ej. el CSS del ticket), releído solo si cambió."""
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return None
+    previo = _textos.get(ruta)
+    if previo and previo[0] == mtime:
+        return previo[1]
+    with open(ruta, 'r', encoding='utf-8') as f:
+        texto = f.read()
+    _textos[ruta] = (mtime, texto)
+    return texto
+
+
+_volcador = ThreadPoolExecutor(max_workers=1, thread_name_prefix='debug-dump')
+
+
+def _escribir(ruta, datos):
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'wb') as f:
+            f.write(datos)
+        print(f"[DEBUG] guardado en: {ruta}")
+    except OSError as e:
+        print(f"[WARN] no se pudo guardar {ruta}: {e}")
+
+
+def volcar_debug(ruta, datos):
+    """Escribe un archivo de depuración en segundo plano."""
+    if isinstance(datos, str):
+        datos = datos.encode('utf-8')
+    _volcador.submit(_escribir, ruta, datos)
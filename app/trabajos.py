@@ -0,0 +1,280 @@
+"""Cola de exportaciones en segundo plano con artefactos reutilizables.
+
+Pedir una exportación (`submit`) devuelve de inmediato un trabajo con id; un
+hilo dedicado arma el .xlsx con `app.exportar.escribir_xlsx` y lo deja en el
+directorio de artefactos, de donde se sirve como archivo estático. Así un
+respaldo grande ya no ocupa uno de los hilos de waitress mientras se genera,
+y dos peticiones iguales simultáneas comparten el mismo trabajo.
+
+El nombre del artefacto incluye los contadores `cambios:<tabla>` de
+stats_counters (migración 9) de las tablas que lee la exportación: si nada
+cambió desde la última vez, el archivo ya existe y el trabajo nace listo.
+Para no consultar esos contadores en cada petición se usa `PRAGMA
+data_version` de una conexión propia, que solo cambia cuando otra conexión
+confirma algo en la BD.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from app.exportar import EXPORTACIONES, escribir_xlsx, hojas_exportacion, nombre_archivo
+
+PENDIENTE, GENERANDO, LISTO, ERROR = 'pendiente', 'generando', 'listo', 'error'
+
+_FIN = object()
+_NO_SEGURO = re.compile(r'[^\w.-]+')
+
+
+def _leer_cambios(cur):
+    cur.execute("SELECT clave, valor FROM stats_counters WHERE clave >= 'cambios:' AND clave < 'cambios;'")
+    return {clave[len('cambios:'):]: valor for clave, valor in cur.fetchall()}
+
+
+class ExportJobs:
+    """Un hilo que genera exportaciones XLSX y las guarda como artefactos en disco."""
+
+    def __init__(self, pool, directorio, max_artefactos=20, max_trabajos=200):
+        self._pool = pool
+        self.directorio = directorio
+        self.max_artefactos = max_artefactos
+        self.max_trabajos = max_trabajos
+        self._cola = queue.Queue()
+        self._trabajos = {}
+        self._en_curso = {}  # llave -> id del trabajo pendiente/generando
+        self._lock = threading.Lock()
+        self._listo = threading.Condition(self._lock)
+        self._hilo = None
+        self._conn_version = None
+        self._data_version = None
+        self._cambios = {}
+        self._stats = {'solicitados': 0, 'reutilizados': 0, 'generados': 0, 'errores': 0}
+
+    # ---------------- API pública ----------------
+    def start(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError:
+                    pass
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._run, name='export-jobs', daemon=True)
+            self._hilo.start()
+        atexit.register(self.stop)
+
+    def submit(self, tipo, params=None):
+        """Encola (o reutiliza) una exportación. Devuelve una copia del trabajo."""
+        if tipo not in EXPORTACIONES:
+            raise ValueError(f'exportación desconocida: {tipo}')
+        params = {k: v for k, v in (params or {}).items() if v not in (None, '')}
+        llave = self._llave(tipo, params, self._versiones_actuales(tipo))
+        ruta = self._ruta(tipo, params, llave)
+        with self._lock:
+            self._stats['solicitados'] += 1
+            if llave in self._en_curso:
+                return dict(self._trabajos[self._en_curso[llave]])
+            trabajo = self._nuevo(tipo, params)
+            if os.path.exists(ruta):
+                self._stats['reutilizados'] += 1
+                self._terminar(trabajo, ruta, reutilizado=True)
+                return dict(trabajo)
+            trabajo['llave'] = llave
+            self._en_curso[llave] = trabajo['id']
+        self._cola.put(trabajo['id'])
+        return dict(trabajo)
+
+    def get(self, trabajo_id):
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            return dict(trabajo) if trabajo else None
+
+    def wait(self, trabajo_id, timeout=None):
+        """Espera a que el trabajo termine (listo o error) y lo devuelve."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._listo:
+            while True:
+                trabajo = self._trabajos.get(trabajo_id)
+                if trabajo is None or trabajo['estado'] in (LISTO, ERROR):
+                    return dict(trabajo) if trabajo else None
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return dict(trabajo)
+                self._listo.wait(restante)
+
+    def stop(self, timeout=10.0):
+        hilo = self._hilo
+        if hilo is None or not hilo.is_alive():
+            return
+        self._cola.put(_FIN)
+        hilo.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            datos = dict(self._stats)
+            datos['en_cola'] = self._cola.qsize()
+            datos['en_curso'] = len(self._en_curso)
+        datos['artefactos'] = len(self._artefactos())
+        return datos
+
+    # ---------------- internos ----------------
+    def _nuevo(self, tipo, params):
+        trabajo = {
+            'id': uuid.uuid4().hex,
+            'tipo': tipo,
+            'params': params,
+            'estado': PENDIENTE,
+            'filas': 0,
+            'total_estimado': None,
+            'hoja': None,
+            'registros': {},
+            'archivo': None,
+            'descarga': None,
+            'reutilizado': False,
+            'error': None,
+            'creado': datetime.now().isoformat(timespec='seconds'),
+            'terminado': None,
+        }
+        self._trabajos[trabajo['id']] = trabajo
+        if len(self._trabajos) > self.max_trabajos:
+            for viejo in sorted(self._trabajos.values(), key=lambda t: t['creado']):
+                if len(self._trabajos) <= self.max_trabajos:
+                    break
+                if viejo['estado'] in (LISTO, ERROR):
+                    del self._trabajos[viejo['id']]
+        return trabajo
+
+    def _terminar(self, trabajo, ruta, reutilizado=False, registros=None):
+        trabajo['estado'] = LISTO
+        trabajo['archivo'] = ruta
+        trabajo['reutilizado'] = reutilizado
+        if registros is not None:
+            trabajo['registros'] = registros
+            trabajo['filas'] = sum(registros.values())
+        trabajo['terminado'] = datetime.now().isoformat(timespec='seconds')
+        trabajo['descarga'] = f"{nombre_archivo(trabajo['tipo'], trabajo['params'])}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        self._listo.notify_all()
+
+    def _versiones_actuales(self, tipo):
+        """Contadores de cambios vigentes; solo se releen si cambió `data_version`."""
+        with self._lock:
+            if self._conn_version is None:
+                self._conn_version = self._pool.acquire()
+            cur = self._conn_version.cursor()
+            cur.execute("PRAGMA data_version")
+            version = cur.fetchone()[0]
+            if version != self._data_version:
+                self._cambios = _leer_cambios(cur)
+                self._data_version = version
+            return {t: self._cambios.get(t, 0) for t in EXPORTACIONES[tipo]['tablas']}
+
+    @staticmethod
+    def _llave(tipo, params, versiones):
+        datos = json.dumps([tipo, params, versiones], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(datos.encode('utf-8')).hexdigest()[:16]
+
+    def _ruta(self, tipo, params, llave):
+        base = _NO_SEGURO.sub('_', nombre_archivo(tipo, params))
+        return os.path.join(self.directorio, f"{base}-{llave}.xlsx")
+
+    def _artefactos(self):
+        try:
+            return [os.path.join(self.directorio, n) for n in os.listdir(self.directorio) if n.endswith('.xlsx')]
+        except OSError:
+            return []
+
+    def _purgar(self):
+        archivos = sorted(self._artefactos(), key=lambda r: os.path.getmtime(r), reverse=True)
+        for ruta in archivos[self.max_artefactos:]:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass  # en Windows puede estar abierto por una descarga en curso
+
+    def _progreso(self, trabajo):
+        por_hoja = {}
+
+        def avance(hoja, filas):
+            por_hoja[hoja] = filas
+            with self._lock:
+                trabajo['hoja'] = hoja
+                trabajo['filas'] = sum(por_hoja.values())
+        return avance
+
+    def _estimar(self, cur, trabajo):
+        if trabajo['tipo'] == 'categoria':
+            cur.execute("SELECT total FROM categorias_directorio WHERE prefijo = ? COLLATE NOCASE",
+                        (trabajo['params'].get('prefijo'),))
+            r = cur.fetchone()
+            return r[0] if r else None
+        claves = [f"total:{t}" for t in EXPORTACIONES[trabajo['tipo']]['tablas']]
+        cur.execute(f"SELECT SUM(valor) FROM stats_counters WHERE clave IN ({','.join('?' * len(claves))})", claves)
+        return cur.fetchone()[0]
+
+    def _ejecutar(self, trabajo):
+        tipo, params = trabajo['tipo'], trabajo['params']
+        conn = self._pool.acquire()
+        try:
+            cur = conn.cursor()
+            # Una sola transacción de lectura: todas las hojas y los contadores
+            # de cambios salen de la misma foto de la BD
+            cur.execute("BEGIN")
+            cambios = _leer_cambios(cur)
+            llave = self._llave(tipo, params, {t: cambios.get(t, 0) for t in EXPORTACIONES[tipo]['tablas']})
+            ruta = self._ruta(tipo, params, llave)
+            if os.path.exists(ruta):
+                with self._lock:
+                    self._stats['reutilizados'] += 1
+                    self._terminar(trabajo, ruta, reutilizado=True)
+                return
+            with self._lock:
+                trabajo['estado'] = GENERANDO
+            trabajo['total_estimado'] = self._estimar(cur, trabajo)
+            hojas = hojas_exportacion(cur, tipo, params)
+            temporal = f"{ruta}.{trabajo['id']}.tmp"
+            try:
+                conteos = escribir_xlsx(conn, hojas, temporal, progreso=self._progreso(trabajo))
+                os.replace(temporal, ruta)
+            except Exception:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+                raise
+            with self._lock:
+                self._stats['generados'] += 1
+                self._terminar(trabajo, ruta, registros=conteos)
+        finally:
+            self._pool.release(conn)
+
+    def _run(self):
+        while True:
+            trabajo_id = self._cola.get()
+            if trabajo_id is _FIN:
+                break
+            with self._lock:
+                trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is None:
+                continue
+            try:
+                self._ejecutar(trabajo)
+            except Exception as e:
+                print(f"[ERROR] exportación {trabajo['tipo']} falló: {e}")
+                with self._lock:
+                    self._stats['errores'] += 1
+                    trabajo['estado'] = ERROR
+                    trabajo['error'] = str(e)
+                    trabajo['terminado'] = datetime.now().isoformat(timespec='seconds')
+                    self._listo.notify_all()
+            finally:
+                with self._lock:
+                    self._en_curso.pop(trabajo.get('llave'), None)
+                self._purgar()
@@ -0,0 +1,134 @@
+"""Volcados CSV y NDJSON en streaming de inventory, movimientos y ventas.
+
+Pensados para scripts: cada fila se serializa conforme sale del cursor
+(por lotes de `LOTE_FILAS`) y se envía de inmediato, opcionalmente
+comprimida con gzip al vuelo, así que un volcado de un millón de filas
+empieza a llegar enseguida y usa memoria constante. Filtros:
+
+- `prefijo`: categoría (índice de `inventory.prefijo`; en movimientos y
+  ventas, SKUs que empiezan con `PREFIJO-`);
+- `q`: búsqueda de texto libre en inventario, igual que la exportación XLSX
+  por categoría;
+- `since`: fecha/hora ISO mínima sobre la columna de fecha de cada tabla.
+"""
+
+import csv
+import io
+import json
+import threading
+import zlib
+from datetime import datetime
+
+from app.exportar import LOTE_FILAS, columnas_tabla, filas
+from app.search import plan_busqueda
+
+# nombre público -> (tabla, columna de fecha para `since`, acción de bitácora)
+VOLCADOS = {
+    'inventario': ('inventory', 'fecha_registro', 'EXPORTAR_INVENTARIO'),
+    'movimientos': ('movimientos', 'cuando', 'EXPORTAR_MOVIMIENTOS'),
+    'ventas': ('ventas', 'fecha_venta', 'EXPORTAR_VENTAS'),
+}
+FORMATOS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+def normalizar_since(since):
+    """Valida `since` (fecha o fecha/hora ISO) y lo devuelve en formato comparable."""
+    if not since:
+        return None
+    valor = datetime.fromisoformat(since.strip().replace(' ', 'T'))
+    return valor.isoformat() if len(since.strip()) > 10 else valor.date().isoformat()
+
+
+def consulta_volcado(cur, nombre, prefijo=None, q=None, since=None):
+    """(sql, params) del volcado con los filtros pedidos."""
+    tabla, col_fecha, _ = VOLCADOS[nombre]
+    columnas = ', '.join(f"t.{c}" for c in columnas_tabla(cur, tabla))
+    if nombre == 'inventario' and q:
+        sql, params = plan_busqueda(cur, q, prefijo=prefijo, columnas=columnas.replace('t.', 'i.'))
+        if since:
+            sql = f"SELECT * FROM ({sql}) WHERE replace({col_fecha}, ' ', 'T') >= ?"
+            params = list(params) + [since]
+        return sql, params
+    where, params = [], []
+    if prefijo:
+        if tabla == 'inventory':
+            where.append("t.prefijo = ? COLLATE NOCASE")
+            params.append(prefijo)
+        else:
+            where.append("t.sku LIKE ? ESCAPE '\\'")
+            params.append(prefijo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '-%')
+    if since:
+        # las fechas se guardan en ISO con 'T' o con espacio según la ruta que escribió
+        where.append(f"replace(t.{col_fecha}, ' ', 'T') >= ?")
+        params.append(since)
+    sql = f"SELECT {columnas} FROM {tabla} t"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+
+def _lotes_csv(cur):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([d[0] for d in cur.description])
+    n = 0
+    for row in filas(cur):
+        writer.writerow(row)
+        n += 1
+        if n % LOTE_FILAS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _lotes_ndjson(cur):
+    cols = [d[0] for d in cur.description]
+    lote = []
+    for row in filas(cur):
+        lote.append(json.dumps(dict(zip(cols, row)), ensure_ascii=False, default=str))
+        if len(lote) >= LOTE_FILAS:
+            yield '\n'.join(lote) + '\n'
+            lote = []
+    if lote:
+        yield '\n'.join(lote) + '\n'
+
+
+def una_vez(funcion):
+    """Envuelve `funcion` para que solo la primera llamada la ejecute.
+
+    La conexión de un volcado se devuelve al pool tanto desde el generador
+    como desde `response.call_on_close` (HEAD o cliente que corta antes de
+    empezar: el generador nunca arranca); devolverla dos veces entregaría
+    al pool una conexión que ya usa otra petición.
+    """
+    lock = threading.Lock()
+    pendiente = [True]
+
+    def llamar():
+        with lock:
+            if not pendiente[0]:
+                return
+            pendiente[0] = False
+        funcion()
+    return llamar
+
+
+def generar_volcado(conn, sql, params, formato, comprimir=False, al_terminar=None):
+    """Generador de bytes del volcado. `al_terminar()` se llama al final si el generador arrancó."""
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        lotes = _lotes_csv(cur) if formato == 'csv' else _lotes_ndjson(cur)
+        gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if comprimir else None
+        for texto in lotes:
+            datos = texto.encode('utf-8')
+            if gz:
+                datos = gz.compress(datos)
+            if datos:
+                yield datos
+        if gz:
+            yield gz.flush()
+    finally:
+        if al_terminar:
+            al_terminar()
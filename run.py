@@ -39,6 +39,8 @@ if __name__ == "__main__":
     logger.info("🌐 Servidor escuchando en 0.0.0.0 ...")
 
     try:
-        serve(app, host="0.0.0.0", port=5000, threads=8)
+        # 8 hilos para peticiones normales más los que pueden quedar retenidos por
+        # flujos SSE y long-polls de escaneos (ESCANEOS_MAX_FLUJOS + ESCANEOS_MAX_ESPERAS)
+        serve(app, host="0.0.0.0", port=5000, threads=8 + app.config.get('HILOS_ESCANEO', 8))
     except Exception as e:
         logger.error(f"🔥 Error al iniciar Waitress: {e}")
@@ -0,0 +1,128 @@
+"""Compara los motores de PDF: xhtml2pdf (plantillas HTML) contra ReportLab nativo.
+
+Uso (desde la raíz del proyecto):
+
+    python scripts/bench_pdf.py [--items 5] [--tickets 40] [--repeticiones 20]
+
+Genera un ticket de `--items` artículos y un reporte de evento con
+`--tickets` tickets, con datos sintéticos (no toca la BD), y muestra la
+mediana y el p95 en milisegundos de cada motor. Ambos se ejecutan en este
+mismo proceso, sin la caché de tickets ni el pool de `app.pdf`.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+from app import pdf_nativo  # noqa: E402
+from app.imagenes import LogoVariantes  # noqa: E402
+from app.pdf import con_css, _renderizar  # noqa: E402
+
+
+def datos_ticket(n_items, ticket_id=1):
+    items = [{
+        'venta_id': ticket_id * 100 + i,
+        'sku': f"LAP-{i:04d}",
+        'tipo': 'Laptop',
+        'marca': 'Lenovo',
+        'modelo': f"ThinkPad T{400 + i}",
+        'no_serie': f"PF{i:06d}",
+        'precio': 1500.0 + i,
+    } for i in range(n_items)]
+    ticket = {
+        'id': ticket_id,
+        'codigo': f"T-{ticket_id}",
+        'anchor_venta_id': items[0]['venta_id'] if items else ticket_id,
+        'comprador': 'Consumidor final',
+        'vendedor': 'admin',
+        'observaciones': 'Entrega en caja',
+        'fecha_venta': datetime.now().isoformat(timespec='seconds'),
+        'evento_fecha': datetime.now().date().isoformat(),
+        'total': sum(i['precio'] for i in items),
+        'total_items': len(items),
+    }
+    return ticket, items
+
+
+def datos_reporte(n_tickets, n_items):
+    tickets = []
+    for t in range(1, n_tickets + 1):
+        ticket, items = datos_ticket(n_items, t)
+        ticket['items'] = items
+        ticket['estado'] = 'ABIERTO'
+        tickets.append(ticket)
+    return {
+        'evento': {'fecha': datetime.now().date().isoformat(), 'estado': 'ABIERTO'},
+        'tickets': tickets,
+        'total_vendido': sum(t['total'] for t in tickets),
+        'total_items': sum(len(t['items']) for t in tickets),
+        'total_tickets': len(tickets),
+    }
+
+
+def medir(nombre, funcion, repeticiones):
+    funcion()  # calentamiento (importaciones, fuentes)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        tamano = len(funcion())
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    print(f"{nombre:<28} mediana {statistics.median(tiempos):8.1f} ms   p95 {p95:8.1f} ms   {tamano / 1024:7.1f} KB")
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=5, help='artículos por ticket')
+    parser.add_argument('--tickets', type=int, default=40, help='tickets en el reporte')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    logos = LogoVariantes(os.path.join(RAIZ, 'static', 'images', 'CCClogo.jpg'),
+                          os.path.join(RAIZ, 'cache', 'imagenes'))
+    logos.preparar()
+    env = Environment(loader=FileSystemLoader(os.path.join(RAIZ, 'templates')), autoescape=True)
+    with open(os.path.join(RAIZ, 'static', 'css', 'venta_ticket_pdf.css'), encoding='utf-8') as f:
+        css = f.read()
+
+    ticket, items = datos_ticket(args.items)
+    reporte = datos_reporte(args.tickets, 3)
+    generado = datetime.now()
+
+    def ticket_html():
+        html = env.get_template('venta_ticket_pdf.html').render(ticket=ticket, items=items,
+                                                                 logo_path=logos.data_uri('ticket'))
+        datos, _ = _renderizar(con_css(html, css), {'encoding': 'utf-8'})
+        return datos
+
+    def reporte_html():
+        html = env.get_template('venta_evento_pdf.html').render(
+            evento_fecha=reporte['evento']['fecha'], evento_estado=reporte['evento']['estado'],
+            tickets=reporte['tickets'], total_vendido=reporte['total_vendido'],
+            total_items=reporte['total_items'], total_tickets=reporte['total_tickets'],
+            generado=generado, logo_path=logos.data_uri('ticket'))
+        datos, _ = _renderizar(html, {})
+        return datos
+
+    print(f"Ticket de {args.items} artículos, reporte de {args.tickets} tickets, {args.repeticiones} repeticiones\n")
+    a = medir('ticket  xhtml2pdf', ticket_html, args.repeticiones)
+    b = medir('ticket  reportlab', lambda: pdf_nativo.ticket_pdf(ticket, items, logos.datos('ticket')),
+              args.repeticiones)
+    c = medir('reporte xhtml2pdf', reporte_html, args.repeticiones)
+    d = medir('reporte reportlab', lambda: pdf_nativo.reporte_pdf(reporte, reporte['evento']['fecha'], generado,
+                                                                  logos.datos('ticket')), args.repeticiones)
+    print(f"\nticket: {a / b:.1f}x más rápido   reporte: {c / d:.1f}x más rápido")
+
+
+if __name__ == '__main__':
+    main()
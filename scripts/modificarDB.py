@@ -1,41 +1,22 @@
+import os
 import sqlite3
+import sys
+
+# Permite importar el paquete `app` al ejecutar `python scripts/modificarDB.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.migrations import migrate  # noqa: E402
+from app.series import activar_serie_unica  # noqa: E402
+
+ruta_bd = os.environ.get('DB_PATH') or r"C:\Users\ROG\PruebaGit\SistemaCCC\inventario_consolidado.db"
+
+# El esquema vive en app/migrations.py (mismas migraciones que aplica la app al arrancar)
+aplicadas = migrate(ruta_bd)
+print(f"Esquema verificado. Migraciones aplicadas ahora: {aplicadas or 'ninguna'}")
 
-ruta_bd = r"C:\Users\ROG\PruebaGit\SistemaCCC\inventario_consolidado.db"
 conn = sqlite3.connect(ruta_bd)
 cursor = conn.cursor()
 
 try:
-    # Crear tabla de inventory (TABLA PRINCIPAL QUE FALTABA)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS inventory (
-            rowid INTEGER PRIMARY KEY AUTOINCREMENT,
-            sku TEXT,
-            id_original TEXT,
-            tipo TEXT,
-            marca TEXT,
-            modelo TEXT,
-            no_serie TEXT,
-            volts TEXT,
-            precio REAL,
-            estado TEXT,
-            ubicacion TEXT,
-            fecha_registro TEXT,
-            origen_hoja TEXT,
-            observacion TEXT,
-            extras TEXT
-        );
-    """)
-
-    # Crear tabla de usuarios
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            nivel INTEGER NOT NULL
-        );
-    """)
-
     # Lista de usuarios a insertar
     usuarios = [
     ]
@@ -45,74 +26,7 @@ try:
         INSERT OR IGNORE INTO usuarios (usuario, password, nivel)
         VALUES (?, ?, ?)
     """, usuarios)
-
-    # Crear tabla de ventas
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ventas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            rowid_producto INTEGER NOT NULL,
-            sku TEXT NOT NULL,
-            tipo TEXT,
-            marca TEXT,
-            modelo TEXT,
-            no_serie TEXT,
-            precio_venta REAL NOT NULL,
-            comprador TEXT,
-            vendedor TEXT,
-            fecha_venta TEXT NOT NULL,
-            observaciones TEXT,
-            FOREIGN KEY (rowid_producto) REFERENCES inventory (rowid)
-        );
-    """)
-
-    # -----------------------------------------------------
-    # Tablas para eventos de venta del día
-    # -----------------------------------------------------
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS venta_eventos (
-            fecha TEXT PRIMARY KEY,
-            estado TEXT NOT NULL DEFAULT 'OPEN', -- OPEN / CERRADA
-            creado_cuando TEXT,
-            cerrado_cuando TEXT
-        );
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS venta_evento_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            evento_fecha TEXT NOT NULL,
-            rowid_producto INTEGER NOT NULL,
-            precio_asignado REAL,
-            agregado_por TEXT,
-            agregado_cuando TEXT,
-            UNIQUE(evento_fecha, rowid_producto),
-            FOREIGN KEY (rowid_producto) REFERENCES inventory(rowid),
-            FOREIGN KEY (evento_fecha) REFERENCES venta_eventos(fecha)
-        );
-    """)
-
-    # Añadir columna evento_fecha a ventas si aún no existe
-    try:
-        cursor.execute("ALTER TABLE ventas ADD COLUMN evento_fecha TEXT")
-    except Exception:
-        # Ignorar error si la columna ya existe
-        pass
-
     conn.commit()
-    print("Tablas verificadas: inventory, usuarios, ventas, venta_eventos, venta_evento_items")
-
-    # ---------------------------------------------
-    # Crear tabla de catálogo de ubicaciones (salones)
-    # ---------------------------------------------
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ubicaciones_catalogo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            nivel TEXT NOT NULL,
-            nota TEXT,
-            UNIQUE(nivel, nombre)
-        );
-    """)
 
     # Lista normalizada de ubicaciones por nivel (sin duplicados por nivel)
     # Notas extraídas de las descripciones originales.
@@ -269,29 +183,23 @@ try:
     conn.commit()
     print(f"Catálogo de ubicaciones actualizado. Total cargadas (intentos): {len(todas_ubicaciones)}")
 
+    # Opcional: `python scripts/modificarDB.py --serie-unica` prohíbe series repetidas en la BD
+    # (índice UNIQUE sobre no_serie_norm). Solo funciona si ya no hay duplicados.
+    if '--serie-unica' in sys.argv:
+        try:
+            activar_serie_unica(conn)
+            print("Índice UNIQUE de número de serie activado.")
+        except sqlite3.IntegrityError:
+            repetidas = conn.execute(
+                "SELECT no_serie_norm, COUNT(*) FROM inventory WHERE no_serie_norm IS NOT NULL "
+                "GROUP BY no_serie_norm HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC"
+            ).fetchall()
+            print(f"No se activó el índice UNIQUE: hay {len(repetidas)} series repetidas. Ejemplos:")
+            for serie, veces in repetidas[:10]:
+                print(f"  {serie}: {veces}")
+
 except Exception as e:
     print("Error:", e)
 
 finally:
     conn.close()
-
-# Crear tabla de movimientos / historial de actividad si no existe
-try:
-    conn = sqlite3.connect(ruta_bd)
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS movimientos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario TEXT,
-            accion TEXT,
-            rowid_producto INTEGER,
-            sku TEXT,
-            detalles TEXT,
-            cuando TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    print("Tabla 'movimientos' verificada/creada correctamente.")
-except Exception as e:
-    print('No se pudo crear tabla movimientos:', e)
\ No newline at end of file
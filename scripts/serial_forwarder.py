@@ -9,24 +9,45 @@ Propósito:
 
 Características:
     ✓ Auto-detección del puerto del escáner.
-    ✓ Resolución automática del servidor (hostname, server.txt, cache, escaneo rápido LAN).
+    ✓ Resolución automática del servidor (hostname, server.txt, cache, búsqueda concurrente en la LAN).
     ✓ Lectura carácter por carácter para compatibilidad con HID/Serial.
     ✓ Ensamblado seguro de líneas completas (cada lect ura = un código).
     ✓ Control opcional de la línea DTR (evita que algunos escáneres se apaguen).
     ✓ Reintentos automáticos si el puerto se desconecta.
     ✓ Funciona en cualquier PC conectada a la misma red.
+    ✓ Estaciones opcionales (--estacion caja1): las páginas abiertas con
+      ?estacion=caja1 solo reciben los códigos de ese escáner. Sin
+      --estacion se publica en la estación principal, la que escuchan las
+      páginas abiertas sin ?estacion=.
+    ✓ Bandeja de salida en SQLite (--outbox): cada código se guarda en disco
+      antes de enviarse y un hilo aparte lo manda en lotes por una sesión
+      HTTP persistente (/push_scan/lote, con id por escaneo). Si el servidor
+      está lento o caído, la lectura del escáner sigue y nada se pierde,
+      ni siquiera al reiniciar el forwarder.
+    ✓ Modo --async: un solo proceso atiende todos los escáneres de la caja
+      (un lector asyncio por puerto, reconexión con espera creciente por
+      puerto, estadísticas por puerto) con la misma bandeja de salida.
 
 Requiere:
     pip install pyserial requests
 """
 
 import argparse
+import asyncio
+import errno
+import ipaddress
+import selectors
 import time
 import sys
 import socket
 import os
 import re
-from typing import Optional
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
 
 # ---------------------------------------
 # MÓDULOS EXTERNOS
@@ -51,7 +72,15 @@ except Exception:
 DEFAULT_SERVER_HOSTNAME = "inventario.local"
 SERVER_FILE = "server.txt"
 SERVER_CACHE = "server_cache.txt"
+CACHE_TTL = 7 * 24 * 3600  # s que se confía en la IP cacheada (igual se verifica con /health)
+SERVER_PORT = 5000
+SERVICE_NAME = "sistemaccc-inventario"  # `servicio` que responde /health
+DEFAULT_SUBNET = "192.168.1.0/24"
+STATION_NAME = re.compile(r"^[a-z0-9][a-z0-9_.-]{0,39}$")  # mismo formato que valida el servidor
 PUSH_ENDPOINT = "/push_scan"
+BATCH_ENDPOINT = "/push_scan/lote"
+OUTBOX_FILE = "scanner_outbox.db"
+BATCH_SIZE = 200
 BAUD = 9600
 
 # Palabras clave típicas en descripciones de escáneres USB/Serial
@@ -67,10 +96,10 @@ def validate_ip(ip: str) -> bool:
 
 
 def save_server_cache(ip: str):
-    """Guarda la IP resuelta en un archivo de caché."""
+    """Guarda la IP resuelta (con la hora, para su vigencia) en un archivo de caché."""
     try:
         with open(SERVER_CACHE, "w") as f:
-            f.write(ip)
+            f.write(f"{ip} {time.time():.0f}")
     except Exception:
         pass  # No es crítico
 
@@ -78,32 +107,42 @@ def save_server_cache(ip: str):
 # ---------------------------------------
 # DETECCIÓN DE PUERTO SERIAL
 # ---------------------------------------
-def detect_scanner_port(filter_text: Optional[str] = None, timeout: float = 0.0) -> Optional[str]:
+def scanner_ports(filter_text: Optional[str] = None) -> List[str]:
     """
-    Busca un dispositivo serial cuyo descriptor coincida con:
+    Todos los dispositivos serial cuyo descriptor coincide con:
+    - Texto filtrado por el usuario (--filter), primero
     - Palabras clave típicas de escáner
-    - Texto filtrado por el usuario (--filter)
-    Si timeout > 0, reintenta hasta que el tiempo expire.
     """
-    start = time.time()
-
     filter_lower = filter_text.lower() if filter_text else None
+    preferred, matches = [], []
 
-    while True:
-        ports = list(serial.tools.list_ports.comports())
+    for p in serial.tools.list_ports.comports():
+        desc = (p.description or "").lower()
+        hwid = (p.hwid or "").lower()
+        dev = (p.device or "").lower()
+
+        # Si se especificó un filtro explícito
+        if filter_lower and (filter_lower in desc or filter_lower in hwid or filter_lower in dev):
+            preferred.append(p.device)
+
+        # Coincidencia por palabras clave típicas
+        elif any(k in desc or k in hwid for k in COMMON_SCANNER_KEYWORDS):
+            matches.append(p.device)
+
+    return preferred + matches
 
-        for p in ports:
-            desc = (p.description or "").lower()
-            hwid = (p.hwid or "").lower()
-            dev = (p.device or "").lower()
 
-            # Si se especificó un filtro explícito
-            if filter_lower and (filter_lower in desc or filter_lower in hwid or filter_lower in dev):
-                return p.device
+def detect_scanner_port(filter_text: Optional[str] = None, timeout: float = 0.0) -> Optional[str]:
+    """
+    Busca un dispositivo serial que parezca escáner (ver `scanner_ports`).
+    Si timeout > 0, reintenta hasta que el tiempo expire.
+    """
+    start = time.time()
 
-            # Coincidencia por palabras clave típicas
-            if any(k in desc or k in hwid for k in COMMON_SCANNER_KEYWORDS):
-                return p.device
+    while True:
+        ports = scanner_ports(filter_text)
+        if ports:
+            return ports[0]
 
         if timeout and (time.time() - start) >= timeout:
             return None
@@ -114,13 +153,154 @@ def detect_scanner_port(filter_text: Optional[str] = None, timeout: float = 0.0)
 # ---------------------------------------
 # RESOLUCIÓN AUTOMÁTICA DEL SERVIDOR
 # ---------------------------------------
-def resolve_server(quick_subnet_scan: bool = True) -> Optional[str]:
+def local_ip() -> Optional[str]:
+    """IP de la interfaz que sale a la red (no envía nada)."""
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+        finally:
+            s.close()
+    except Exception:
+        return None
+
+
+def default_subnets() -> List[str]:
+    """La /24 de esta PC y, por compatibilidad, 192.168.1.0/24."""
+    subnets = []
+    ip = local_ip()
+    if ip and not ip.startswith("127."):
+        subnets.append(str(ipaddress.ip_network(f"{ip}/24", strict=False)))
+    if DEFAULT_SUBNET not in subnets:
+        subnets.append(DEFAULT_SUBNET)
+    return subnets
+
+
+def is_our_server(ip: str, timeout: float = 0.5) -> bool:
+    """True si `ip` responde /health como el servidor de inventario."""
+    try:
+        r = requests.get(f"http://{ip}:{SERVER_PORT}/health", timeout=timeout)
+        return r.status_code == 200 and r.json().get("servicio") == SERVICE_NAME
+    except Exception:
+        return False
+
+
+def open_port_hosts(hosts: List[str], port: int = SERVER_PORT, timeout: float = 0.4,
+                    on_open: Optional[Callable[[str], None]] = None,
+                    stop: Optional[threading.Event] = None) -> List[str]:
+    """
+    Vía rápida: intenta conectar (solo TCP, sin HTTP) a todos los `hosts` a la
+    vez con sockets no bloqueantes (hasta 200: select() de Windows admite 512)
+    y devuelve los que aceptan en `port`, en orden de respuesta. Cada host que
+    acepta se pasa a `on_open` en cuanto responde. Termina cuando todos
+    respondieron, al vencer `timeout` o cuando se activa `stop`.
+    """
+    found = []
+    sel = selectors.DefaultSelector()
+    try:
+        for host in hosts:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            err = s.connect_ex((host, port))
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, 10035):  # 10035 = WSAEWOULDBLOCK
+                sel.register(s, selectors.EVENT_WRITE, host)
+            else:
+                s.close()
+        deadline = time.monotonic() + timeout
+        while sel.get_map() and not (stop and stop.is_set()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(min(remaining, 0.05)):
+                s = key.fileobj
+                sel.unregister(s)
+                if s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    found.append(key.data)
+                    if on_open:
+                        on_open(key.data)
+                s.close()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+    return found
+
+
+def discover_server(subnets: Optional[List[str]] = None, timeout: float = 0.4) -> Optional[str]:
+    """
+    Busca el servidor en las subredes. Las tandas de 200 hosts se conectan en
+    paralelo, y cada host que acepta la conexión se verifica con /health en
+    ese momento. Se devuelve el primero que responde como el servidor, sin
+    esperar al resto de la búsqueda.
+    """
+    hosts = []
+    for net in subnets or default_subnets():
+        try:
+            hosts += [str(h) for h in ipaddress.ip_network(net, strict=False).hosts()]
+        except ValueError:
+            print(f"[WARN] Subred inválida: {net}")
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts:
+        return None
+    batches = [hosts[i:i + 200] for i in range(0, len(hosts), 200)]
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    winner: List[str] = []
+    checks = []
+
+    def check(host: str):
+        if not stop.is_set() and is_our_server(host):
+            with lock:
+                if not winner:
+                    winner.append(host)
+            stop.set()
+
+    scans = ThreadPoolExecutor(max_workers=len(batches))
+    health = ThreadPoolExecutor(max_workers=16)
+
+    def on_open(host: str):
+        with lock:
+            checks.append(health.submit(check, host))
+
+    try:
+        scanning = [scans.submit(open_port_hosts, b, SERVER_PORT, timeout, on_open, stop) for b in batches]
+        while not stop.wait(0.01):
+            if all(f.done() for f in scanning):
+                with lock:
+                    pending = list(checks)
+                if all(f.done() for f in pending):
+                    break
+    finally:
+        stop.set()
+        scans.shutdown(wait=False, cancel_futures=True)
+        health.shutdown(wait=False, cancel_futures=True)
+    return winner[0] if winner else None
+
+
+def read_server_cache(ttl: float = CACHE_TTL) -> Optional[str]:
+    """IP de la caché si no venció. Formato "ip marca_de_tiempo" (o solo "ip", de versiones viejas)."""
+    try:
+        with open(SERVER_CACHE) as f:
+            parts = f.read().split()
+        if not parts or not validate_ip(parts[0]):
+            return None
+        saved = float(parts[1]) if len(parts) > 1 else 0.0
+        if time.time() - saved > ttl:
+            return None
+        return parts[0]
+    except Exception:
+        return None
+
+
+def resolve_server(quick_subnet_scan: bool = True, subnets: Optional[List[str]] = None) -> Optional[str]:
     """
     Intenta obtener la IP del servidor en este orden:
       1) Hostname inventario.local
       2) Archivo server.txt
-      3) Caché local server_cache.txt
-      4) Escaneo rápido 192.168.1.x buscando /health
+      3) Caché local server_cache.txt (vigente por CACHE_TTL y si aún responde /health)
+      4) Descubrimiento concurrente en la LAN buscando /health
     """
 
     # 1. Hostname
@@ -143,25 +323,18 @@ def resolve_server(quick_subnet_scan: bool = True) -> Optional[str]:
         pass
 
     # 3. Caché
-    try:
-        if os.path.exists(SERVER_CACHE):
-            txt = open(SERVER_CACHE).read().strip()
-            if validate_ip(txt):
-                return txt
-    except Exception:
-        pass
+    cached = read_server_cache()
+    if cached and is_our_server(cached):
+        return cached
 
-    # 4. Escaneo LAN rápido
+    # 4. Descubrimiento en la LAN
     if quick_subnet_scan:
-        for i in range(1, 255):
-            target = f"192.168.1.{i}"
-            try:
-                r = requests.get(f"http://{target}:5000/health", timeout=0.25)
-                if r.status_code == 200:
-                    save_server_cache(target)
-                    return target
-            except Exception:
-                pass
+        start = time.monotonic()
+        found = discover_server(subnets)
+        if found:
+            print(f"[INFO] Servidor encontrado en {found} ({(time.monotonic() - start) * 1000:.0f} ms)")
+            save_server_cache(found)
+            return found
 
     return None
 
@@ -169,34 +342,169 @@ def resolve_server(quick_subnet_scan: bool = True) -> Optional[str]:
 # ---------------------------------------
 # ENVÍO DEL CÓDIGO AL SERVIDOR
 # ---------------------------------------
-def send_to_server(server_ip: str, code: str) -> bool:
-    """Envía el código recién leído al servidor Flask."""
-    url = f"http://{server_ip}:5000{PUSH_ENDPOINT}"
-    try:
-        r = requests.post(url, json={"code": code}, timeout=3)
-        return r.status_code == 200
-    except Exception:
-        return False
+class Outbox:
+    """
+    Bandeja de salida en SQLite: los códigos leídos quedan en disco hasta que
+    el servidor confirma que los recibió. Cada uno lleva un id propio que el
+    servidor usa para no publicarlo dos veces si un lote se reenvía.
+    """
 
+    def __init__(self, path: str = OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT UNIQUE NOT NULL,"
+            " code TEXT NOT NULL,"
+            " station TEXT,"
+            " scanned_at TEXT NOT NULL)"
+        )
+
+    def add(self, code: str, station: Optional[str]) -> int:
+        """Guarda un código; devuelve cuántos quedan pendientes."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending (id, code, station, scanned_at) VALUES (?, ?, ?, ?)",
+                (uuid.uuid4().hex, code, station, datetime.now().isoformat(timespec="milliseconds")),
+            )
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def add_many(self, items: List[Tuple[str, Optional[str]]]) -> int:
+        """Guarda varios (code, station) en una sola transacción; devuelve cuántos quedan pendientes."""
+        now = datetime.now().isoformat(timespec="milliseconds")
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO pending (id, code, station, scanned_at) VALUES (?, ?, ?, ?)",
+                    [(uuid.uuid4().hex, code, station, now) for code, station in items],
+                )
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def batch(self, limit: int = BATCH_SIZE) -> List[Tuple[str, str, Optional[str], str]]:
+        """Los `limit` códigos más antiguos: (id, code, station, scanned_at)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, code, station, scanned_at FROM pending ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+
+    def confirm(self, ids: List[str]):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in ids])
 
-# ---------------------------------------
-# LECTURA DEL ESCÁNER
-# ---------------------------------------
-def read_from_scanner_loop(port: str, server_ip: str, baud: int = BAUD, delay: float = 0.01, dtr_mode: str = 'auto'):
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+
+class Sender(threading.Thread):
     """
-    Lee del puerto serial carácter por carácter, arma líneas completas,
-    y envía cada código al servidor.
-    Mantiene el puerto abierto hasta que falle.
+    Hilo que vacía la bandeja hacia el servidor en lotes, por una sesión HTTP
+    con keep-alive. Si el servidor no responde, reintenta con espera
+    creciente (1 s a 30 s) sin tocar el hilo que lee el escáner. Con un
+    servidor viejo sin /push_scan/lote envía código por código a /push_scan.
     """
-    print(f"[INFO] Abriendo puerto serial {port} @ {baud}")
 
+    def __init__(self, server_ip: str, outbox: Outbox, batch_size: int = BATCH_SIZE):
+        super().__init__(name="sender", daemon=True)
+        self.base = f"http://{server_ip}:{SERVER_PORT}"
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        self.session.mount("http://", adapter)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._batch_supported = True
+
+    def notify(self):
+        """Avisa que hay códigos nuevos en la bandeja."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            rows = self.outbox.batch(self.batch_size)
+            if not rows:
+                self._wake.wait(5)
+                self._wake.clear()
+                continue
+            try:
+                sent = self._send(rows)
+            except Exception as e:
+                motivo = str(e) if isinstance(e, requests.HTTPError) else e.__class__.__name__
+                print(f"[ERR] Envío fallido ({motivo}); "
+                      f"{self.outbox.pending()} en bandeja, reintento en {backoff:.0f}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            self.outbox.confirm(sent)
+            print(f"[OK] Enviados {len(sent)} ✔ (pendientes: {self.outbox.pending()})")
+
+    def _send(self, rows) -> List[str]:
+        """
+        Envía un lote; devuelve los ids que el servidor ya tiene y pueden borrarse.
+        Cualquier error (incluido un 400, p. ej. "demasiadas estaciones en
+        uso") lanza excepción: los códigos quedan en la bandeja y se
+        reintentan; nunca se descartan.
+        """
+        if self._batch_supported:
+            done = []
+            # Un lote por estación (normalmente todos son de la misma)
+            for station in dict.fromkeys(r[2] for r in rows):
+                items = [{"id": i, "code": c, "ts": ts} for i, c, st, ts in rows if st == station]
+                r = self.session.post(self.base + BATCH_ENDPOINT, json={"estacion": station, "escaneos": items},
+                                      timeout=(3, 10))
+                if r.status_code == 404:
+                    print("[INFO] El servidor no tiene /push_scan/lote; se envía código por código.")
+                    self._batch_supported = False
+                    return done
+                check_response(r)
+                done += [it["id"] for it in items]
+                try:
+                    expired = len(r.json().get("vencidos") or [])
+                except Exception:
+                    expired = 0
+                if expired:
+                    # Escaneos que esperaron demasiado en la bandeja (p. ej. tras una caída)
+                    print(f"[INFO] {expired} escaneo(s) demasiado viejos; el servidor no los publicó.")
+            return done
+
+        done = []
+        for i, code, station, _ in rows:
+            r = self.session.post(self.base + PUSH_ENDPOINT, json={"code": code, "estacion": station}, timeout=(3, 10))
+            check_response(r)
+            done.append(i)
+        return done
+
+
+def check_response(r):
+    """Como `raise_for_status`, con el mensaje (`msg`) que manda el servidor."""
+    if r.status_code < 400:
+        return
     try:
-        ser = serial.Serial(port, baud, timeout=1)
-    except Exception as e:
-        print(f"[ERR] No se pudo abrir {port}: {e}")
-        return False
+        msg = r.json().get("msg")
+    except Exception:
+        msg = None
+    raise requests.HTTPError(f"HTTP {r.status_code}: {msg or r.reason}", response=r)
+
 
-    # Control de DTR (evita que algunos escáneres se apaguen)
+# ---------------------------------------
+# LECTURA DEL ESCÁNER
+# ---------------------------------------
+def apply_dtr(ser, dtr_mode: str):
+    """Control de DTR (evita que algunos escáneres se apaguen)."""
     try:
         if dtr_mode == 'off':
             try:
@@ -211,6 +519,24 @@ def read_from_scanner_loop(port: str, server_ip: str, baud: int = BAUD, delay: f
     except Exception:
         pass
 
+
+def read_from_scanner_loop(port: str, outbox: Outbox, sender: Sender, baud: int = BAUD, delay: float = 0.01,
+                           dtr_mode: str = 'auto', station: Optional[str] = None):
+    """
+    Lee del puerto serial carácter por carácter, arma líneas completas,
+    y guarda cada código en la bandeja de salida (el envío lo hace `sender`).
+    Mantiene el puerto abierto hasta que falle.
+    """
+    print(f"[INFO] Abriendo puerto serial {port} @ {baud}")
+
+    try:
+        ser = serial.Serial(port, baud, timeout=1)
+    except Exception as e:
+        print(f"[ERR] No se pudo abrir {port}: {e}")
+        return False
+
+    apply_dtr(ser, dtr_mode)
+
     buffer = ""
 
     try:
@@ -237,12 +563,9 @@ def read_from_scanner_loop(port: str, server_ip: str, baud: int = BAUD, delay: f
                 code = buffer.strip()
                 buffer = ""
                 if code:
-                    print(f"[SCAN] → {code}")
-                    ok = send_to_server(server_ip, code)
-                    if ok:
-                        print("[OK] Enviado ✔")
-                    else:
-                        print("[ERR] Error enviando al servidor (se reintentará).")
+                    pending = outbox.add(code, station)
+                    sender.notify()
+                    print(f"[SCAN] → {code} (en bandeja: {pending})")
                 continue
 
             buffer += char
@@ -256,35 +579,257 @@ def read_from_scanner_loop(port: str, server_ip: str, baud: int = BAUD, delay: f
     return False
 
 
+# ---------------------------------------
+# MODO ASYNC: VARIOS ESCÁNERES EN UN PROCESO
+# ---------------------------------------
+class PortReader:
+    """
+    Lector asyncio de un puerto: abre el puerto, entrega los códigos a la cola
+    compartida y, si el puerto falla, reconecta con espera creciente (1 s a
+    30 s) sin afectar a los demás puertos.
+
+    En Linux/macOS espera los datos con `loop.add_reader` sobre el descriptor
+    del puerto (sin hilos). En Windows los puertos COM no admiten eso, así
+    que cada lectura bloqueante (con timeout) corre en el pool de hilos del
+    loop.
+    """
+
+    MAX_LINE = 512  # bytes sin fin de línea: ruido, se descarta
+
+    def __init__(self, port: str, queue: "asyncio.Queue", station: Optional[str], baud: int = BAUD,
+                 dtr_mode: str = 'auto'):
+        self.port = port
+        self.queue = queue
+        self.station = station
+        self.baud = baud
+        self.dtr_mode = dtr_mode
+        self.connected = False
+        self.codes = 0
+        self.bytes = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self.last_code: Optional[str] = None
+
+    async def run(self):
+        backoff = 1.0
+        opened_before = False
+        while True:
+            try:
+                ser = await asyncio.to_thread(self._open)
+            except Exception as e:
+                self._error(e)
+                print(f"[ERR] {self.port}: no se pudo abrir ({e}); reintento en {backoff:.0f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            if opened_before:
+                self.reconnects += 1
+            opened_before = True
+            self.connected = True
+            backoff = 1.0
+            print(f"[INFO] {self.port}: abierto @ {self.baud}")
+            try:
+                await self._read(ser)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._error(e)
+                print(f"[ERR] {self.port}: fallo de lectura ({e}); reintento en {backoff:.0f}s")
+            finally:
+                self.connected = False
+                try:
+                    ser.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _open(self):
+        # Sin timeout (no bloqueante) cuando se espera con add_reader
+        ser = serial.Serial(self.port, self.baud, timeout=0.5 if os.name == 'nt' else 0)
+        apply_dtr(ser, self.dtr_mode)
+        return ser
+
+    def _error(self, e: Exception):
+        self.errors += 1
+        self.last_error = str(e)
+
+    async def _chunks(self, ser):
+        """Bloques de bytes leídos del puerto, sin bloquear el loop."""
+        loop = asyncio.get_running_loop()
+        if os.name == 'nt':
+            while True:
+                data = await loop.run_in_executor(None, lambda: ser.read(ser.in_waiting or 1))
+                if data:
+                    yield data
+        ready = asyncio.Event()
+        fd = ser.fileno()
+        loop.add_reader(fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                # Si el dispositivo se desconectó, pyserial lanza SerialException aquí
+                data = ser.read(ser.in_waiting or 1)
+                if data:
+                    yield data
+        finally:
+            loop.remove_reader(fd)
+
+    async def _read(self, ser):
+        buffer = bytearray()
+        async for data in self._chunks(ser):
+            self.bytes += len(data)
+            buffer += data
+            *lines, rest = re.split(rb"[\r\n]", bytes(buffer))
+            buffer = bytearray(rest)
+            if len(buffer) > self.MAX_LINE:
+                buffer.clear()
+                self.errors += 1
+            for line in lines:
+                code = line.decode("utf-8", errors="ignore").strip()
+                if code:
+                    self.codes += 1
+                    self.last_code = code
+                    await self.queue.put((code, self.station))
+
+    def stats(self) -> Dict:
+        return {
+            "port": self.port,
+            "connected": self.connected,
+            "codes": self.codes,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "last_code": self.last_code,
+            "last_error": self.last_error,
+        }
+
+
+async def outbox_pipeline(queue: "asyncio.Queue", outbox: Outbox, sender: Sender):
+    """Envío compartido: junta lo que haya en la cola y lo guarda en la bandeja en una sola transacción."""
+    while True:
+        items = [await queue.get()]
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        pending = await asyncio.to_thread(outbox.add_many, items)
+        sender.notify()
+        for code, _ in items:
+            print(f"[SCAN] → {code}")
+        print(f"[INFO] en bandeja: {pending}")
+
+
+async def run_async(ports: List[str], outbox: Outbox, sender: Sender, station: Optional[str], baud: int = BAUD,
+                    dtr_mode: str = 'auto', filter_text: Optional[str] = None, rescan: float = 5.0,
+                    stats_interval: float = 60.0):
+    """
+    Atiende varios escáneres en un solo proceso. Con `ports` vacío usa todos
+    los que detecta `scanner_ports` y vuelve a buscar cada `rescan` segundos
+    (escáneres conectados después o desconectados). Cada `stats_interval`
+    segundos imprime las estadísticas por puerto.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+    readers: Dict[str, PortReader] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+    pipeline = asyncio.create_task(outbox_pipeline(queue, outbox, sender))
+    fixed = bool(ports)
+    last_stats = time.monotonic()
+
+    try:
+        while True:
+            current = ports if fixed else await asyncio.to_thread(scanner_ports, filter_text)
+            for port in current:
+                if port not in tasks:
+                    print(f"[INFO] Escáner: {port}")
+                    readers[port] = PortReader(port, queue, station, baud, dtr_mode)
+                    tasks[port] = asyncio.create_task(readers[port].run())
+            for port in [p for p in tasks if p not in current]:
+                print(f"[INFO] Escáner desconectado: {port}")
+                tasks.pop(port).cancel()
+                readers.pop(port)
+            if not tasks:
+                print("[INFO] Esperando escáneres...")
+            if pipeline.done():
+                pipeline.result()  # propaga el error de la bandeja
+
+            if stats_interval and time.monotonic() - last_stats >= stats_interval:
+                last_stats = time.monotonic()
+                for r in readers.values():
+                    st = r.stats()
+                    print(f"[STATS] {st['port']}: {'conectado' if st['connected'] else 'desconectado'}, "
+                          f"{st['codes']} códigos, {st['errors']} errores, {st['reconnects']} reconexiones")
+            await asyncio.sleep(rescan)
+    finally:
+        for task in list(tasks.values()) + [pipeline]:
+            task.cancel()
+        await asyncio.gather(*tasks.values(), pipeline, return_exceptions=True)
+
+
 # ---------------------------------------
 # PROGRAMA PRINCIPAL
 # ---------------------------------------
 def main():
     parser = argparse.ArgumentParser(description="Serial Scanner Forwarder – Limpio y Documentado")
     parser.add_argument("--server", help="IP del servidor (sin http://). Si no, intenta autodetección.")
-    parser.add_argument("--port", help="Ej: COM3 o /dev/ttyUSB0. Si no, usar --auto.")
+    parser.add_argument("--port", action="append",
+                        help="Ej: COM3 o /dev/ttyUSB0 (repetible con --async). Si no, usar --auto.")
     parser.add_argument("--baud", type=int, default=9600)
     parser.add_argument("--auto", action="store_true", help="Detectar el puerto del escáner automáticamente.")
     parser.add_argument("--filter", help="Texto preferido para filtrar puertos (ej: USB)")
     parser.add_argument("--retries", type=int, default=5, help="Reintentos antes de salir (-1 = infinito).")
     parser.add_argument("--dtr", choices=["auto", "on", "off"], default="auto", help="Control DTR.")
+    parser.add_argument("--estacion",
+                        help="Estación donde se publican los códigos (ej: caja1). Por defecto, la principal.")
+    parser.add_argument("--subnet", action="append",
+                        help="Subred donde buscar el servidor (ej: 10.0.0.0/24). Repetible. "
+                             "Por defecto, la de esta PC y 192.168.1.0/24.")
+    parser.add_argument("--outbox", default=OUTBOX_FILE, help="Archivo SQLite de la bandeja de salida.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Atender todos los escáneres (--port repetido, o todos los detectados) en un proceso.")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="Segundos entre estadísticas por puerto en modo --async (0 = nunca).")
     args = parser.parse_args()
 
+    if args.estacion and not STATION_NAME.match(args.estacion.strip().lower()):
+        print("[FATAL] --estacion inválida: usa letras, números, '-', '_' o '.' (máx. 40).")
+        return
+
     # Resolver servidor
     server_ip = args.server
     if not server_ip:
         print("[INFO] Resolviendo servidor...")
-        server_ip = resolve_server()
+        server_ip = resolve_server(subnets=args.subnet)
 
     if not server_ip:
         print("[FATAL] No se encontró servidor.")
         print("Crea server.txt con la IP o proporciona --server.")
         return
 
-    print(f"[OK] Servidor detectado: http://{server_ip}:5000")
+    print(f"[OK] Servidor detectado: http://{server_ip}:{SERVER_PORT}")
+    if args.estacion:
+        print(f"[OK] Estación: {args.estacion} (abre las páginas con ?estacion={args.estacion})")
+    else:
+        print("[OK] Estación: principal")
+
+    # Bandeja de salida: lo que quedó pendiente de una ejecución anterior se envía primero
+    outbox = Outbox(args.outbox)
+    if outbox.pending():
+        print(f"[INFO] {outbox.pending()} códigos pendientes en {args.outbox}; se enviarán ahora.")
+    sender = Sender(server_ip, outbox)
+    sender.start()
+
+    if args.use_async:
+        try:
+            asyncio.run(run_async(args.port or [], outbox, sender, args.estacion, baud=args.baud,
+                                  dtr_mode=args.dtr, filter_text=args.filter,
+                                  stats_interval=args.stats_interval))
+        except KeyboardInterrupt:
+            pass
+        return
 
     # Resolver puerto serial
-    port = args.port
+    port = args.port[0] if args.port else None
     if args.auto and not port:
         print("[INFO] Detectando puerto del escáner...")
         port = detect_scanner_port(filter_text=args.filter, timeout=10)
@@ -297,7 +842,7 @@ def main():
     retries = args.retries
 
     while True:
-        ok = read_from_scanner_loop(port, server_ip, baud=args.baud, dtr_mode=args.dtr)
+        read_from_scanner_loop(port, outbox, sender, baud=args.baud, dtr_mode=args.dtr, station=args.estacion)
 
         if retries == 0:
             print("[FATAL] Demasiados reintentos. Saliendo.")
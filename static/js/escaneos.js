@@ -0,0 +1,121 @@
+// Cliente del flujo de escaneos del servidor.
+// Usa Server-Sent Events (/escaneos/stream) y, si el navegador no los soporta
+// o el servidor rechaza el flujo (503), cae a long-poll (/escaneos/esperar).
+// Mientras nadie escanea no se hace ninguna petición: el flujo queda abierto
+// con latidos, o el long-poll espera hasta 20 s en el servidor. Desde el
+// long-poll se vuelve a probar SSE cada minuto, y si el servidor está lleno
+// (503) se espera lo que pide `Retry-After`, duplicando la pausa hasta 2 min.
+//
+// Cada PC con escáner publica en su estación; la página escucha la estación
+// de `opciones.estacion`, o la de `?estacion=` en la URL (se recuerda en
+// localStorage para las páginas siguientes), o la principal.
+//
+//   const sub = suscribirEscaneos(code => { ... }, {base: SERVER});
+//   sub.cerrar();
+function estacionEscaneo(){
+    let estacion = null;
+    try{
+        estacion = new URLSearchParams(window.location.search).get('estacion');
+        if(estacion !== null) localStorage.setItem('estacionEscaneo', estacion);
+        else estacion = localStorage.getItem('estacionEscaneo');
+    }catch(e){}
+    return estacion || '';
+}
+
+function suscribirEscaneos(alEscanear, opciones){
+    opciones = opciones || {};
+    const base = opciones.base || '';
+    const estacion = opciones.estacion !== undefined ? opciones.estacion : estacionEscaneo();
+    const consulta = estacion ? 'estacion=' + encodeURIComponent(estacion) : '';
+    let cursor = null;
+    let activo = true;
+    let fuente = null;
+    let controlador = null;
+
+    function entregar(evento){
+        if(cursor !== null && evento.id <= cursor) return;
+        cursor = evento.id;
+        try{ alEscanear(evento.code, evento); }catch(e){ console.error(e); }
+    }
+
+    const REINTENTO_SSE = 60000;  // ms en long-poll antes de volver a probar SSE
+    const PAUSA_MAX = 120000;
+    const usarSSE = !!window.EventSource && !opciones.soloLongPoll;
+    let proximoSSE = 0;
+    let temporizador = null;
+
+    function pausa(ms){
+        // Con algo de azar para que las pestañas rechazadas no vuelvan todas a la vez
+        ms = ms * (0.8 + Math.random() * 0.4);
+        return new Promise(r => { temporizador = setTimeout(r, ms); });
+    }
+
+    function esperaPedida(r, previa){
+        const segundos = parseInt(r.headers.get('Retry-After'), 10);
+        const pedida = segundos > 0 ? segundos * 1000 : 3000;
+        return Math.min(Math.max(pedida, previa * 2), PAUSA_MAX);
+    }
+
+    async function longPoll(){
+        let espera = 0;
+        while(activo){
+            if(usarSSE && Date.now() >= proximoSSE){
+                abrirFlujo();
+                return;
+            }
+            try{
+                controlador = new AbortController();
+                const params = [consulta, cursor !== null ? 'cursor=' + cursor : ''].filter(Boolean).join('&');
+                const url = base + '/escaneos/esperar' + (params ? '?' + params : '');
+                const r = await fetch(url, {signal: controlador.signal, cache: 'no-store'});
+                if(!r.ok){
+                    espera = esperaPedida(r, espera);
+                    await pausa(espera);
+                    continue;
+                }
+                espera = 0;
+                const j = await r.json();
+                if(cursor === null){
+                    cursor = j.cursor;  // primera llamada: empezar desde ahora
+                } else {
+                    (j.eventos || []).forEach(entregar);
+                    if(j.cursor > cursor) cursor = j.cursor;
+                }
+            }catch(e){
+                if(!activo) return;
+                espera = Math.min(Math.max(3000, espera * 2), PAUSA_MAX);
+                await pausa(espera);
+            }
+        }
+    }
+
+    function abrirFlujo(){
+        const params = [consulta, cursor !== null ? 'cursor=' + cursor : ''].filter(Boolean).join('&');
+        fuente = new EventSource(base + '/escaneos/stream' + (params ? '?' + params : ''));
+        fuente.addEventListener('hola', e => {
+            const j = JSON.parse(e.data);
+            if(cursor === null || j.id > cursor) cursor = j.id;
+        });
+        fuente.addEventListener('escaneo', e => entregar(JSON.parse(e.data)));
+        fuente.onerror = () => {
+            // CLOSED = el servidor rechazó el flujo; si no, EventSource reintenta solo
+            if(fuente && fuente.readyState === EventSource.CLOSED){
+                fuente = null;
+                proximoSSE = Date.now() + REINTENTO_SSE;
+                if(activo) longPoll();
+            }
+        };
+    }
+
+    if(usarSSE) abrirFlujo();
+    else longPoll();
+
+    return {
+        cerrar(){
+            activo = false;
+            if(fuente){ fuente.close(); fuente = null; }
+            if(controlador) controlador.abort();
+            clearTimeout(temporizador);
+        }
+    };
+}